@@ -0,0 +1,475 @@
+import os
+import re
+import numpy as np
+from collections import Counter
+from qe_xml import get_xml_dir, read_data_file_schema
+from bands_utils import read_bands_file
+from resource_utils import read_pw_input
+from structure_utils import read_pw_input_structure, get_structure_fingerprint
+from wannier_utils import read_hr_file, read_compact_model, read_win_unit_cell, read_wout_spreads
+from qic import get_calculation_files, read_projections, clear_cache
+from file_utils import find_file, open_file
+
+
+# Utilities for the band gaps, band edges, effective masses and spin-orbit splittings of the band structures in the
+# projects created by init_calc.py, used by band_analytics.py, for the orbital character of the bands, used by
+# orbital_character.py, and for collecting the results of the projects, used by results_store.py.
+# These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# hbar^2 / (2 m_e) in eV angstrom^2, which converts the curvature of a band to an effective mass
+hbar_squared_over_2_electron_mass = 3.80998212
+
+# The band structure path of a pw.x input, with the number of points of every segment and the label in the comment
+k_path_regex_object = re.compile(r"^K_POINTS\s*\{?\s*crystal_b\s*\}?\s*\n\s*(\d+)\s*\n", re.MULTILINE | re.IGNORECASE)
+k_path_point_regex_object = re.compile(r"^\s*(\S+)\s+(\S+)\s+(\S+)\s+(\d+)\s*(?:!\s*(.*?))?\s*$")
+
+fermi_energy_regex_object = re.compile(r"the Fermi energy is\s+(-?\d+\.\d+)")
+
+# The largest energy difference (in eV) between bands which are counted as degenerate
+degeneracy_tolerance = 0.002
+
+# An atomic state in the header of the projwfc.x output, e.g. "state #   5: atom   1 (Mo ), wfc  3 (l=2 m= 1)"
+atomic_state_regex_object = re.compile(r"state #\s*(\d+): atom\s+(\d+) \((\w+)\s*\), wfc\s+\d+ \(l=(\d)")
+
+# The names of the orbitals by their angular momentum
+orbital_names = ("s", "p", "d", "f")
+
+# The smallest hopping (in eV) of a Wannier model counted in its range
+wannier_hopping_threshold = 0.001
+
+
+# Reads the Fermi energy of a project from the nscf calculation of the pdos (its XML output or standard output) or
+# from the scf calculation, in the same order as plot_pbands.py. Returns None if it is not found.
+def read_fermi_energy(project_dir, compound_name, spin_orbit=False):
+
+    flag = "_soc" if spin_orbit else ""
+    base_dir = os.path.join(project_dir, "spin_orbit") if spin_orbit else project_dir
+
+    xml_dir = get_xml_dir(os.path.join(base_dir, "pdos"), compound_name)
+    if find_file(xml_dir) is not None:
+        try:
+            fermi_energy = read_data_file_schema(xml_dir, read_eigenvalues=False)["fermi_energy"]
+            if fermi_energy is not None:
+                return fermi_energy
+        except ValueError:
+            pass
+
+    for output_dir in (os.path.join(base_dir, "pdos", f"{compound_name}_nscf{flag}.pw.out"),
+        os.path.join(base_dir, "scf", f"{compound_name}_scf{flag}.pw.out")):
+        if find_file(output_dir) is None:
+            continue
+
+        with open_file(output_dir, "r") as output_file:
+            fermi_energy_match = fermi_energy_regex_object.search(output_file.read())
+        if fermi_energy_match is not None:
+            return float(fermi_energy_match.group(1))
+
+    return None
+
+
+# Reads the k-points of the band structure path (K_POINTS crystal_b) of a pw.x input in the order of pw.x: the points
+# of every segment from its first high-symmetry point up to the next one, and the last high-symmetry point.
+# Returns the k-points in crystal coordinates and the labels of the high-symmetry points by their index, or None if
+# the input has no such path.
+def read_k_path(pw_input):
+
+    k_path_match = k_path_regex_object.search(pw_input)
+    if k_path_match is None:
+        return None
+
+    number_of_points = int(k_path_match.group(1))
+    point_lines = pw_input[k_path_match.end():].splitlines()[:number_of_points]
+    point_matches = [k_path_point_regex_object.match(line) for line in point_lines]
+    if None in point_matches:
+        return None
+
+    high_symmetry_points = np.array([[float(match.group(i)) for i in range(1, 4)] for match in point_matches])
+    segment_lengths = [int(match.group(4)) for match in point_matches[:-1]]
+
+    k_points = []
+    labels = dict()
+    for i, segment_length in enumerate(segment_lengths):
+        labels[len(k_points)] = point_matches[i].group(5) or f"P{i + 1}"
+        steps = np.arange(segment_length)[:, None] / max(segment_length, 1)
+        k_points.extend(high_symmetry_points[i] + steps * (high_symmetry_points[i + 1] - high_symmetry_points[i]))
+
+    labels[len(k_points)] = point_matches[-1].group(5) or f"P{number_of_points}"
+    k_points.append(high_symmetry_points[-1])
+
+    return np.array(k_points), labels
+
+
+# Finds the band edges of a band structure with the energies relative to the Fermi energy (one row per band and one
+# column per k-point). The bands completely below the Fermi energy are the valence bands. Returns None for metals
+# (a band crosses the Fermi energy). Otherwise returns the index of the highest valence band, the k-point indices of
+# the valence band maximum, the conduction band minimum and the smallest direct gap, and the gaps.
+def find_band_edges(energies):
+
+    below = np.max(energies, axis=1) < 0
+    above = np.min(energies, axis=1) > 0
+    if not np.all(below | above) or not np.any(below) or not np.any(above):
+        return None
+
+    valence_band = np.count_nonzero(below) - 1
+    valence_energies = energies[valence_band]
+    conduction_energies = energies[valence_band + 1]
+
+    vbm_index = np.argmax(valence_energies)
+    cbm_index = np.argmin(conduction_energies)
+    direct_gaps = conduction_energies - valence_energies
+    direct_gap_index = np.argmin(direct_gaps)
+
+    return {
+        "valence_band": valence_band,
+        "vbm_index": vbm_index,
+        "cbm_index": cbm_index,
+        "direct_gap_index": direct_gap_index,
+        "band_gap": conduction_energies[cbm_index] - valence_energies[vbm_index],
+        "direct_gap": direct_gaps[direct_gap_index]
+    }
+
+
+# Fits a parabola E = E0 + hbar^2 dk^2 / (2 m) to a band around its extremum, separately on both sides along the path
+# (the directions of the segments can differ) with the given number of points on every side, and returns the average
+# effective mass in units of the electron mass (negative for a maximum), or None if there are no points to fit.
+# The k-points are the distances along the path in 1/angstrom.
+def fit_effective_mass(band_energies, extremum_index, k_distances, fit_points):
+
+    masses = []
+    for direction in (-1, 1):
+        indices = extremum_index + direction * np.arange(1, fit_points + 1)
+        indices = indices[(indices >= 0) & (indices < len(band_energies))]
+
+        delta_k = k_distances[indices] - k_distances[extremum_index]
+        delta_energies = band_energies[indices] - band_energies[extremum_index]
+
+        # Stopping at a discontinuity of the path, where the same distance is repeated
+        if len(delta_k) == 0 or np.any(delta_k == 0):
+            continue
+
+        curvature = np.sum(delta_energies * delta_k**2) / np.sum(delta_k**4)
+        if curvature != 0:
+            masses.append(hbar_squared_over_2_electron_mass / curvature)
+
+    return float(np.mean(masses)) if len(masses) > 0 else None
+
+
+# Gets the label of the position of a k-point on the path: the label of its high-symmetry point or of its segment
+def get_k_point_label(k_index, labels):
+
+    if k_index in labels:
+        return labels[k_index]
+
+    label_indices = sorted(labels)
+    segment = np.searchsorted(label_indices, k_index)
+    return f"{labels[label_indices[segment - 1]]}-{labels[label_indices[segment]]}"
+
+
+# Calculates the spin-orbit splittings of the band edges at the given k-points. Without spin-orbit coupling, the
+# highest valence (lowest conduction) multiplet at a k-point is the group of bands degenerate with the valence (the
+# first conduction) band within the tolerance. With spin-orbit coupling, its d spin-degenerate bands become 2d bands
+# at the same edge, and the splitting is the energy range of these 2d bands: 0 for a Kramers pair (e.g. the valence
+# band of MoS2 at Gamma) and the splitting of the multiplet otherwise (e.g. at K, or the split-off band of a p
+# multiplet). Returns the valence and the conduction splittings, one per k-point.
+def get_spin_orbit_splittings(energies, valence_band, energies_soc, valence_band_soc, k_indices,
+    tolerance=degeneracy_tolerance):
+
+    valence_splittings = []
+    conduction_splittings = []
+    for k_index in k_indices:
+        valence_degeneracy = np.count_nonzero(np.abs(energies[:valence_band + 1, k_index]
+            - energies[valence_band, k_index]) <= tolerance)
+        conduction_degeneracy = np.count_nonzero(np.abs(energies[valence_band + 1:, k_index]
+            - energies[valence_band + 1, k_index]) <= tolerance)
+
+        valence_bands_soc = energies_soc[max(0, valence_band_soc + 1 - 2 * valence_degeneracy):valence_band_soc + 1,
+            k_index]
+        conduction_bands_soc = energies_soc[valence_band_soc + 1:valence_band_soc + 1 + 2 * conduction_degeneracy,
+            k_index]
+
+        # The multiplets cut off by the first or the last band have no splitting
+        valence_splittings.append(np.ptp(valence_bands_soc) if len(valence_bands_soc) == 2 * valence_degeneracy
+            else None)
+        conduction_splittings.append(np.ptp(conduction_bands_soc)
+            if len(conduction_bands_soc) == 2 * conduction_degeneracy else None)
+
+    return valence_splittings, conduction_splittings
+
+
+# Analyzes the band structures of a compound, without and with spin-orbit coupling: the band gap (direct or
+# indirect), the positions of the band edges, the effective masses of the holes and the electrons and, with spin-orbit
+# coupling, the splittings of the highest valence and the lowest conduction bands at the high-symmetry points, which
+# need the band structure without spin-orbit coupling on the same path.
+# Returns one row per band structure found. This is the task run by each worker process of band_analytics.py.
+def analyze_compound(project_dir, compound_name, fit_points):
+
+    rows = []
+    bands_without_soc = None  # The energies and the valence band without spin-orbit coupling
+    for spin_orbit in (False, True):
+        flag = "_soc" if spin_orbit else ""
+        pband_dir = os.path.join(project_dir, "spin_orbit", "projected_bands") if spin_orbit \
+            else os.path.join(project_dir, "projected_bands")
+
+        bands_dir = os.path.join(pband_dir, f"{compound_name}.bands.gnu")
+        if find_file(bands_dir) is None:
+            continue
+
+        row = {"compound": compound_name, "spin_orbit": spin_orbit}
+        rows.append(row)
+
+        fermi_energy = read_fermi_energy(project_dir, compound_name, spin_orbit)
+        if fermi_energy is None:
+            row["error"] = "Fermi energy not found"
+            continue
+
+        _, energies = read_bands_file(bands_dir)
+        energies = energies - fermi_energy
+        row.update({"fermi_energy": fermi_energy, "number_of_bands": len(energies), "number_of_k_points":
+            energies.shape[1]})
+
+        # The positions of the k-points from the path of the pw.x input, when it matches the band structure
+        k_path = None
+        pw_bands_input_dir = os.path.join(pband_dir, f"{compound_name}_bands{flag}.pw.in")
+        if find_file(pw_bands_input_dir) is not None:
+            with open_file(pw_bands_input_dir, "r") as pw_bands_input_file:
+                pw_bands_input = pw_bands_input_file.read()
+            k_path = read_k_path(pw_bands_input)
+            lattice_vectors = read_pw_input(pw_bands_input)["lattice_vectors"]
+
+        if k_path is None or len(k_path[0]) != energies.shape[1] or lattice_vectors is None:
+            row["error"] = "k-path not found in the pw.x input"
+            k_path = None
+
+        band_edges = find_band_edges(energies)
+        row["metal"] = band_edges is None
+        if band_edges is None:
+            row["band_gap"] = 0.0
+            continue
+
+        if not spin_orbit:
+            bands_without_soc = (energies, band_edges["valence_band"])
+
+        row.update({
+            "band_gap": band_edges["band_gap"],
+            "direct_gap": band_edges["direct_gap"],
+            "gap_type": "direct" if band_edges["vbm_index"] == band_edges["cbm_index"] else "indirect",
+            "vbm_energy": energies[band_edges["valence_band"], band_edges["vbm_index"]],
+            "cbm_energy": energies[band_edges["valence_band"] + 1, band_edges["cbm_index"]]
+        })
+
+        if k_path is None:
+            continue
+
+        k_points, labels = k_path
+        reciprocal_vectors = 2 * np.pi * np.linalg.inv(lattice_vectors).T
+        k_distances = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(k_points @ reciprocal_vectors, axis=0),
+            axis=1))])
+
+        for edge, index_key in (("vbm", "vbm_index"), ("cbm", "cbm_index"), ("direct_gap", "direct_gap_index")):
+            k_index = band_edges[index_key]
+            row[f"{edge}_k"] = " ".join(f"{coordinate:.4f}" for coordinate in k_points[k_index])
+            row[f"{edge}_location"] = get_k_point_label(k_index, labels)
+
+        hole_mass = fit_effective_mass(energies[band_edges["valence_band"]], band_edges["vbm_index"], k_distances,
+            fit_points)
+        electron_mass = fit_effective_mass(energies[band_edges["valence_band"] + 1], band_edges["cbm_index"],
+            k_distances, fit_points)
+        row["hole_mass"] = -hole_mass if hole_mass is not None else None
+        row["electron_mass"] = electron_mass
+
+        # The spin-orbit splittings of the band edges at the high-symmetry points, from the multiplets without
+        # spin-orbit coupling on the same path
+        if spin_orbit and bands_without_soc is not None \
+            and bands_without_soc[0].shape[1] == energies.shape[1]:
+            label_indices = sorted(labels)
+            valence_splittings, conduction_splittings = get_spin_orbit_splittings(*bands_without_soc, energies,
+                band_edges["valence_band"], label_indices)
+
+            for k_index, valence_splitting, conduction_splitting in zip(label_indices, valence_splittings,
+                conduction_splittings):
+                row[f"soc_vb_splitting_{labels[k_index]}"] = valence_splitting
+                row[f"soc_cb_splitting_{labels[k_index]}"] = conduction_splitting
+
+    return rows
+
+
+# Groups the atomic states of a kpdos calculation by element (e.g. "Mo"), by element and orbital (e.g. "Mo-d") or by
+# atom and orbital (e.g. "Mo1-d"), from the table of atomic states in the header of the projwfc.x output.
+# Returns the names of the groups and the index of the group of every atomic state.
+def get_orbital_groups(kpdos_header, group_by="orbital"):
+
+    group_names = []
+    state_groups = []
+    for state_match in atomic_state_regex_object.finditer(kpdos_header):
+        atom, element, angular_momentum = int(state_match.group(2)), state_match.group(3), int(state_match.group(4))
+
+        if group_by == "element":
+            group_name = element
+        elif group_by == "atom":
+            group_name = f"{element}{atom}-{orbital_names[angular_momentum]}"
+        else:
+            group_name = f"{element}-{orbital_names[angular_momentum]}"
+
+        if group_name not in group_names:
+            group_names.append(group_name)
+        state_groups.append(group_names.index(group_name))
+
+    return group_names, np.array(state_groups)
+
+
+# Sums the weights of the atomic states (in the last axis) per group, at once for all the k-points and bands
+def sum_group_weights(weights, state_groups, number_of_groups):
+
+    group_matrix = np.zeros((len(state_groups), number_of_groups))
+    group_matrix[np.arange(len(state_groups)), state_groups] = 1
+
+    return weights @ group_matrix
+
+
+# Classifies the orbital character of every k-point and band from the weights of the atomic states (one row per
+# k-point, one column per band and one layer per atomic state): the weights are summed per group and normalized, and
+# the dominant group, its share of the weight and the entropy of the shares (in nats, 0 for a single group and
+# ln(number of groups) for equal shares) are found at once for all the k-points and bands. The total weight is the
+# projectability of the band onto the atomic states. Bands without any weight get the group -1.
+def classify_orbital_character(weights, state_groups, number_of_groups):
+
+    group_weights = sum_group_weights(weights, state_groups, number_of_groups)
+
+    total_weights = np.sum(group_weights, axis=2)
+    shares = np.divide(group_weights, total_weights[:, :, None], out=np.zeros_like(group_weights),
+        where=total_weights[:, :, None] > 0)
+
+    dominant_groups = np.where(total_weights > 0, np.argmax(shares, axis=2), -1)
+    dominant_shares = np.max(shares, axis=2)
+    entropies = -np.sum(shares * np.log(np.where(shares > 0, shares, 1)), axis=2)
+
+    return {
+        "dominant_groups": dominant_groups,
+        "dominant_shares": dominant_shares,
+        "entropies": entropies,
+        "total_weights": total_weights
+    }
+
+
+# Gets the chemical formula of a structure from its atomic labels, in the order of their first appearance (e.g. MoS2)
+def get_chemical_formula(atomic_labels):
+    return "".join(f"{label}{count if count > 1 else ''}" for label, count in Counter(atomic_labels).items())
+
+
+# Collects the results of a compound for the results store (see results_store.py), without and with spin-orbit
+# coupling: the structure of the scf input, the Fermi energy, the bands and their gaps, the projected weights summed
+# per group of atomic states (see get_orbital_groups) and the spreads and hoppings of the Wannier functions.
+# Returns one row per spin-orbit flag with any of these results. A row with a file which cannot be read gets the
+# error instead of the rest of its results. This is the task run by each worker process of results_store.py.
+def collect_results(project_dir, compound_name, group_by="orbital"):
+
+    rows = []
+    for spin_orbit in (False, True):
+        flag = "_soc" if spin_orbit else ""
+        base_dir = os.path.join(project_dir, "spin_orbit") if spin_orbit else project_dir
+        calculation_files = get_calculation_files(compound_name, os.path.dirname(project_dir), spin_orbit)
+
+        scf_input_dir = os.path.join(base_dir, "scf", f"{compound_name}_scf{flag}.pw.in")
+        wannier_seed_dir = os.path.join(base_dir, "wannier", f"{compound_name}_wannier{flag}")
+        wannier_hamiltonian_dir = calculation_files["compact_wannier_hamiltonian"] \
+            if find_file(calculation_files["compact_wannier_hamiltonian"]) is not None \
+            else calculation_files["wannier_hamiltonian"]
+
+        found_files = {name: find_file(file_dir) is not None for name, file_dir in (("structure", scf_input_dir),
+            ("bands", calculation_files["bands"]), ("projections", calculation_files["kpdos_output"]),
+            ("wannier_hamiltonian", wannier_hamiltonian_dir), ("wannier_output", f"{wannier_seed_dir}.wout"))}
+        if not any(found_files.values()):
+            continue
+
+        row = {"compound": compound_name, "spin_orbit": spin_orbit}
+        rows.append(row)
+
+        try:
+            fermi_energy = read_fermi_energy(project_dir, compound_name, spin_orbit)
+            row["fermi_energy"] = fermi_energy
+
+            lattice_vectors = None
+            if found_files["structure"]:
+                with open_file(scf_input_dir, "r") as scf_input_file:
+                    structure = read_pw_input_structure(scf_input_file.read())
+
+                if structure is not None:
+                    lattice_vectors = structure["lattice_vectors"]
+                    row.update({
+                        "formula": get_chemical_formula(structure["atomic_labels"]),
+                        "number_of_atoms": len(structure["atomic_labels"]),
+                        "volume": abs(np.linalg.det(lattice_vectors)),
+                        "fingerprint": get_structure_fingerprint(lattice_vectors, structure["atomic_labels"],
+                            structure["fractional_positions"]),
+                        "atomic_labels": " ".join(structure["atomic_labels"]),
+                        "lattice_vectors": lattice_vectors,
+                        "fractional_positions": structure["fractional_positions"]
+                    })
+
+            if found_files["bands"]:
+                k_distances, energies = read_bands_file(calculation_files["bands"])
+                energies = energies - (fermi_energy if fermi_energy is not None else 0.0)
+                row.update({
+                    "number_of_bands": len(energies),
+                    "number_of_k_points": energies.shape[1],
+                    "band_k_distances": k_distances.astype(np.float32),
+                    "band_energies": energies.astype(np.float32)
+                })
+
+                # The gaps are only meaningful relative to the Fermi energy
+                if fermi_energy is not None:
+                    band_edges = find_band_edges(energies)
+                    row["metal"] = band_edges is None
+                    row["band_gap"] = band_edges["band_gap"] if band_edges is not None else 0.0
+                    row["direct_gap"] = band_edges["direct_gap"] if band_edges is not None else 0.0
+
+            # The weights are stored with one row per band like the bands
+            if found_files["projections"]:
+                projections = read_projections(calculation_files["kpdos_output"], calculation_files["atomic_proj"])
+                group_names, state_groups = get_orbital_groups(projections["header"], group_by)
+                group_weights = sum_group_weights(projections["weights"], state_groups, len(group_names))
+                row["projection_groups"] = " ".join(group_names)
+                row["projected_weights"] = np.transpose(group_weights, (1, 0, 2)).astype(np.float32)
+
+            if found_files["wannier_hamiltonian"]:
+                wannier_model = read_compact_model(wannier_hamiltonian_dir) \
+                    if wannier_hamiltonian_dir.endswith(".npz") else read_hr_file(wannier_hamiltonian_dir)
+                hopping_sizes = np.max(np.abs(wannier_model["hamiltonian"]), axis=(1, 2))
+                row["number_of_wannier_functions"] = wannier_model["number_of_wannier_functions"]
+                row["wannier_hoppings"] = int(np.count_nonzero(wannier_model["hamiltonian"]))
+
+                # The threshold and the cutoff of the models truncated by hr_convert.py (0 and None otherwise)
+                row["wannier_threshold"] = wannier_model.get("threshold", 0.0)
+                row["wannier_cutoff"] = wannier_model.get("cutoff")
+
+                # The distance between the furthest unit cells with a hopping larger than the threshold
+                unit_cell = read_win_unit_cell(f"{wannier_seed_dir}.win")
+                unit_cell = unit_cell if unit_cell is not None else lattice_vectors
+                if unit_cell is not None:
+                    distances = np.linalg.norm(wannier_model["lattice_vectors"] @ unit_cell, axis=1)
+                    row["wannier_hopping_range"] = float(np.max(distances[hopping_sizes >= wannier_hopping_threshold],
+                        initial=0.0))
+
+            if found_files["wannier_output"]:
+                wannier_spreads = read_wout_spreads(f"{wannier_seed_dir}.wout")
+                if wannier_spreads is not None:
+                    row.update({
+                        "wannier_spread": wannier_spreads["omega_total"],
+                        "wannier_omega_i": wannier_spreads["omega_i"],
+                        "wannier_omega_d": wannier_spreads["omega_d"],
+                        "wannier_omega_od": wannier_spreads["omega_od"],
+                        "wannier_spreads": wannier_spreads["spreads"],
+                        "wannier_centres": wannier_spreads["centres"]
+                    })
+
+        except (ValueError, IndexError, KeyError, OSError) as e:
+            row.clear()
+            row.update({"compound": compound_name, "spin_orbit": spin_orbit, "error": f"{type(e).__name__}: {e}"})
+
+    # The readers of qic keep every result in memory, which is not needed once the compound is collected
+    clear_cache()
+
+    return rows
@@ -0,0 +1,108 @@
+import os
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from file_utils import atomic_output, list_compound_names, get_process_context
+from analysis_utils import analyze_compound
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python band_analytics.py [<compound name> ...] [--output FILE] [--fit-points N] [--parallel [N]]
+#
+# Analyzes the band structures (bands.gnu, possibly compressed) of the given compounds, or of all the compounds in the
+# root directory if none is given, without and with spin-orbit coupling. For every band structure, the band gap and the
+# smallest direct gap, whether the gap is direct or indirect, the energies and positions (in crystal coordinates and
+# on the path) of the valence band maximum and the conduction band minimum, the parabolic effective masses of the holes
+# and the electrons along the path and, with spin-orbit coupling, the splittings of the highest valence and the lowest
+# conduction bands at the high-symmetry points are written to one CSV file (band_analytics.csv in the root directory
+# by default). The energies are in eV relative to the Fermi energy and the masses in units of the electron mass.
+#
+# The positions of the k-points are taken from the path of the pw.x input of the bands calculation. The spin-orbit
+# splitting of a band edge at a k-point is the energy range of the 2d spin-orbit bands coming from the d degenerate
+# bands of the edge without spin-orbit coupling (0 for a Kramers pair), so it needs both band structures on the same
+# path. The compounds are analyzed in parallel with --parallel.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Analyzes the band gaps and band edges of the band structures.")
+parser.add_argument("compound_names", nargs="*", metavar="compound_name",
+    help="the names of the compounds of interest (all the compounds if none is given)")
+parser.add_argument("--output", default=None, metavar="FILE",
+    help="the CSV file to write (default: band_analytics.csv in the root directory of the projects)")
+parser.add_argument("--fit-points", type=int, default=4, metavar="N",
+    help="fit the effective masses to N points on every side of the band edges (default: 4)")
+parser.add_argument("--parallel", type=int, nargs="?", const=os.cpu_count(), default=None, metavar="N",
+    help="analyze the compounds with N processes (all cores if N is not given)")
+args = parser.parse_args()
+
+if args.parallel is not None and args.parallel < 1:
+    parser.error("the number of processes of --parallel must be at least 1")
+
+print("Initializing...\n", flush=True)
+
+root_dir = os.path.abspath("../")  # The root directory of the projects
+analytics_output_dir = args.output if args.output is not None else os.path.join(root_dir, "band_analytics.csv")
+
+# Taking all the project directories if no compound is given, except for the directory of the toolkit itself
+compound_names = args.compound_names
+if len(compound_names) == 0:
+    compound_names = list_compound_names(root_dir)
+
+# The columns of the table. The columns of the spin-orbit splittings are added for the high-symmetry points found.
+info_columns = ["compound", "spin_orbit", "fermi_energy", "number_of_bands", "number_of_k_points", "metal",
+    "band_gap", "direct_gap", "gap_type", "vbm_energy", "vbm_k", "vbm_location", "cbm_energy", "cbm_k", "cbm_location",
+    "direct_gap_k", "direct_gap_location", "hole_mass", "electron_mass", "error"]
+
+# ANALYZING THE BAND STRUCTURES
+# ============================================================================================================================
+
+print(f"Analyzing the band structures of {len(compound_names)} compounds\
+{f' with {args.parallel} processes' if args.parallel is not None else ''}...\n", flush=True)
+
+analytics_table = []
+
+if args.parallel is None:
+    for compound_name in compound_names:
+        analytics_table += analyze_compound(os.path.join(root_dir, compound_name), compound_name, args.fit_points)
+
+else:
+    with ProcessPoolExecutor(max_workers=args.parallel, mp_context=get_process_context()) as executor:
+        for rows in executor.map(analyze_compound, [os.path.join(root_dir, name) for name in compound_names],
+            compound_names, [args.fit_points] * len(compound_names), chunksize=16):
+            analytics_table += rows
+
+splitting_columns = []
+for row in analytics_table:
+    for column in row:
+        if column not in info_columns and column not in splitting_columns:
+            splitting_columns.append(column)
+
+# Printing a summary of the band structures
+print(f"{'compound':<20} {'SOC':>4} {'gap (eV)':>9} {'type':>9} {'VBM at':>10} {'CBM at':>10} {'m_h':>7} {'m_e':>7}")
+for row in analytics_table:
+    if "error" in row and "band_gap" not in row:
+        print(f"{row['compound']:<20} {'yes' if row['spin_orbit'] else 'no':>4}  {row['error']}")
+        continue
+
+    masses = [f"{row[key]:.3f}" if row.get(key) is not None else "-" for key in ("hole_mass", "electron_mass")]
+    print(f"{row['compound']:<20} {'yes' if row['spin_orbit'] else 'no':>4} {row['band_gap']:>9.3f} \
+{row.get('gap_type', 'metal'):>9} {row.get('vbm_location', '-'):>10} {row.get('cbm_location', '-'):>10} \
+{masses[0]:>7} {masses[1]:>7}")
+
+# WRITING THE TABLE
+# ============================================================================================================================
+
+print(f"\nWriting {len(analytics_table)} band structures to {analytics_output_dir}...")
+
+with atomic_output(analytics_output_dir) as temp_analytics_output_dir:
+    with open(temp_analytics_output_dir, "w", newline="") as analytics_output_file:
+        csv_writer = csv.DictWriter(analytics_output_file, fieldnames=info_columns + splitting_columns, restval="")
+        csv_writer.writeheader()
+        csv_writer.writerows(analytics_table)
+
+print("Done.")
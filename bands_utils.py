@@ -0,0 +1,76 @@
+import os
+import re
+import numpy as np
+from file_utils import file_lock, atomic_output, find_file, open_file
+
+
+# Utilities for the band structure data shared by plot_pbands.py and compare_bands.py.
+# These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The energy (in eV) by which the energy window is extended on both sides when selecting the bands
+energy_window_margin = 0.5
+
+
+# Finds the bands which enter the energy window (plus a margin) anywhere along the k-path.
+# The energies are relative to the Fermi energy with one row per band and one column per k-point.
+# A band is kept if its energy range overlaps the window, so bands crossing it between two k-points are kept too.
+def find_bands_in_window(energies, energy_window, margin=energy_window_margin):
+
+    lower_bound = energy_window[0] - margin
+    upper_bound = energy_window[1] + margin
+
+    return np.flatnonzero((np.max(energies, axis=1) >= lower_bound) & (np.min(energies, axis=1) <= upper_bound))
+
+
+# A blank line (or a run of blank lines) between two bands of a bands.gnu or _band.dat file
+band_separator_regex_object = re.compile(rb"\n[ \t\r]*\n(?:[ \t\r]*\n)*")
+
+
+# Reads a band structure file with one block of (k, E) lines per band, separated by blank lines, such as the
+# bands.gnu file of bands.x or the _band.dat file of Wannier90. The blocks are counted from the separators and
+# all the numbers are converted at once, so repeated k-points (e.g. at the discontinuities of the path) are kept.
+# Returns the k-points and the energies with one row per band. The result is cached in a binary .npz file next to
+# the band structure file, which is reused as long as the size and the modification time of the file do not change.
+# The cache is written atomically while holding its lock, so concurrent jobs never read a partially written cache.
+def read_bands_file(bands_dir):
+
+    bands_cache_dir = f"{bands_dir}.cache.npz"
+
+    with file_lock(bands_cache_dir):
+        return read_or_cache_bands_file(bands_dir, bands_cache_dir)
+
+
+# Reads a band structure file from its cache if it is up to date, or parses and caches it otherwise
+def read_or_cache_bands_file(bands_dir, bands_cache_dir):
+
+    # The file can be compressed (.gz, .xz or .zst)
+    bands_file_stat = os.stat(find_file(bands_dir) or bands_dir)
+    bands_file_signature = f"{bands_file_stat.st_size}:{bands_file_stat.st_mtime_ns}"
+
+    if os.path.exists(bands_cache_dir):
+        with np.load(bands_cache_dir) as bands_cache:
+            if str(bands_cache["signature"]) == bands_file_signature:
+                print(f"Using the cached bands data in {os.path.basename(bands_cache_dir)}...")
+                return bands_cache["k_points"], bands_cache["energies"]
+
+    with open_file(bands_dir, "rb") as bands_file:
+        bands_file_content = bands_file.read().strip()
+
+    number_of_bands = len(band_separator_regex_object.findall(bands_file_content)) + 1
+    bands_data = np.fromstring(bands_file_content, sep=" ")
+
+    # Every band must have the same number of k-points with 2 columns each
+    if len(bands_data) % (2 * number_of_bands) != 0:
+        raise ValueError(f"The bands in {bands_dir} do not have the same number of k-points")
+
+    bands_data = bands_data.reshape(number_of_bands, -1, 2)
+    k_points = bands_data[0, :, 0]
+    energies = bands_data[:, :, 1]
+
+    with atomic_output(bands_cache_dir) as temp_bands_cache_dir:
+        np.savez(temp_bands_cache_dir, signature=bands_file_signature, k_points=k_points, energies=energies)
+
+    return k_points, energies
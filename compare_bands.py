@@ -1,13 +1,18 @@
 import os
-from sys import argv
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 import re
+from qe_xml import read_xml_metadata
+from bands_utils import energy_window_margin, find_bands_in_window, read_bands_file
+from file_utils import atomic_output, open_file
 
 
 # Usage: the following python script should be run with command line arguments in the following way:
 #
-# python compare_bands.py <compound name>
+# python compare_bands.py <compound name> [--window EMIN EMAX] [--margin M]
+#
+# Only the bands entering the energy window (-5 to 2 eV around the Fermi energy by default) plus a margin are kept.
+# The outputs can be compressed (.gz, .xz or .zst).
 #
 # For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
 
@@ -15,11 +20,21 @@ import re
 # INITIALIZATION
 # ===========================================================================================================================================
 
+parser = argparse.ArgumentParser(description="Compares the Wannier interpolated bands of a compound with DFT.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--window", type=float, nargs=2, default=[-5.0, 2.0], metavar=("EMIN", "EMAX"),
+    help="the plotted energy window relative to the Fermi energy in eV (default: -5 2)")
+parser.add_argument("--margin", type=float, default=energy_window_margin, metavar="M",
+    help=f"keep the bands within M eV of the energy window too (default: {energy_window_margin})")
+args = parser.parse_args()
+
 print("Initializing...\n", flush=True)
 
-compound_name = argv[1]  # Taking the name of the compound of interest
+compound_name = args.compound_name  # Taking the name of the compound of interest
+energy_window = args.window  # The plotted energy window relative to the Fermi energy
+energy_window_margin = args.margin  # The bands within this distance of the energy window are kept
 root_dir = os.path.abspath("../")  # The root directory of the project
-project_dir = os.path.join(root_dir, argv[1])  # The calculation directory
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
 
 # Directory of projected bands calculation
 pbands_dir_list = [
@@ -49,45 +64,60 @@ for wannier_dir, pband_dir, flag in zip(wannier_dir_list, pbands_dir_list, spin_
 fermi_energy_list = [] # List of Fermi energies for spin-orbit and non spin-orbit case
 alat_parameter_list = [] # List of alat parmaeters for spin-orbit and non spin-orbit case
 skip_normal = False  # Flag to dermine whether non spin-orbit coupling case should be skipped
-for wannier_nscf_output_dir, flag in zip(wannier_nscf_output_dir_list, spin_orbit_flag):
+for wannier_nscf_output_dir, wannier_dir, pband_dir, flag in zip(wannier_nscf_output_dir_list, wannier_dir_list,
+pbands_dir_list, spin_orbit_flag):
 
     print("Getting alat parameter...\n", flush=True)
-    print(f"Reading {compound_name}_nscf_wannier{flag}.pw.out...\n", flush=True)
     try:
 
-        # Reading the output of Quantum ESPRESSO nscf calculation
-        nscf_output_file = open(wannier_nscf_output_dir, "r")
-        nscf_calculation_output = nscf_output_file.read()
-        nscf_output_file.close()
-
-        # Getting fermi energy from the calculation output
-        alat_parameter_regex_pattern = r"celldm\(1\)=\s+(\d\.\d+)"
-        alat_parameter_regex_object = re.compile(alat_parameter_regex_pattern)
-        alat_parameter_match = alat_parameter_regex_object.finditer(nscf_calculation_output)
+        # Preferring the XML output of the nscf calculation over the standard output
+        xml_metadata = read_xml_metadata(wannier_dir, compound_name)
 
-        if alat_parameter_match is not None:
-            alat_parameter = float(next(alat_parameter_match).group(1)) * 0.529177  # Converting bohr to angstrom
+        if xml_metadata is not None and xml_metadata["fermi_energy"] is not None:
+            alat_parameter = xml_metadata["alat"]
             alat_parameter_list.append(alat_parameter)
+            print(f"Alat parameter extracted successfully. Alat parameter is {alat_parameter} Angstrom.\n")
+
+            fermi_energy = xml_metadata["fermi_energy"]
+            fermi_energy_list.append(fermi_energy)
+            print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n", flush=True)
+
         else:
-            print("FATAL ERROR: Alat parameter not found!")
-            exit(1)
+            print(f"Reading {compound_name}_nscf_wannier{flag}.pw.out...\n", flush=True)
 
-        print(f"Alat parameter extracted successfully. Alat parameter is {alat_parameter} Angstrom.\n")
+            # Reading the output of Quantum ESPRESSO nscf calculation
+            nscf_output_file = open_file(wannier_nscf_output_dir, "r")
+            nscf_calculation_output = nscf_output_file.read()
+            nscf_output_file.close()
 
-        print("Getting Fermi energy...\n", flush=True)
+            # Getting fermi energy from the calculation output
+            alat_parameter_regex_pattern = r"celldm\(1\)=\s+(\d\.\d+)"
+            alat_parameter_regex_object = re.compile(alat_parameter_regex_pattern)
+            alat_parameter_match = alat_parameter_regex_object.finditer(nscf_calculation_output)
 
-        # Getting the number of calculated bands from the calculation output
-        Fermi_energy_regex_pattern = r"the Fermi energy is\s+(-?\d\.\d+)"
-        Fermi_energy_regex_object = re.compile(Fermi_energy_regex_pattern)
-        Fermi_energy_match = Fermi_energy_regex_object.finditer(nscf_calculation_output)
+            if alat_parameter_match is not None:
+                alat_parameter = float(next(alat_parameter_match).group(1)) * 0.529177  # Converting bohr to angstrom
+                alat_parameter_list.append(alat_parameter)
+            else:
+                print("FATAL ERROR: Alat parameter not found!")
+                exit(1)
 
-        if Fermi_energy_match is not None:
-            fermi_energy = float(next(Fermi_energy_match).group(1))  # Accessing the value of the iterator
-            fermi_energy_list.append(fermi_energy)
-            print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n", flush=True)
-        else:
-            print("FATAL ERROR: Fermi energy not found!")
-            exit(1)
+            print(f"Alat parameter extracted successfully. Alat parameter is {alat_parameter} Angstrom.\n")
+
+            print("Getting Fermi energy...\n", flush=True)
+
+            # Getting the number of calculated bands from the calculation output
+            Fermi_energy_regex_pattern = r"the Fermi energy is\s+(-?\d\.\d+)"
+            Fermi_energy_regex_object = re.compile(Fermi_energy_regex_pattern)
+            Fermi_energy_match = Fermi_energy_regex_object.finditer(nscf_calculation_output)
+
+            if Fermi_energy_match is not None:
+                fermi_energy = float(next(Fermi_energy_match).group(1))  # Accessing the value of the iterator
+                fermi_energy_list.append(fermi_energy)
+                print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n", flush=True)
+            else:
+                print("FATAL ERROR: Fermi energy not found!")
+                exit(1)
         
         bands_dir_list.append(os.path.join(project_dir,
         os.path.join(pband_dir, f"{compound_name}.bands.gnu")))  # The plot output of Quantum ESPRESSO bands calculation
@@ -113,8 +143,6 @@ in the directory of the project.")
 # PREPROCESSING
 # ===========================================================================================================================================
 
-wannier_data_list = []  # List of wannier bands data
-DFT_data_list = []  # List of DFT bands data
 k_points_wannier_list = []  # List of kpoints for wannier calculation
 k_points_DFT_list = []  # List of kpoints for DFT calculation
 wannier_energies_list = []  # The energies column of wannier bands data
@@ -124,17 +152,17 @@ DFT_energies_list = []  # The energies column of DFT bands data
 for wannier_bands_dir, bands_dir, alat_parameter, fermi_energy in zip(wannier_bands_dir_list, bands_dir_list, 
 alat_parameter_list, fermi_energy_list):
     
-    wannier_data = np.loadtxt(wannier_bands_dir)
-    DFT_data = np.loadtxt(bands_dir)
+    k_points_wannier, wannier_energies = read_bands_file(wannier_bands_dir)
+    k_points_DFT, DFT_energies = read_bands_file(bands_dir)
 
-    k_points_wannier = np.unique(wannier_data[:, 0]) / ((2 * np.pi) / alat_parameter)
-    wannier_energies = np.reshape(wannier_data[:, 1], (-1, len(k_points_wannier))) - fermi_energy
+    k_points_wannier = k_points_wannier / ((2 * np.pi) / alat_parameter)
+    wannier_energies = wannier_energies - fermi_energy
+    DFT_energies = DFT_energies - fermi_energy
 
-    k_points_DFT = np.unique(DFT_data[:, 0])
-    DFT_energies = np.reshape(DFT_data[:, 1], (-1, len(k_points_DFT))) - fermi_energy
+    # Keeping only the bands which enter the energy window
+    wannier_energies = wannier_energies[find_bands_in_window(wannier_energies, energy_window, energy_window_margin)]
+    DFT_energies = DFT_energies[find_bands_in_window(DFT_energies, energy_window, energy_window_margin)]
         
-    wannier_data_list.append(wannier_data)
-    DFT_data_list.append(DFT_data)
     k_points_wannier_list.append(k_points_wannier)
     k_points_DFT_list.append(k_points_DFT)
     wannier_energies_list.append(wannier_energies)
@@ -143,6 +171,10 @@ alat_parameter_list, fermi_energy_list):
 # PLOTTING THE DATA
 # ===========================================================================================================================================
 
+# matplotlib is only imported once the data is ready to be plotted, since importing it is slow
+import matplotlib.pyplot as plt
+from plot_utils import get_compound_name_latex
+
 high_symmetry_k_points = [0.0000, 0.5774, 0.9107, 1.5774]
 
 k_labels = [r"$\Gamma$", r"$M$", r"$K$", r"$\Gamma$"]
@@ -150,27 +182,7 @@ k_labels = [r"$\Gamma$", r"$M$", r"$K$", r"$\Gamma$"]
 # Creating the LaTeX symbols for the comopound name to display in the plot
 # ----------------------------------------------------------------------------------------------------------------------------
 
-compound_name_regex_pattern = r"(([A-Z][a-z]?)(\d?))"
-compound_name_regex_object = re.compile(compound_name_regex_pattern)
-element_matches = compound_name_regex_object.finditer(compound_name)
-
-element_names = []
-element_numbers = []
-for element in element_matches:
-    element_names.append(element.group(2))
-    if element.group(3) == '':
-        element_numbers.append(1)
-    else:
-        element_numbers.append(int(element.group(3)))
-
-compound_name_latex = r'$'
-
-for i in range(len(element_names)):
-    compound_name_latex +=  r'{' + rf"{element_names[i]}" + r'}'
-    if element_numbers[i] != 1:
-        compound_name_latex += r'_' + r'{' + rf"{element_numbers[i]}" + r'}'
-
-compound_name_latex += r'$'
+compound_name_latex = get_compound_name_latex(compound_name)
 
 for k_points_DFT, DFT_energies, k_points_wannier, wannier_energies, flag in zip(k_points_DFT_list, DFT_energies_list, 
 k_points_wannier_list, wannier_energies_list, spin_orbit_flag):
@@ -197,7 +209,8 @@ k_points_wannier_list, wannier_energies_list, spin_orbit_flag):
     for band in range(len(DFT_energies)):
         plt.plot(k_points_DFT, DFT_energies[band, :], color="blue")
 
-    plt.ylim(-5, 2)
+    plt.ylim(energy_window)
     plt.legend(loc=(0.4, 0.6))
-    plt.savefig(os.path.join(project_dir, f"{compound_name}_wannier_compare_bands{flag}.png"))       
+    with atomic_output(os.path.join(project_dir, f"{compound_name}_wannier_compare_bands{flag}.png")) as temp_figure_dir:
+        plt.savefig(temp_figure_dir)
     plt.show()
@@ -0,0 +1,236 @@
+import os
+import argparse
+import re
+import numpy as np
+from qe_xml import read_xml_metadata
+from file_utils import atomic_output, find_file, open_file
+from wannier_utils import read_hr_file, read_compact_model, read_win_unit_cell, get_chunk_size, \
+    interpolate_wannier_bands_in_chunks, is_truncated_model
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python fermi_surface.py <compound name> [--soc] [--energies E ...] [--grid N] [--kz KZ] [--3d] [--chunk N]
+#                         [--parallel [N]]
+#
+# Calculates the Fermi surface (or the contours at other energies relative to the Fermi energy) from the Wannier
+# Hamiltonian (the compact _hr.npz file written by hr_convert.py if it exists, or the _hr.dat file), without another
+# nscf calculation. The bands are interpolated on a dense N x N grid of the plane kz (in crystal coordinates) of the
+# reciprocal cell centered at Gamma, in chunks of k-points which bound the memory, optionally with a process pool.
+#
+# The contours are plotted and written to <compound>_fermi_surface<flag>.npz in the project directory, with one row
+# per point: the index of the energy, the band, the index of the contour line and the cartesian k-point (in 1/angstrom).
+# With --3d, the bands are calculated on an N x N x N grid instead and written to a .bxsf file, which can be opened by
+# XCrySDen or FermiSurfer to draw the iso-energy surfaces.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Calculates Fermi surfaces and constant energy contours from Wannier90.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--soc", action="store_true", help="use the spin-orbit Wannier model")
+parser.add_argument("--energies", type=float, nargs="+", default=[0.0], metavar="E",
+    help="the energies of the contours relative to the Fermi energy in eV (default: 0)")
+parser.add_argument("--grid", type=int, default=300, metavar="N",
+    help="the number of k-points along every reciprocal lattice vector (default: 300, or 60 with --3d)")
+parser.add_argument("--kz", type=float, default=0.0, metavar="KZ",
+    help="the plane of the contours along the third reciprocal lattice vector in crystal coordinates (default: 0)")
+parser.add_argument("--3d", dest="three_dimensional", action="store_true",
+    help="calculate the bands on a 3D grid and write them to a .bxsf file")
+parser.add_argument("--chunk", type=int, default=None, metavar="N",
+    help="interpolate N k-points at a time (default: as many as fit in 64 MB)")
+parser.add_argument("--parallel", type=int, nargs="?", const=os.cpu_count(), default=None, metavar="N",
+    help="interpolate the chunks with N processes (all cores if N is not given)")
+args = parser.parse_args()
+
+print("Initializing...\n", flush=True)
+
+compound_name = args.compound_name  # Taking the name of the compound of interest
+flag = "_soc" if args.soc else ""
+root_dir = os.path.abspath("../")  # The root directory of the project
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
+wannier_dir = os.path.join(project_dir, "spin_orbit/wannier" if args.soc else "wannier")
+seedname = os.path.join(wannier_dir, f"{compound_name}_wannier{flag}")
+
+# The default grids give similar numbers of k-points in 2D and 3D
+grid_size = args.grid
+if args.three_dimensional and grid_size == parser.get_default("grid"):
+    grid_size = 60
+
+# Getting the Fermi energy and the unit cell
+# ----------------------------------------------------------------------------------------------------------------------------
+
+print("Getting the Fermi energy...\n", flush=True)
+
+# Preferring the XML output of the nscf calculation over the standard output
+xml_metadata = read_xml_metadata(wannier_dir, compound_name)
+
+if xml_metadata is not None and xml_metadata["fermi_energy"] is not None:
+    fermi_energy = xml_metadata["fermi_energy"]
+else:
+    try:
+        with open_file(f"{os.path.join(wannier_dir, compound_name)}_nscf_wannier{flag}.pw.out", "r") as nscf_output_file:
+            fermi_energy_match = re.search(r"the Fermi energy is\s+(-?\d+\.\d+)", nscf_output_file.read())
+    except FileNotFoundError:
+        fermi_energy_match = None
+
+    if fermi_energy_match is None:
+        print(f"FATAL ERROR: Fermi energy not found in {compound_name}_nscf_wannier{flag}.pw.out!")
+        exit(1)
+    fermi_energy = float(fermi_energy_match.group(1))
+
+print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n", flush=True)
+
+# The unit cell (in angstrom) of the Wannier90 input, or of the XML output if there is no input
+unit_cell = read_win_unit_cell(f"{seedname}.win")
+if unit_cell is None and xml_metadata is not None and None not in xml_metadata["cell"]:
+    unit_cell = np.array(xml_metadata["cell"], dtype=float)
+if unit_cell is None:
+    print(f"FATAL ERROR: The unit cell was not found in {compound_name}_wannier{flag}.win or the XML output!")
+    exit(1)
+
+# The reciprocal lattice vectors (in 1/angstrom) as rows
+reciprocal_vectors = 2 * np.pi * np.linalg.inv(unit_cell).T
+
+# Reading the Wannier Hamiltonian
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Preferring the compact Hamiltonian of hr_convert.py, which loads much faster
+if os.path.exists(f"{seedname}_hr.npz"):
+    print(f"Reading {os.path.basename(seedname)}_hr.npz...\n", flush=True)
+    wannier_model = read_compact_model(f"{seedname}_hr.npz")
+
+    # The truncated models of hr_convert.py have approximate bands
+    if is_truncated_model(wannier_model):
+        cutoff = "no cutoff" if wannier_model["cutoff"] is None else f"a cutoff of {wannier_model['cutoff']} angstrom"
+        print(f"WARNING: The model was truncated by hr_convert.py with a threshold of {wannier_model['threshold']} eV \
+and {cutoff}. Convert the _hr.dat file again without --threshold and --cutoff to use the full model.\n", flush=True)
+elif find_file(f"{seedname}_hr.dat") is not None:
+    print(f"Reading {os.path.basename(seedname)}_hr.dat...\n", flush=True)
+    wannier_model = read_hr_file(f"{seedname}_hr.dat")
+else:
+    print(f"FATAL ERROR: {compound_name}_wannier{flag}_hr.dat does not exist. Set write_hr = true in the .win file.")
+    exit(1)
+
+# INTERPOLATING THE BANDS
+# ============================================================================================================================
+
+# The grids include both ends of the cell, so the contours and the surfaces are closed at its boundaries
+if args.three_dimensional:
+    grid_coordinates = [np.linspace(0, 1, grid_size + 1)] * 3
+else:
+    grid_coordinates = [np.linspace(-0.5, 0.5, grid_size + 1)] * 2 + [np.array([args.kz])]
+
+grid_shape = tuple(len(coordinates) for coordinates in grid_coordinates)
+k_points = np.stack(np.meshgrid(*grid_coordinates, indexing="ij"), axis=-1).reshape(-1, 3)
+
+chunk_size = args.chunk if args.chunk is not None else get_chunk_size(wannier_model["number_of_wannier_functions"])
+print(f"Interpolating {wannier_model['number_of_wannier_functions']} bands on {len(k_points)} k-points in chunks of \
+{chunk_size} k-points{f' with {args.parallel} processes' if args.parallel is not None else ''}...\n", flush=True)
+
+energies = interpolate_wannier_bands_in_chunks(wannier_model, k_points, chunk_size, args.parallel) - fermi_energy
+energies = energies.reshape(grid_shape + (-1,))
+
+# Keeping only the bands which cross one of the energies
+crossing_bands = [band for band in range(energies.shape[-1])
+    if any(np.min(energies[..., band]) <= energy <= np.max(energies[..., band]) for energy in args.energies)]
+
+print(f"The bands {', '.join(str(band + 1) for band in crossing_bands) or '(none)'} cross the energies \
+{', '.join(f'{energy:g}' for energy in args.energies)} eV.\n", flush=True)
+
+# WRITING THE FERMI SURFACE
+# ============================================================================================================================
+
+if args.three_dimensional:
+
+    # The bands crossing the energies in the BXSF format with the general grid (both ends included) and absolute energies
+    bxsf_dir = os.path.join(project_dir, f"{compound_name}_fermi_surface{flag}.bxsf")
+    bxsf_content = f'''BEGIN_INFO
+  # Generated by fermi_surface.py from the Wannier Hamiltonian of {compound_name}
+  Fermi Energy: {fermi_energy + args.energies[0]:.6f}
+END_INFO
+BEGIN_BLOCK_BANDGRID_3D
+  band_energies
+  BEGIN_BANDGRID_3D_wannier
+    {len(crossing_bands)}
+    {grid_shape[0]} {grid_shape[1]} {grid_shape[2]}
+    0.0 0.0 0.0
+'''
+    for reciprocal_vector in reciprocal_vectors:
+        bxsf_content += f"    {reciprocal_vector[0]:.8f} {reciprocal_vector[1]:.8f} {reciprocal_vector[2]:.8f}\n"
+
+    for band in crossing_bands:
+        band_energies = (energies[..., band] + fermi_energy).reshape(-1, grid_shape[2])
+        bxsf_content += f"    BAND: {band + 1}\n"
+        bxsf_content += "\n".join(" ".join(f"{energy:.5f}" for energy in line) for line in band_energies) + "\n"
+
+    bxsf_content += "  END_BANDGRID_3D\nEND_BLOCK_BANDGRID_3D\n"
+
+    with atomic_output(bxsf_dir) as temp_bxsf_dir:
+        with open(temp_bxsf_dir, "w") as bxsf_file:
+            bxsf_file.write(bxsf_content)
+
+    print(f"Wrote the Fermi surface at:\n {bxsf_dir}")
+    exit()
+
+# Extracting the contours of every band crossing the energies on the plane of the grid
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# contourpy is the contouring library of matplotlib
+import contourpy
+
+cartesian_k_points = k_points.reshape(grid_shape + (3,))[:, :, 0] @ reciprocal_vectors
+k_x, k_y = cartesian_k_points[..., 0], cartesian_k_points[..., 1]
+
+contour_rows = []  # The points of the contours: the energy index, the band, the line index, kx and ky
+contour_lines = []  # The contour lines with their energy index for plotting
+for energy_index, energy in enumerate(args.energies):
+    for band in crossing_bands:
+        contour_generator = contourpy.contour_generator(k_x, k_y, energies[:, :, 0, band])
+        for line_index, line in enumerate(contour_generator.lines(energy)):
+            contour_lines.append((energy_index, line))
+            contour_rows.append(np.column_stack([np.full((len(line), 3), (energy_index, band + 1, line_index)), line]))
+
+contour_data = np.vstack(contour_rows) if len(contour_rows) > 0 else np.empty((0, 5))
+
+contour_dir = os.path.join(project_dir, f"{compound_name}_fermi_surface{flag}.npz")
+with atomic_output(contour_dir) as temp_contour_dir:
+    with open(temp_contour_dir, "wb") as contour_file:
+        np.savez_compressed(contour_file, energies=np.array(args.energies), fermi_energy=fermi_energy, kz=args.kz,
+            reciprocal_vectors=reciprocal_vectors, contours=contour_data)
+
+print(f"Wrote {len(contour_lines)} contour lines at:\n {contour_dir}\n", flush=True)
+
+# PLOTTING THE CONTOURS
+# ============================================================================================================================
+
+# matplotlib is only imported once the data is ready to be plotted, since importing it is slow
+import matplotlib.pyplot as plt
+
+plt.style.use("ggplot")
+figure, axes = plt.subplots(figsize=(7, 7))
+
+# The boundary of the reciprocal cell of the grid, centered at Gamma
+cell_corners = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5], [-0.5, -0.5]]) @ reciprocal_vectors[:2, :2]
+axes.plot(cell_corners[:, 0], cell_corners[:, 1], color="black", linewidth=0.8)
+axes.plot(0, 0, "k.")
+axes.annotate(r"$\Gamma$", (0, 0), textcoords="offset points", xytext=(4, 4))
+
+colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+for energy_index, energy in enumerate(args.energies):
+    axes.plot([], [], color=colors[energy_index % len(colors)], label=f"E - E$_F$ = {energy:g} eV")
+for energy_index, line in contour_lines:
+    axes.plot(line[:, 0], line[:, 1], color=colors[energy_index % len(colors)], linewidth=1.2)
+
+axes.set_aspect("equal")
+axes.set_xlabel(r"k$_x$ (1/$\AA$)")
+axes.set_ylabel(r"k$_y$ (1/$\AA$)")
+axes.set_title(f"Constant energy contours of {compound_name}{' with spin-orbit coupling' if args.soc else ''}")
+axes.legend(loc="upper right")
+
+with atomic_output(os.path.join(project_dir, f"{compound_name}_fermi_surface{flag}.png")) as temp_figure_dir:
+    plt.savefig(temp_figure_dir)
+plt.show()
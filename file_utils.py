@@ -0,0 +1,161 @@
+import os
+import io
+import gzip
+import lzma
+import hashlib
+from contextlib import contextmanager
+
+
+# Utilities for reading the (possibly compressed) outputs, writing the files of the toolkit safely, listing the projects
+# and starting worker processes. These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# File locks are only available on POSIX systems. Elsewhere, the files are still written atomically but not locked.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The extensions of the compressed outputs which can be read directly, in the order they are looked for
+compressed_extensions = (".gz", ".xz", ".zst")
+
+
+# Finds a file or its compressed variant (e.g. "<file>.gz"), preferring the uncompressed file.
+# Returns None if none of them exists.
+def find_file(file_dir):
+
+    for extension in ("",) + compressed_extensions:
+        if os.path.exists(file_dir + extension):
+            return file_dir + extension
+
+    return None
+
+
+# Opens a file or its compressed variant for reading in text ("r") or binary ("rb") mode. Compressed files are
+# decompressed while they are read, so no decompressed copy is written to the disk.
+# Raises FileNotFoundError like open if none of them exists.
+def open_file(file_dir, mode="r"):
+
+    found_file_dir = find_file(file_dir)
+    if found_file_dir is None:
+        raise FileNotFoundError(f"No such file: '{file_dir}'")
+
+    if found_file_dir.endswith(".gz"):
+        return gzip.open(found_file_dir, mode if mode == "rb" else "rt")
+
+    if found_file_dir.endswith(".xz"):
+        return lzma.open(found_file_dir, mode if mode == "rb" else "rt")
+
+    if found_file_dir.endswith(".zst"):
+
+        # Zstandard is part of the standard library since Python 3.14 and is available as the zstandard package before
+        try:
+            from compression import zstd
+            zstd_file = zstd.open(found_file_dir, "rb")
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError(f"Reading {found_file_dir} requires Python 3.14 or the zstandard package")
+            zstd_file = zstandard.open(found_file_dir, "rb")
+
+        return zstd_file if mode == "rb" else io.TextIOWrapper(zstd_file)
+
+    return open(found_file_dir, mode)
+
+
+# Computes the SHA-256 hash of the content of a file, or None if the file does not exist
+def get_file_hash(file_dir):
+
+    if not os.path.exists(file_dir):
+        return None
+
+    file_hash = hashlib.sha256()
+    with open(file_dir, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+# Holds an exclusive lock on a file while it is created or read, so concurrent jobs (also on other machines sharing
+# the filesystem) wait for each other instead of creating the same file at the same time.
+# The lock is taken on a separate "<file>.lock" file, which is kept so that every job locks the same file.
+@contextmanager
+def file_lock(file_dir):
+
+    if fcntl is None:
+        yield
+        return
+
+    with open(f"{file_dir}.lock", "a") as lock_file:
+        fcntl.lockf(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Gives a temporary path in the same directory to write a file to, and renames it over the file once it is complete.
+# The file therefore always has either its old or its new content and is never partially written, e.g. when the job
+# is killed. The temporary path has the same extension as the file, since e.g. np.save and np.savez add theirs.
+@contextmanager
+def atomic_output(file_dir):
+
+    file_root, file_extension = os.path.splitext(file_dir)
+    temp_file_dir = f"{file_root}.{os.getpid()}.tmp{file_extension}"
+
+    try:
+        yield temp_file_dir
+        os.replace(temp_file_dir, file_dir)
+
+    finally:
+        if os.path.exists(temp_file_dir):
+            os.remove(temp_file_dir)
+
+
+# Writes a text file atomically (see atomic_output)
+def write_file_atomically(file_dir, content):
+
+    with atomic_output(file_dir) as temp_file_dir:
+        with open(temp_file_dir, "w") as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+
+# Writes a file atomically only if its content differs from the content on the disk, so the modification time of
+# unchanged files is kept. Returns whether the file was written.
+def write_file_if_changed(file_dir, content):
+
+    if get_file_hash(file_dir) == hashlib.sha256(content.encode("utf-8")).hexdigest():
+        return False
+
+    write_file_atomically(file_dir, content)
+
+    return True
+
+
+# Lists the names of the compounds, i.e. the project directories in the root directory, except for the hidden
+# directories, the directory of the toolkit itself (the working directory) and the excluded directories (e.g. a store)
+def list_compound_names(root_dir, exclude=()):
+
+    excluded_dirs = {os.path.abspath(excluded_dir) for excluded_dir in exclude} | {os.getcwd()}
+
+    return sorted(name for name in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, name))
+        and not name.startswith(".") and os.path.abspath(os.path.join(root_dir, name)) not in excluded_dirs)
+
+
+# Gets the context of the worker processes. The scripts run at module level, so the workers are forked when possible
+# instead of re-importing them. multiprocessing is only imported here, so the scripts without workers start fast.
+def get_process_context():
+
+    import multiprocessing
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+
+    return multiprocessing.get_context()
@@ -0,0 +1,102 @@
+import os
+import argparse
+import time
+import numpy as np
+from wannier_utils import read_hr_file, read_win_unit_cell, truncate_wannier_model, write_compact_model, \
+    read_compact_model, interpolate_wannier_bands, get_chunk_size, is_truncated_model
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python hr_convert.py <_hr.dat file> [...] [--threshold EV] [--cutoff ANGSTROM] [--grid N]
+#
+# Converts the tight-binding Hamiltonians written by Wannier90 (_hr.dat) to a compact binary file (_hr.npz) next to
+# them, which only keeps the nonzero hoppings and loads much faster. qic.read_wannier_model reads both formats.
+#
+# Optionally, the hoppings smaller than the threshold (in eV) or between unit cells further apart than the cutoff
+# (in angstrom, with the unit cell from the .win file next to the _hr.dat file) are dropped, which also makes the
+# interpolation faster. The error of the bands of the truncated model is reported on a uniform N x N x N grid of
+# k-points (N x N x 1 for 2D models without hoppings along the third lattice vector), which is interpolated in chunks
+# of k-points so the memory stays bounded for large models and grids.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Converts Wannier90 _hr.dat files to a compact and truncated format.")
+parser.add_argument("hamiltonian_dirs", nargs="+", metavar="hr_file", help="the _hr.dat files to convert")
+parser.add_argument("--threshold", type=float, default=0.0, metavar="EV",
+    help="drop the hoppings smaller than EV eV (default: 0, keep all)")
+parser.add_argument("--cutoff", type=float, default=None, metavar="ANGSTROM",
+    help="drop the hoppings between unit cells further apart than ANGSTROM (default: keep all)")
+parser.add_argument("--grid", type=int, default=24, metavar="N",
+    help="the number of k-points along every direction for the error of the bands (default: 24)")
+args = parser.parse_args()
+
+# CONVERTING THE HAMILTONIANS
+# ============================================================================================================================
+
+for hamiltonian_dir in args.hamiltonian_dirs:
+
+    print(f"Converting {hamiltonian_dir}...", flush=True)
+
+    start_time = time.perf_counter()
+    wannier_model = read_hr_file(hamiltonian_dir)
+    parse_time = time.perf_counter() - start_time
+
+    # The unit cell is only needed for the distance cutoff
+    unit_cell = None
+    if args.cutoff is not None:
+        seedname = hamiltonian_dir.split("_hr.dat")[0]
+        unit_cell = read_win_unit_cell(f"{seedname}.win")
+        if unit_cell is None:
+            print(f"ERROR: The unit cell was not found in {seedname}.win, which is needed for the cutoff.")
+            exit(1)
+
+    truncated_model = truncate_wannier_model(wannier_model, args.threshold, args.cutoff, unit_cell)
+
+    compact_model_dir = f"{hamiltonian_dir.split('_hr.dat')[0]}_hr.npz"
+    write_compact_model(compact_model_dir, truncated_model)
+
+    start_time = time.perf_counter()
+    read_compact_model(compact_model_dir)
+    load_time = time.perf_counter() - start_time
+
+    number_of_hoppings = wannier_model["hamiltonian"].size
+    number_of_kept_hoppings = np.count_nonzero(truncated_model["hamiltonian"])
+    print(f"Kept {len(truncated_model['lattice_vectors'])} of {len(wannier_model['lattice_vectors'])} lattice vectors \
+and {number_of_kept_hoppings} of {number_of_hoppings} hoppings ({100 * number_of_kept_hoppings / number_of_hoppings:.1f}%).")
+    print(f"Wrote {compact_model_dir} ({os.path.getsize(compact_model_dir) / 1024:.1f} kB, the _hr.dat file has \
+{os.path.getsize(hamiltonian_dir) / 1024:.1f} kB).")
+    if is_truncated_model(truncated_model):
+        print(f"The threshold ({args.threshold} eV) and the cutoff ({args.cutoff} angstrom) are recorded in the file, \
+and fermi_surface.py warns when it reads the truncated model.")
+    print(f"Loading took {1000 * load_time:.1f} ms instead of {1000 * parse_time:.1f} ms.")
+
+    # Comparing the bands of the truncated model with the full one on a uniform grid
+    if number_of_kept_hoppings < number_of_hoppings:
+        grid_sizes = [args.grid, args.grid, args.grid if np.any(wannier_model["lattice_vectors"][:, 2] != 0) else 1]
+        number_of_grid_points = int(np.prod(grid_sizes))
+
+        # The grid is interpolated in chunks of k-points whose Hamiltonians fit in chunk_memory, keeping only the
+        # largest error and the sum of the squared errors, so the memory does not grow with the grid
+        chunk_size = get_chunk_size(wannier_model["number_of_wannier_functions"])
+        max_band_error = 0.0
+        squared_band_error_sum = 0.0
+        for start in range(0, number_of_grid_points, chunk_size):
+            grid_indices = np.unravel_index(np.arange(start, min(start + chunk_size, number_of_grid_points)), grid_sizes)
+            k_points = np.stack(grid_indices, axis=-1) / grid_sizes
+
+            band_errors = np.abs(interpolate_wannier_bands(truncated_model, k_points)
+                - interpolate_wannier_bands(wannier_model, k_points))
+            max_band_error = max(max_band_error, np.max(band_errors))
+            squared_band_error_sum += np.sum(band_errors**2)
+
+        rms_band_error = np.sqrt(squared_band_error_sum / (number_of_grid_points
+            * wannier_model["number_of_wannier_functions"]))
+        print(f"Band error on a {'x'.join(str(n) for n in grid_sizes)} grid: {1000 * max_band_error:.3f} meV at most \
+and {1000 * rms_band_error:.3f} meV on average (RMS).")
+
+    print(flush=True)
@@ -2,12 +2,25 @@ import os
 from sys import argv
 import re
 import subprocess
+from file_utils import write_file_if_changed
+from structure_utils import get_structure_fingerprint, find_duplicate_projects, add_to_structure_index
+from resource_utils import read_pw_input, read_number_of_k_points, estimate_fft_grid, choose_parallelization, \
+    read_valence_charge, get_default_number_of_bands, get_cell_volume, estimate_resources, get_step_name, read_calibration, \
+    read_number_of_q_points, estimate_number_of_q_points, split_q_points
 
 
 # Usage: the following python script should be run with command line arguments in the following way:
 #
 # python init_calc.py <compound name> <path-to-POSCAR-file>
 #
+# If the project already exists, only the input files whose content changed are rewritten, so the modification times
+# of the unchanged files are kept.
+#
+# If a number of MPI processes is given, a job script (run_<calculation>.sh) is also written in every calculation
+# directory, with the parallelization of every pw.x run chosen for its number of k-points, bands and FFT grid.
+# The number of plane waves, the FFT grid, the memory and the wall time of every pw.x run are estimated and printed.
+# The estimates are calibrated with the outputs harvested by qe_timings.py (qe_timings.csv in the root directory).
+#
 # For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
 
 # INITIALIZATION
@@ -52,45 +65,6 @@ for element_name in element_names:
 
 root_dir = os.path.abspath("../")  # The root directory for creating the calculation project
 project_dir = os.path.join(root_dir, argv[1])
-calculation_list = ("scf", "pdos", "projected_bands", "wannier")  # List of desired DFT and wannier calculations
-calculation_dirs = []  # Directories of calculations
-
-# Creating the folder structure of the project
-try:
-    os.mkdir(project_dir)
-    print(f"\nProject directory initialized at:\n {project_dir}\n", flush=True)
-
-    print(f"Entering {compound_name} directory...")
-    os.chdir(project_dir)
-
-    for calculation in calculation_list:
-        os.mkdir(calculation)
-        calculation_dirs.append(os.path.abspath(calculation))
-
-    os.mkdir("spin_orbit")
-    for calculation in calculation_list:
-        calculation_with_soc = os.path.join("spin_orbit", calculation)
-        os.makedirs(calculation_with_soc)
-        calculation_dirs.append(os.path.abspath(calculation_with_soc))
-
-    print("Successfully created calculation directories.\n", flush=True)
-
-except FileExistsError:
-    print("\nProject already initialized! Retrieving calculation directories...\n")
-    for dirpath, dirnames, _ in os.walk(project_dir):
-        if len(dirnames) == 0:
-            calculation_dirs.append(dirpath)
-
-# TEMPLATE INPUT FILE GENERATION
-# =======================================================================================================
-
-print("Generating template input files...\n", flush=True)
-print(
-'''
-By default, the number of bands in spin-orbit case will be double of the provided number of bands below.
-Change the generated input files if that's not what you want.
-''', flush=True)
-number_of_bands = int(input("Enter the number of bands: "))
 
 # Reading the atomic positions and lattice vectors from the POSCAR file
 with open(poscar_file, "r") as file:
@@ -113,6 +87,74 @@ with open(poscar_file, "r") as file:
             lattice_vectors.append(f"{match.group(1)}  {match.group(2)}    {match.group(3)}")
         counter += 1
 
+# CHECKING FOR DUPLICATE STRUCTURES
+# =======================================================================================================
+
+# The same structure can appear under a different name, atom order, origin or choice of lattice vectors.
+# The fingerprint of the structure is looked up in the index of the projects in the root directory, and the
+# structures of the projects with the same fingerprint are compared with the tolerances.
+structure_index_dir = os.path.join(root_dir, "structure_index.json")
+structure = {
+    "lattice_vectors": [lattice_vector.split() for lattice_vector in lattice_vectors],
+    "atomic_labels": atomic_labels,
+    "fractional_positions": [atomic_position.split() for atomic_position in atomic_positions[:number_of_atoms]]
+}
+structure_fingerprint = get_structure_fingerprint(structure["lattice_vectors"], structure["atomic_labels"],
+    structure["fractional_positions"])
+
+duplicate_projects = find_duplicate_projects(structure_index_dir, structure_fingerprint, compound_name, root_dir,
+    structure)
+
+if len(duplicate_projects) > 0:
+    print(f"\nThe structure is the same as the one of the existing projects: {', '.join(duplicate_projects)}")
+    print("Enter s to skip, l to link to the existing project or c to create the project anyway.", flush=True)
+
+    # Skipping by default, so batch scripts do not repeat the calculations of a duplicate
+    try:
+        duplicate_action = input("Action [s/l/c]: ").strip().lower()
+    except EOFError:
+        duplicate_action = "s"
+
+    if duplicate_action == "l" and not os.path.exists(project_dir):
+        os.symlink(duplicate_projects[0], project_dir)
+        print(f"Linked {project_dir} to the existing project {duplicate_projects[0]}.")
+        exit()
+    elif duplicate_action != "c":
+        print(f"Skipping {compound_name}.")
+        exit()
+
+calculation_list = ("scf", "pdos", "projected_bands", "wannier")  # List of desired DFT and wannier calculations
+calculation_dirs = []  # Directories of calculations
+
+# Creating the folder structure of the project.
+# The calculation directories are always listed in the same order, so an existing project is updated in place.
+if os.path.exists(project_dir):
+    print("\nProject already initialized! Retrieving calculation directories...\n")
+else:
+    print(f"\nProject directory initialized at:\n {project_dir}\n", flush=True)
+
+for calculation in calculation_list:
+    calculation_dirs.append(os.path.join(project_dir, calculation))
+
+for calculation in calculation_list:
+    calculation_dirs.append(os.path.join(project_dir, "spin_orbit", calculation))
+
+for calculation_dir in calculation_dirs:
+    os.makedirs(calculation_dir, exist_ok=True)
+
+print("Successfully created calculation directories.\n", flush=True)
+
+# TEMPLATE INPUT FILE GENERATION
+# =======================================================================================================
+
+print("Generating template input files...\n", flush=True)
+print(
+'''
+By default, the number of bands in spin-orbit case will be double of the provided number of bands below.
+Change the generated input files if that's not what you want.
+''', flush=True)
+number_of_bands = int(input("Enter the number of bands: "))
+
 # Input file contents
 #-----------------------------------------------------------------------------------------------------
 
@@ -962,6 +1004,111 @@ f'''
 
 '''
 
+# Input files for the phonons
+#-----------------------------------------------------------------------------------------------------
+
+# The phonons are calculated on a q-point mesh by ph.x, which is split into independent jobs of consecutive q-points
+# (start_q and last_q) with their own copies of the scf data, so they can run at the same time. The dynamical matrices
+# of all the jobs are then collected, converted to force constants by q2r.x and interpolated along the path by matdyn.x.
+# Skipping the phonons when the input ends, e.g. in batch scripts
+try:
+    phonon_settings = input("Enter the q-point mesh of the phonons and the number of jobs to split it into, e.g. \
+\"4 4 1 4\". Leave empty to skip the phonons: ").split()
+except EOFError:
+    phonon_settings = []
+
+calculate_phonons = len(phonon_settings) > 0
+if calculate_phonons:
+
+    # Checking the q-point mesh and the number of jobs before the directory of the phonons is created
+    if len(phonon_settings) < 3 or not all(n.isdigit() and int(n) > 0 for n in phonon_settings[:4]):
+        print(f"ERROR: Invalid phonon settings \"{' '.join(phonon_settings)}\". Enter at least 3 positive integers \
+for the q-point mesh, optionally followed by the number of jobs, e.g. \"4 4 1 4\".")
+        exit(1)
+
+    q_mesh = [int(n) for n in phonon_settings[:3]]
+    number_of_phonon_jobs = int(phonon_settings[3]) if len(phonon_settings) > 3 else 1
+
+    phonon_dir = os.path.join(project_dir, "phonon")
+    os.makedirs(phonon_dir, exist_ok=True)
+    calculation_dirs.append(phonon_dir)
+
+    # Preferring the number of irreducible q-points written by a previous run of ph.x over the estimate
+    number_of_q_points = read_number_of_q_points(os.path.join(phonon_dir, f"{compound_name}.dyn0"))
+    q_points_estimated = number_of_q_points is None
+    if q_points_estimated:
+        number_of_q_points = estimate_number_of_q_points(q_mesh)
+
+    q_point_ranges = split_q_points(number_of_q_points, number_of_phonon_jobs)
+
+    print(f"\nSplitting {'~' if q_points_estimated else ''}{number_of_q_points} q-points into \
+{len(q_point_ranges)} phonon jobs:", flush=True)
+    for job_index, (start_q, last_q) in enumerate(q_point_ranges):
+        print(f"job {job_index + 1}: q-points {start_q} to {last_q}")
+    if q_points_estimated:
+        print("The number of q-points is estimated. Run run_phonon.sh and then init_calc.py again to split the \
+q-points reduced by symmetry.", flush=True)
+
+    # The first run only finds the irreducible q-points and writes them to the fildyn0 file
+    ph_init_input = \
+f'''phonons of {compound_name}
+ &INPUTPH
+  prefix   = '{compound_name}'
+  outdir   = './out'
+  fildyn   = '{compound_name}.dyn'
+  tr2_ph   = 1.0d-16
+  ldisp    = .true.
+  nq1      = {q_mesh[0]}
+  nq2      = {q_mesh[1]}
+  nq3      = {q_mesh[2]}
+  start_irr = 0
+  last_irr  = 0
+ /
+'''
+
+    ph_job_inputs = []
+    for job_index, (start_q, last_q) in enumerate(q_point_ranges):
+        ph_job_inputs.append(
+f'''phonons of {compound_name}
+ &INPUTPH
+  prefix   = '{compound_name}'
+  outdir   = './out_q{job_index + 1}'
+  fildyn   = 'q{job_index + 1}/{compound_name}.dyn'
+  tr2_ph   = 1.0d-16
+  ldisp    = .true.
+  nq1      = {q_mesh[0]}
+  nq2      = {q_mesh[1]}
+  nq3      = {q_mesh[2]}
+  start_q  = {start_q}
+  last_q   = {last_q}
+ /
+''')
+
+    q2r_input = \
+f'''
+ &INPUT
+  fildyn = '{compound_name}.dyn'
+  zasr   = 'crystal'
+  flfrc  = '{compound_name}.fc'
+ /
+'''
+
+    matdyn_input = \
+f'''
+ &INPUT
+  asr              = 'crystal'
+  flfrc            = '{compound_name}.fc'
+  flfrq            = '{compound_name}.freq'
+  q_in_band_form   = .true.
+  q_in_cryst_coord = .true.
+ /
+4
+  0.0000000000    0.0000000000    0.0000000000    120 ! Gamma
+  0.5000000000    0.0000000000    0.0000000000    120 ! M
+  0.3333333333    0.3333333333    0.0000000000    120 ! K
+  0.0000000000    0.0000000000    0.0000000000    0 ! Gamma
+'''
+
 # Calculation types and their respective input files nicely formatted for convenience and easy access
 calculation_info = {
     "scf": {
@@ -1009,20 +1156,353 @@ calculation_soc_info = {
     }
 }
 
-# Writing the generated templates to files
+# The phonons are only calculated without spin-orbit coupling, from their own scf calculation
+if calculate_phonons:
+    phonon_info = {
+        "index": calculation_dirs.index(phonon_dir),
+        "input_list": (scf_input, ph_init_input) + tuple(ph_job_inputs) + (q2r_input, matdyn_input),
+        "filename_list": (f"{compound_name}_scf.pw.in", f"{compound_name}_init.ph.in")
+            + tuple(f"{compound_name}_q{job_index + 1}.ph.in" for job_index in range(len(ph_job_inputs)))
+            + (f"{compound_name}.q2r.in", f"{compound_name}.matdyn.in")
+    }
+
+# RESOURCE ESTIMATION AND JOB SCRIPT GENERATION
+# =======================================================================================================
+
+# The programs run by the job script of every calculation in order, with the index of their input file in the
+# filename list of the calculation. The relaxation is written commented out, since it is not always needed.
+job_step_info = {
+    "scf": (("pw.x", 0), ("pw.x", 1)),
+    "pdos": (("pw.x", 0), ("projwfc.x", 1)),
+    "projected_bands": (("pw.x", 0), ("bands.x", 1), ("projwfc.x", 2)),
+    "wannier": (("pw.x", 0), ("wannier90.x -pp", 1), ("pw2wannier90.x", 2), ("wannier90.x", 1))
+}
+
+# The header of the job script for every job scheduler and the default command for starting the MPI processes
+scheduler_info = {
+    "none": {
+        "header": "",
+        "mpi_command": "mpirun -np {number_of_processes}"
+    },
+    "slurm": {
+        "header": "#SBATCH --job-name={job_name}\n#SBATCH --ntasks={number_of_processes}\n#SBATCH --output={job_name}.%j.log\n",
+        "mpi_command": "srun"
+    },
+    "pbs": {
+        "header": "#PBS -N {job_name}\n#PBS -l select=1:ncpus={number_of_processes}:mpiprocs={number_of_processes}\n#PBS -j oe\n",
+        "mpi_command": "mpirun -np {number_of_processes}"
+    }
+}
+
+print("\nEstimating the resources of the calculations...\n", flush=True)
+
+# Estimating a serial run without job scripts or a memory check when the input ends, e.g. in batch scripts
+try:
+    job_settings = input("Enter the number of MPI processes for the job scripts, optionally followed by the job \
+scheduler (slurm or pbs), e.g. \"64 slurm\". Leave empty to skip the job scripts: ").split()
+except EOFError:
+    job_settings = []
+
+try:
+    node_settings = input("Enter the number of MPI processes per node and the memory per node in GB, e.g. \
+\"48 192\", to check whether the calculations fit in the memory (leave empty to skip): ").split()
+except EOFError:
+    node_settings = []
+
+write_job_scripts = len(job_settings) > 0
+if write_job_scripts and not (job_settings[0].isdigit() and int(job_settings[0]) > 0):
+    print(f"ERROR: Invalid number of MPI processes \"{job_settings[0]}\". Enter a positive integer, e.g. \"64 slurm\".")
+    exit(1)
+
+number_of_processes = int(job_settings[0]) if write_job_scripts else 1
+scheduler = job_settings[1].lower() if len(job_settings) > 1 else "none"
+if scheduler not in scheduler_info:
+    print(f"ERROR: Unknown job scheduler \"{scheduler}\". Choose slurm, pbs or leave it empty.")
+    exit(1)
+
+check_node_memory = len(node_settings) == 2
+if check_node_memory:
+    try:
+        valid_node_settings = int(node_settings[0]) > 0 and float(node_settings[1]) > 0
+    except ValueError:
+        valid_node_settings = False
+
+    if not valid_node_settings:
+        print(f"ERROR: Invalid node settings \"{' '.join(node_settings)}\". Enter the number of MPI processes per \
+node and the memory per node in GB as positive numbers, e.g. \"48 192\".")
+        exit(1)
+
+    processes_per_node = min(int(node_settings[0]), number_of_processes)
+    node_memory = float(node_settings[1]) * 1024  # In MB
+
+too_large_inputs = []  # The inputs which need more memory than a node has
+parallelization_info = dict()  # The parallelization of every pw.x input, reused by the phonon jobs
+
+# The number of valence electrons from the pseudopotentials, which determines the number of bands if nbnd is not given
+number_of_electrons = None
+number_of_electrons_soc = None
+valence_charges = [read_valence_charge(os.path.join(pseudo_dir_path, pseudo_list[element])) for element in element_names]
+rel_valence_charges = [read_valence_charge(os.path.join(rel_pseudo_dir_path, rel_pseudo_list[element]))
+    for element in element_names]
+
+if None not in valence_charges:
+    number_of_electrons = sum(charge * number for charge, number in zip(valence_charges, element_numbers))
+if None not in rel_valence_charges:
+    number_of_electrons_soc = sum(charge * number for charge, number in zip(rel_valence_charges, element_numbers))
+
+# Calibrating the estimates with the outputs harvested by qe_timings.py
+calibration = read_calibration(os.path.join(root_dir, "qe_timings.csv"))
+if calibration is None:
+    print("\nNo harvested outputs found (run qe_timings.py after the first calculations to calibrate the estimates).")
+    print("The wall times are only given as relative costs.", flush=True)
+else:
+    print(f"\nThe estimates are calibrated with {calibration['number_of_runs']} runs from qe_timings.csv.", flush=True)
+
+print(f"\nThe resources of the pw.x runs on {number_of_processes} MPI processes (~: estimated number of k-points, \
+*: calibrated with all the steps instead of the same step):\n", flush=True)
+print(f"{'input file':<32} {'k-points':>9} {'bands':>6} {'plane waves':>12} {'FFT grid':>13} {'RAM/proc (MB)':>14} \
+{'RAM (GB)':>9} {'wall time' if calibration is not None else 'rel. cost':>10}   flags", flush=True)
+
 for calculation in calculation_list:
-    for input_src, filename in zip(calculation_info[calculation]["input_list"], calculation_info[calculation]["filename_list"]):
+    for info, flag in zip((calculation_info[calculation], calculation_soc_info[calculation]), ("", "_soc")):
+
+        calculation_dir = calculation_dirs[info["index"]]
+        scf_dir = calculation_dirs[(calculation_soc_info if flag else calculation_info)["scf"]["index"]]
+        job_name = f"{compound_name}_{calculation}{flag}"
 
-        with open(os.path.join(calculation_dirs[calculation_info[calculation]["index"]], filename), "w") as file:
-            file.write(input_src)
-        print(f"Wrote {filename} at:\n \
-            {os.path.join(calculation_dirs[calculation_info[calculation]['index']], filename)}\n", flush=True)
+        job_script = "#!/bin/bash\n"
+        job_script += scheduler_info[scheduler]["header"].format(job_name=job_name,
+            number_of_processes=number_of_processes)
+        job_script += f'''
+# Job script of the {calculation}{" spin-orbit" if flag else ""} calculation of {compound_name} generated by init_calc.py.
+# The parallelization of pw.x is chosen for {number_of_processes} MPI processes. Rerun init_calc.py after the first run
+# to choose it from the actual number of k-points instead of an estimate.{f"""
+# The nscf calculation starts from the scf data, so run run_scf{flag}.sh first.""" if calculation != "scf" else ""}
+# Set MPIRUN to change the command which starts the MPI processes.
 
-    for input_src, filename in zip(calculation_soc_info[calculation]["input_list"], calculation_soc_info[calculation]["filename_list"]):
+set -e
+cd "{calculation_dir}"
 
-        with open(os.path.join(calculation_dirs[calculation_soc_info[calculation]["index"]], filename), "w") as file:
-            file.write(input_src)
-        print(f"Wrote {filename} at:\n \
-            {os.path.join(calculation_dirs[calculation_soc_info[calculation]['index']], filename)}\n", flush=True)
+MPIRUN=${{MPIRUN:-"{scheduler_info[scheduler]["mpi_command"].format(number_of_processes=number_of_processes)}"}}
+
+'''
+
+        # The nscf calculations work on their own copy of the scf data
+        if calculation != "scf":
+            job_script += f'''if [ ! -d "{scf_dir}/out" ]; then
+    echo "The scf data {scf_dir}/out is missing. Run run_scf{flag}.sh first." >&2
+    exit 1
+fi
+rm -rf out
+cp -r "{scf_dir}/out" out
+
+'''
+
+        number_of_pools = 1
+        for program, input_index in job_step_info[calculation]:
+            input_filename = info["filename_list"][input_index]
+            output_filename = f"{os.path.splitext(input_filename)[0]}.out"
+
+            if program == "pw.x":
+                pw_input_info = read_pw_input(info["input_list"][input_index])
+
+                # Preferring the number of k-points of a previous run over the estimate
+                number_of_k_points = read_number_of_k_points(os.path.join(calculation_dir, output_filename))
+                k_points_estimated = number_of_k_points is None
+                if k_points_estimated:
+                    number_of_k_points = pw_input_info["number_of_k_points"]
+                    k_points_estimated = pw_input_info["k_points_estimated"]
+
+                # The number of bands used by pw.x if nbnd is not given
+                number_of_bands = pw_input_info["number_of_bands"]
+                electrons = number_of_electrons_soc if pw_input_info["spin_orbit"] else number_of_electrons
+                if number_of_bands is None and electrons is not None:
+                    number_of_bands = get_default_number_of_bands(electrons, pw_input_info["spin_orbit"],
+                        pw_input_info["smearing"])
+
+                fft_grid = estimate_fft_grid(pw_input_info["lattice_vectors"], pw_input_info["ecutrho"])
+                parallelization = choose_parallelization(number_of_processes, number_of_k_points, number_of_bands,
+                    fft_grid)
+                number_of_pools = parallelization["npool"]
+                parallelization_info[input_filename] = parallelization
+
+                parallel_flags = f"-nk {parallelization['npool']} -nb {parallelization['nbgrp']} \
+-nt {parallelization['ntg']} -nd {parallelization['ndiag']}"
+                command = f"$MPIRUN pw.x {parallel_flags} -in {input_filename} > {output_filename}"
+
+                # Estimating the memory and the wall time
+                plane_waves_column, ram_per_process_column, ram_column, wall_time_column = "-", "-", "-", "-"
+                if number_of_bands is not None:
+                    resources = estimate_resources(get_cell_volume(pw_input_info["lattice_vectors"]),
+                        pw_input_info["ecutwfc"], fft_grid, number_of_bands, number_of_k_points,
+                        pw_input_info["spin_orbit"], number_of_processes // number_of_pools)
+
+                    ram_per_process = resources["ram_per_process_mb"]
+                    wall_time_column = f"{resources['relative_cost']:.3g}"
+
+                    if calibration is not None:
+                        ram_per_process *= calibration["memory_factor"]
+
+                        step_name = get_step_name(output_filename, compound_name)
+                        time_factor = calibration["time_factors"].get(step_name)
+                        if time_factor is None:
+                            time_factor = calibration["time_factors"][None]
+                        wall_time = time_factor * resources["relative_cost"] / number_of_processes
+
+                        hours, seconds = divmod(round(wall_time), 3600)
+                        wall_time_column = f"{'' if step_name in calibration['time_factors'] else '*'}\
+{hours}h{seconds // 60:02d}m"
+
+                    plane_waves_column = str(resources["number_of_plane_waves"])
+                    ram_per_process_column = f"{ram_per_process:.0f}"
+                    ram_column = f"{ram_per_process * number_of_processes / 1024:.1f}"
+
+                    # Every node needs the memory of its processes
+                    if check_node_memory and ram_per_process * processes_per_node > node_memory:
+                        ram_column += "!"
+                        too_large_inputs.append((input_filename, ram_per_process * processes_per_node / 1024))
+
+                print(f"{input_filename:<32} {('~' if k_points_estimated else '') + str(number_of_k_points):>9} \
+{str(number_of_bands or '-'):>6} {plane_waves_column:>12} {'x'.join(str(n) for n in fft_grid):>13} \
+{ram_per_process_column:>14} {ram_column:>9} {wall_time_column:>10}   {parallel_flags}", flush=True)
+
+            # projwfc.x reads the wavefunctions with the same pools as the pw.x run before it
+            elif program == "projwfc.x":
+                command = f"$MPIRUN projwfc.x -nk {number_of_pools} -in {input_filename} > {output_filename}"
+
+            # Wannier90 is run serially, since it is not always compiled with MPI
+            elif program.startswith("wannier90.x"):
+                command = f"{program} {os.path.splitext(input_filename)[0]}"
+
+            else:
+                command = f"$MPIRUN {program} -in {input_filename} > {output_filename}"
+
+            if "vc_relax" in input_filename:
+                command = f"# {command}  # Uncomment to relax the structure first"
+
+            job_script += f"{command}\n"
+
+        if write_job_scripts:
+            info["input_list"] += (job_script,)
+            info["filename_list"] += (f"run_{calculation}{flag}.sh",)
+
+# The phonon jobs: the scf calculation and the search for the irreducible q-points, the jobs of the q-points which can
+# run at the same time, and the merge of their dynamical matrices. ph.x distributes the k-points over the same pools
+# as the scf calculation.
+if calculate_phonons and write_job_scripts:
+    scf_parallelization = parallelization_info[f"{compound_name}_scf.pw.in"]
+    scf_parallel_flags = f"-nk {scf_parallelization['npool']} -nb {scf_parallelization['nbgrp']} \
+-nt {scf_parallelization['ntg']} -nd {scf_parallelization['ndiag']}"
+    mpi_command = scheduler_info[scheduler]["mpi_command"].format(number_of_processes=number_of_processes)
+
+    phonon_job_info = {
+        "run_phonon.sh": (f"{compound_name}_phonon",
+            "the scf calculation and the search for the irreducible q-points",
+            f'''$MPIRUN pw.x {scf_parallel_flags} -in {compound_name}_scf.pw.in > {compound_name}_scf.pw.out
+$MPIRUN ph.x -nk {scf_parallelization['npool']} -in {compound_name}_init.ph.in > {compound_name}_init.ph.out
+''')
+    }
+
+    for job_index, (start_q, last_q) in enumerate(q_point_ranges):
+        job_name = f"q{job_index + 1}"
+        phonon_job_info[f"run_phonon_{job_name}.sh"] = (f"{compound_name}_phonon_{job_name}",
+            f"the q-points {start_q} to {last_q}",
+            f'''# Skipping the job if ph.x found fewer irreducible q-points than estimated
+number_of_q_points=$(awk 'NR == 2 {{print $1}}' {compound_name}.dyn0)
+if [ {start_q} -gt "$number_of_q_points" ]; then
+    echo "No q-points left for this job."
+    exit 0
+fi
+
+# Every job works on its own copy of the scf data
+rm -rf out_{job_name}
+cp -r out out_{job_name}
+mkdir -p {job_name}
+
+$MPIRUN ph.x -nk {scf_parallelization['npool']} -in {compound_name}_{job_name}.ph.in > {compound_name}_{job_name}.ph.out
+''')
+
+    phonon_job_info["run_phonon_merge.sh"] = (f"{compound_name}_phonon_merge",
+        "the merge of the dynamical matrices of all the q-point jobs",
+        f'''# Collecting the dynamical matrices of all the q-points from the directories of the jobs
+number_of_q_points=$(awk 'NR == 2 {{print $1}}' {compound_name}.dyn0)
+for q in $(seq 1 "$number_of_q_points"); do
+    dyn_files=(q*/{compound_name}.dyn$q)
+    if [ ! -f "${{dyn_files[0]}}" ]; then
+        echo "The dynamical matrix of the q-point $q is missing. Make sure all the q-point jobs have finished." >&2
+        exit 1
+    fi
+    cp "${{dyn_files[0]}}" .
+done
+
+# q2r.x and matdyn.x are fast enough to run serially
+q2r.x -in {compound_name}.q2r.in > {compound_name}.q2r.out
+matdyn.x -in {compound_name}.matdyn.in > {compound_name}.matdyn.out
+''')
+
+    for filename, (job_name, description, commands) in phonon_job_info.items():
+        job_script = "#!/bin/bash\n"
+        job_script += scheduler_info[scheduler]["header"].format(job_name=job_name,
+            number_of_processes=number_of_processes)
+        job_script += f'''
+# Job script of {description} of the phonon calculation of {compound_name} generated by init_calc.py.
+# Run run_phonon.sh first, then all the run_phonon_q<N>.sh jobs at the same time and run_phonon_merge.sh at the end.
+# Set MPIRUN to change the command which starts the MPI processes.
+
+set -e
+cd "{phonon_dir}"
+
+MPIRUN=${{MPIRUN:-"{mpi_command}"}}
+
+{commands}'''
+
+        phonon_info["input_list"] += (job_script,)
+        phonon_info["filename_list"] += (filename,)
+
+print()
+
+for input_filename, ram_per_node in too_large_inputs:
+    print(f"WARNING: {input_filename} needs about {ram_per_node:.1f} GB per node, but a node has \
+{node_memory / 1024:.1f} GB. Use fewer processes per node, more processes or fewer pools (-nk).")
+
+if write_job_scripts:
+    print()
+else:
+    print("Skipping the job scripts.\n", flush=True)
+
+# Writing the generated templates to files
+# ------------------------------------------------------------------------------------------------------
+
+changed_files = []  # The input files which were written
+unchanged_files = []  # The input files which already had the generated content
+
+info_list = [info for calculation in calculation_list
+    for info in (calculation_info[calculation], calculation_soc_info[calculation])]
+if calculate_phonons:
+    info_list.append(phonon_info)
+
+for info in info_list:
+    for input_src, filename in zip(info["input_list"], info["filename_list"]):
+
+        input_file_dir = os.path.join(calculation_dirs[info["index"]], filename)
+
+        # Comparing the hash of the generated content with the file on the disk and writing it atomically
+        if write_file_if_changed(input_file_dir, input_src):
+            changed_files.append(input_file_dir)
+            print(f"Wrote {filename} at:\n {input_file_dir}\n", flush=True)
+        else:
+            unchanged_files.append(input_file_dir)
+
+        # The job scripts are executable
+        if filename.endswith(".sh"):
+            os.chmod(input_file_dir, 0o755)
 
 print("\nInput files have been generated successfully.")
+print(f"{len(changed_files)} files changed and {len(unchanged_files)} files unchanged.")
+
+for unchanged_file in unchanged_files:
+    print(f"Unchanged: {os.path.relpath(unchanged_file, project_dir)}")
+
+# Registering the structure of the project, so later projects with the same structure are recognized
+add_to_structure_index(structure_index_dir, structure_fingerprint, compound_name)
+print(f"\nRegistered the structure of {compound_name} in {structure_index_dir}.")
@@ -0,0 +1,343 @@
+import re
+import mmap
+from file_utils import open_file, get_process_context
+
+
+# Parsing utilities for the standard output of Quantum ESPRESSO projwfc.x (kpdos) calculations.
+# These are used by plot_pbands.py and are not meant to be run directly.
+# NumPy and multiprocessing are only imported by the parsers, so reading the header stays fast.
+# The outputs can be compressed (.gz, .xz or .zst), except for the memory-mapped parallel parser.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The line which starts a new k-point block, e.g. " k =   0.0000000000  0.0000000000  0.0000000000". The components
+# can be fused by their signs (e.g. "k =-0.08333-0.14434 0.0"), lack the leading zero or have an exponent.
+k_point_regex_object = re.compile(r"^\s*k =\s*(-?\d*\.\d+(?:[eE][-+]?\d+)?)\s*(-?\d*\.\d+(?:[eE][-+]?\d+)?)"
+    r"\s*(-?\d*\.\d+(?:[eE][-+]?\d+)?)")
+
+# The line which starts a new wavefunction, e.g. "==== e(   1) =   -62.44638 eV ===="
+energy_regex_object = re.compile(r"==== e\(\s*\d+\) =\s*(-?\d+\.\d+) eV")
+
+# The weight of a single atomic state in a wavefunction, e.g. "0.500*[#   1]"
+weight_regex_object = re.compile(r"(\d+\.\d+)\*\[#\s*(\d+)\]")
+
+
+# Atomic orbitals and their corresponding orbital numbers
+orbital_info = {
+    "s": [
+        "l=0 m= 1",
+        "l=0 j=0.5 m_j=-0.5", "l=0 j=0.5 m_j= 0.5"
+    ],
+
+    "p": [
+        "l=1 m= 1", "l=1 m= 2", "l=1 m= 3",
+        "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
+        "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
+    ],
+
+    "pz": [
+        "l=1 m= 1",
+        "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5",
+        "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5"
+    ],
+    "px": [
+        "l=1 m= 2",
+        "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
+        "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
+    ],
+    "py": [
+        "l=1 m= 3",
+        "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
+        "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
+    ],
+
+    "d": [
+        "l=2 m= 1", "l=2 m= 2", "l=2 m= 3", "l=2 m= 4", "l=2 m= 5",
+        "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5", "l=2 j=2.5 m_j=-2.5",
+        "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=2.5 m_j= 2.5"
+    ],
+
+    "dz2": [
+        "l=2 m= 1",
+        "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5",
+        "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5"
+    ],
+
+    "dxz": [
+        "l=2 m= 2",
+        "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5",
+        "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5"
+    ],
+
+    "dyz": [
+        "l=2 m= 3",
+        "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5",
+        "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5"
+    ],
+
+    "dx2y2": [
+        "l=2 m= 4",
+        "l=2 j=2.5 m_j=-2.5", "l=2 j=2.5 m_j=-1.5", "l=2 j=1.5 m_j=-1.5",
+        "l=2 j=2.5 m_j= 2.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=1.5 m_j= 1.5"
+    ],
+
+    "dxy": [
+        "l=2 m= 5",
+        "l=2 j=2.5 m_j=-2.5", "l=2 j=2.5 m_j=-1.5", "l=2 j=1.5 m_j=-1.5",
+        "l=2 j=2.5 m_j= 2.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=1.5 m_j= 1.5"
+    ]
+}
+
+
+# Resolves the atomic projections to the indices of their atomic states using the state table of the kpdos output
+def resolve_atomic_projection_indices(kpdos_calculation_output, atomic_projection_list):
+
+    # Atomic projections and their respective atomic state indices
+    atomic_projection_indices_info = dict()
+
+    for atomic_projection in atomic_projection_list:
+        projection_indices_list = []
+
+        for orbital in orbital_info[atomic_projection[1]]:
+
+            # Getting the index of all atomic states given by user input
+            atomic_state_regex_pattern = rf"state #\s+(\d+): atom\s+\d+ \({atomic_projection[0]}\s+\), wfc\s+\d+ \({orbital}\)"
+            atomic_state_regex_object = re.compile(atomic_state_regex_pattern)
+            atomic_state_number_matches = atomic_state_regex_object.finditer(kpdos_calculation_output)
+
+            for atomic_state in atomic_state_number_matches:
+                projection_indices_list.append(int(atomic_state.group(1)))
+        projection_indices_list.sort()
+
+        # px and py orbitals have the same contribution
+        if atomic_projection[1] == "px" or atomic_projection[1] == "py":
+            if "px+py" not in atomic_projection_indices_info.keys():
+                atomic_projection_indices_info.update({f"{atomic_projection[0]}-px+py": projection_indices_list})
+
+        # dxz and dyz orbitals have the same contribution
+        elif atomic_projection[1] == "dxz" or atomic_projection[1] == "dyz":
+            if "dxz+dyz" not in atomic_projection_indices_info.keys():
+                atomic_projection_indices_info.update({f"{atomic_projection[0]}-dxz+dyz": projection_indices_list})
+
+        # dx2y2 and dxy orbitals have the same contribution
+        elif atomic_projection[1] == "dx2y2" or atomic_projection[1] == "dxy":
+            if "dx2y2+dxy" not in atomic_projection_indices_info.keys():
+                atomic_projection_indices_info.update({f"{atomic_projection[0]}-dx2y2+dxy": projection_indices_list})
+
+        else:
+            atomic_projection_indices_info.update({f"{atomic_projection[0]}-{atomic_projection[1]}":
+            projection_indices_list})
+
+    return atomic_projection_indices_info
+
+
+# Reads the part of the kpdos output which comes before the first k-point block.
+# It contains the problem sizes and the table of atomic states, but none of the (large) projections.
+def read_kpdos_header(kpdos_output_dir):
+
+    header_lines = []
+
+    with open_file(kpdos_output_dir, "r") as kpdos_output_file:
+        for line in kpdos_output_file:
+            if k_point_regex_object.match(line):
+                break
+            header_lines.append(line)
+
+    return "".join(header_lines)
+
+
+# Gets the number of k-points from the problem sizes of the kpdos output header.
+# If the header does not report it, the k-point lines are counted without keeping the file in memory.
+def get_number_of_k_points(kpdos_output_dir, kpdos_header):
+
+    number_of_k_points_match = re.search(r"nkstot\s+=\s+(\d+)", kpdos_header)
+    if number_of_k_points_match is not None:
+        return int(number_of_k_points_match.group(1))
+
+    number_of_k_points = 0
+    with open_file(kpdos_output_dir, "r") as kpdos_output_file:
+        for line in kpdos_output_file:
+            if k_point_regex_object.match(line):
+                number_of_k_points += 1
+
+    return number_of_k_points
+
+
+# Yields the k-vector and the lines of each k-point block of the kpdos output, one block at a time
+def iterate_k_point_blocks(kpdos_output_file):
+
+    import numpy as np
+
+    k_vector = None
+    block_lines = []
+
+    for line in kpdos_output_file:
+        k_point_match = k_point_regex_object.match(line)
+
+        if k_point_match is not None:
+            if k_vector is not None:
+                yield k_vector, block_lines
+
+            k_vector = np.array([float(k_point_match.group(i)) for i in range(1, 4)])
+            block_lines = []
+
+        elif k_vector is not None:
+            block_lines.append(line)
+
+    if k_vector is not None:
+        yield k_vector, block_lines
+
+
+# Parses the energies and the weights of the stored atomic states for every band of a single k-point block
+def parse_k_point_block(block_lines, state_columns, number_of_bands):
+
+    import numpy as np
+
+    energies = np.zeros(number_of_bands)
+    weights = np.zeros((number_of_bands, len(state_columns)))
+    band = -1
+
+    for line in block_lines:
+        energy_match = energy_regex_object.search(line)
+
+        if energy_match is not None:
+            band += 1
+            energies[band] = float(energy_match.group(1))
+
+        elif band >= 0 and "*[#" in line:
+            for weight_match in weight_regex_object.finditer(line):
+                column = state_columns.get(int(weight_match.group(2)))
+                if column is not None:
+                    weights[band, column] = float(weight_match.group(1))
+
+    return energies, weights
+
+
+# Streams the kpdos output one k-point block at a time and writes the projected bands into a memory-mapped
+# .npy file. The rows have the same layout as the projbands file (k-length, E-EF and one column per stored state),
+# so the peak memory is bounded by the data of a single k-point instead of the size of the kpdos output.
+def stream_kpdos(kpdos_output_dir, projbands_npy_dir, stored_states, number_of_bands, number_of_k_points,
+    fermi_energy):
+
+    import numpy as np
+
+    state_columns = {state: i for i, state in enumerate(stored_states)}
+
+    projbands_data = np.lib.format.open_memmap(projbands_npy_dir, mode="w+", dtype=np.float64,
+        shape=(number_of_k_points * number_of_bands, 2 + len(stored_states)))
+
+    k_length = 0.0
+    previous_k_vector = None
+
+    with open_file(kpdos_output_dir, "r") as kpdos_output_file:
+        for k_index, (k_vector, block_lines) in enumerate(iterate_k_point_blocks(kpdos_output_file)):
+
+            # Measuring the length of the path in reciprocal space
+            if previous_k_vector is not None:
+                k_length += np.linalg.norm(k_vector - previous_k_vector)
+            previous_k_vector = k_vector
+
+            energies, weights = parse_k_point_block(block_lines, state_columns, number_of_bands)
+
+            rows = slice(k_index * number_of_bands, (k_index + 1) * number_of_bands)
+            projbands_data[rows, 0] = k_length
+            projbands_data[rows, 1] = energies - fermi_energy
+            projbands_data[rows, 2:] = weights
+
+    projbands_data.flush()
+
+    return projbands_data
+
+
+# Finds the byte offsets of all k-point blocks of the kpdos output in a single pass over the memory-mapped file.
+# The last offset marks the end of the file.
+def find_k_point_offsets(kpdos_output_dir):
+
+    with open(kpdos_output_dir, "rb") as kpdos_output_file:
+        with mmap.mmap(kpdos_output_file.fileno(), 0, access=mmap.ACCESS_READ) as kpdos_output_map:
+            k_point_offsets = [k_point_match.start() for k_point_match in
+                re.finditer(rb"^[ \t]*k =", kpdos_output_map, re.MULTILINE)]
+            k_point_offsets.append(len(kpdos_output_map))
+
+    return k_point_offsets
+
+
+# Parses a contiguous range of k-point blocks and writes them into the shared projbands .npy file.
+# This is the task run by each worker process of parse_kpdos_parallel and returns the k-vectors of its blocks.
+def parse_k_point_block_range(kpdos_output_dir, projbands_npy_dir, k_point_offsets, first_k_index, stored_states,
+    number_of_bands, fermi_energy):
+
+    import numpy as np
+
+    state_columns = {state: i for i, state in enumerate(stored_states)}
+    projbands_data = np.load(projbands_npy_dir, mmap_mode="r+")
+    k_vectors = []
+
+    with open(kpdos_output_dir, "rb") as kpdos_output_file:
+        with mmap.mmap(kpdos_output_file.fileno(), 0, access=mmap.ACCESS_READ) as kpdos_output_map:
+            for i in range(len(k_point_offsets) - 1):
+                block = kpdos_output_map[k_point_offsets[i]:k_point_offsets[i + 1]].decode("utf-8")
+                k_line, _, block_text = block.partition("\n")
+
+                k_point_match = k_point_regex_object.match(k_line)
+                if k_point_match is None:
+                    raise ValueError(f"The k-point line \"{k_line.strip()}\" of {kpdos_output_dir} cannot be parsed.")
+                k_vectors.append([float(k_point_match.group(j)) for j in range(1, 4)])
+
+                energies, weights = parse_k_point_block(block_text.splitlines(), state_columns, number_of_bands)
+
+                k_index = first_k_index + i
+                rows = slice(k_index * number_of_bands, (k_index + 1) * number_of_bands)
+                projbands_data[rows, 1] = energies - fermi_energy
+                projbands_data[rows, 2:] = weights
+
+    projbands_data.flush()
+
+    return k_vectors
+
+
+# Parses the kpdos output in parallel by splitting it on the k-point boundaries. The blocks are distributed
+# in contiguous ranges over a process pool and written into a shared memory-mapped .npy file in k order,
+# with the same layout as the file written by stream_kpdos.
+def parse_kpdos_parallel(kpdos_output_dir, projbands_npy_dir, stored_states, number_of_bands, number_of_processes,
+    fermi_energy):
+
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy as np
+
+    k_point_offsets = find_k_point_offsets(kpdos_output_dir)
+    number_of_k_points = len(k_point_offsets) - 1
+
+    projbands_data = np.lib.format.open_memmap(projbands_npy_dir, mode="w+", dtype=np.float64,
+        shape=(number_of_k_points * number_of_bands, 2 + len(stored_states)))
+    del projbands_data
+
+    # A few ranges per process to balance the load without too much scheduling overhead
+    number_of_ranges = max(1, min(number_of_k_points, 4 * number_of_processes))
+    range_bounds = np.linspace(0, number_of_k_points, number_of_ranges + 1).astype(int)
+
+    with ProcessPoolExecutor(max_workers=number_of_processes, mp_context=get_process_context()) as executor:
+        futures = [executor.submit(parse_k_point_block_range, kpdos_output_dir, projbands_npy_dir,
+            k_point_offsets[first:last + 1], first, stored_states, number_of_bands, fermi_energy)
+            for first, last in zip(range_bounds[:-1], range_bounds[1:]) if last > first]
+
+        k_vectors = np.array([k_vector for future in futures for k_vector in future.result()])
+
+    # Measuring the length of the path in reciprocal space
+    k_lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(k_vectors, axis=0), axis=1))])
+
+    projbands_data = np.load(projbands_npy_dir, mmap_mode="r+")
+    projbands_data[:, 0] = np.repeat(k_lengths, number_of_bands)
+    projbands_data.flush()
+
+    return projbands_data
+
+
+# Writes the list of atomic states stored in a streamed projbands file.
+# The format is the same as the header of the projbands file written by projwfc_to_bands.awk.
+def write_projbands_states(projbands_states_dir, stored_states):
+
+    with open(projbands_states_dir, "w") as projbands_states_file:
+        for state in stored_states:
+            projbands_states_file.write(f"#     state #{state:4d}:\n")
@@ -0,0 +1,116 @@
+import os
+import argparse
+import numpy as np
+from qic import get_calculation_files, read_projections
+from analysis_utils import read_fermi_energy, get_orbital_groups, classify_orbital_character
+from file_utils import atomic_output, find_file
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python orbital_character.py <compound name> [--soc] [--by element|orbital|atom]
+#
+# Classifies the orbital character of every k-point and band of the projected band structure of a compound: the
+# dominant group of atomic states (elements, orbitals of the elements such as Mo-d, or orbitals of the individual
+# atoms such as Mo1-d), its share of the projected weight, the entropy of the shares (0 for a pure orbital character
+# and ln(number of groups) for a completely mixed one) and the projectability (the total projected weight).
+# All the atomic states of the kpdos calculation are used, read from atomic_proj.xml if it exists and from the
+# standard output of projwfc.x otherwise.
+#
+# The table is written to a compact binary file next to the kpdos output (<compound><flag>.orbital_character.npz)
+# with one entry per k-point and band in the arrays k_index, band, k_distance, energy (relative to the Fermi energy),
+# dominant_group (the index into group_names, -1 without any weight), dominant_weight, entropy and projectability,
+# which can be read with numpy.load or qic.read_orbital_character.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Exports the dominant orbital character of the projected bands.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--soc", action="store_true", help="use the spin-orbit calculation")
+parser.add_argument("--by", choices=["element", "orbital", "atom"], default="orbital",
+    help="group the atomic states by element, by orbital of every element (default) or by orbital of every atom")
+args = parser.parse_args()
+
+print("Initializing...\n")
+
+compound_name = args.compound_name  # Taking the name of the compound of interest
+spin_orbit_flag = "_soc" if args.soc else ""
+root_dir = os.path.abspath("../")  # The root directory of the project
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
+
+calculation_files = get_calculation_files(compound_name, root_dir, args.soc)
+kpdos_output_dir = calculation_files["kpdos_output"]
+orbital_character_dir = f"{kpdos_output_dir.split('.kpdos.out')[0]}.orbital_character.npz"
+
+if find_file(kpdos_output_dir) is None:
+    print(f"ERROR: The kpdos output {kpdos_output_dir} was not found.")
+    exit(1)
+
+fermi_energy = read_fermi_energy(project_dir, compound_name, args.soc)
+if fermi_energy is None:
+    print("WARNING: The Fermi energy was not found. The energies are written as they are.\n")
+
+# READING THE PROJECTIONS
+# ============================================================================================================================
+
+if find_file(calculation_files["atomic_proj"]) is not None:
+    print(f"Reading the projections from {os.path.relpath(calculation_files['atomic_proj'], project_dir)}...")
+else:
+    print(f"Reading the projections from {os.path.relpath(kpdos_output_dir, project_dir)}...")
+
+projections = read_projections(kpdos_output_dir, calculation_files["atomic_proj"])
+number_of_k_points, number_of_bands, number_of_atomic_states = projections["weights"].shape
+
+group_names, state_groups = get_orbital_groups(projections["header"], args.by)
+if len(state_groups) != number_of_atomic_states:
+    print(f"ERROR: {len(state_groups)} atomic states were found in the header of the kpdos output instead of \
+{number_of_atomic_states}.")
+    exit(1)
+
+print(f"{number_of_k_points} k-points, {number_of_bands} bands and {number_of_atomic_states} atomic states in \
+{len(group_names)} groups: {' '.join(group_names)}\n")
+
+# CLASSIFYING THE BANDS
+# ============================================================================================================================
+
+print("Classifying the orbital character of the bands...\n")
+
+orbital_character = classify_orbital_character(projections["weights"], state_groups, len(group_names))
+
+energies = projections["energies"] - (fermi_energy if fermi_energy is not None else 0.0)
+k_indices, bands = np.indices((number_of_k_points, number_of_bands))
+
+# Printing how many of the states are dominated by every group, in total and within 1 eV of the Fermi energy
+near_fermi_energy = np.abs(energies) < 1.0
+print(f"{'group':<12} {'states':>8} {'near E_F':>9}")
+for i, group_name in enumerate(group_names):
+    dominated = orbital_character["dominant_groups"] == i
+    print(f"{group_name:<12} {np.count_nonzero(dominated):>8} {np.count_nonzero(dominated & near_fermi_energy):>9}")
+
+print(f"\nAverage entropy {np.mean(orbital_character['entropies']):.3f} (at most {np.log(len(group_names)):.3f}), \
+average projectability {np.mean(orbital_character['total_weights']):.3f}.\n")
+
+# WRITING THE TABLE
+# ============================================================================================================================
+
+print(f"Writing the table to {orbital_character_dir}...")
+
+with atomic_output(orbital_character_dir) as temp_orbital_character_dir:
+    with open(temp_orbital_character_dir, "wb") as orbital_character_file:
+        np.savez_compressed(orbital_character_file,
+            group_names=np.array(group_names),
+            fermi_energy=np.float64(fermi_energy if fermi_energy is not None else np.nan),
+            k_index=k_indices.ravel().astype(np.int32),
+            band=bands.ravel().astype(np.int32),
+            k_distance=projections["k_points"][k_indices].ravel().astype(np.float32),
+            energy=energies.ravel().astype(np.float32),
+            dominant_group=orbital_character["dominant_groups"].ravel().astype(np.int16),
+            dominant_weight=orbital_character["dominant_shares"].ravel().astype(np.float32),
+            entropy=orbital_character["entropies"].ravel().astype(np.float32),
+            projectability=orbital_character["total_weights"].ravel().astype(np.float32))
+
+print(f"Done ({os.path.getsize(orbital_character_dir) / 1024:.1f} kB).")
@@ -0,0 +1,150 @@
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from file_utils import file_lock, atomic_output, compressed_extensions, find_file, open_file
+
+
+# Utilities for the projected densities of states written by projwfc.x: finding and reading the pdos files, aggregating
+# them by element, orbital and j with a cache next to them, and selecting projections. Used by plot_pdos.py and qic.py.
+# These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The name of a pdos file written by projwfc.x, e.g. "MoS2.pdos_atm#1(Mo)_wfc#3(d)" or "MoS2.pdos_atm#1(Mo)_wfc#3(d_j2.5)",
+# possibly compressed (e.g. "MoS2.pdos_atm#1(Mo)_wfc#3(d).gz")
+pdos_filename_regex_object = re.compile(r"\.pdos_atm#(\d+)\((\w+)\)_wfc#(\d+)\(([spdf])(?:_j(\d\.\d))?\)"
+    + f"(?:{'|'.join(re.escape(extension) for extension in compressed_extensions)})?$")
+
+
+# Finds the pdos files of every atom and orbital in a calculation directory.
+# Returns the paths of the files and the "<element>-<orbital>" or "<element>-<orbital>_j<j>" label of each file.
+def find_pdos_files(pdos_dir, filpdos):
+
+    pdos_file_dir_list = []
+    pdos_label_list = []
+
+    for filename in sorted(os.listdir(pdos_dir)):
+        pdos_filename_match = pdos_filename_regex_object.search(filename)
+
+        if filename.startswith(f"{filpdos}.pdos_atm#") and pdos_filename_match is not None:
+            pdos_label = f"{pdos_filename_match.group(2)}-{pdos_filename_match.group(4)}"
+            if pdos_filename_match.group(5) is not None:
+                pdos_label += f"_j{pdos_filename_match.group(5)}"
+
+            pdos_file_dir_list.append(os.path.join(pdos_dir, filename))
+            pdos_label_list.append(pdos_label)
+
+    return pdos_file_dir_list, pdos_label_list
+
+
+# Finds the file of the total dos of a calculation (<filpdos>.pdos_tot, possibly compressed).
+# Raises FileNotFoundError if it does not exist.
+def find_pdos_total_file(pdos_dir, filpdos):
+
+    pdos_total_dir = find_file(os.path.join(pdos_dir, f"{filpdos}.pdos_tot"))
+    if pdos_total_dir is None:
+        raise FileNotFoundError(f"No such file: '{os.path.join(pdos_dir, f'{filpdos}.pdos_tot')}'")
+
+    return pdos_total_dir
+
+
+# Reads a pdos file (possibly compressed) with a single bulk numeric conversion instead of parsing it line by line
+def read_pdos_file(pdos_file_dir):
+
+    with open_file(pdos_file_dir, "rb") as pdos_file:
+        pdos_file.readline()  # The header of the columns
+        pdos_file_content = pdos_file.read()
+
+    number_of_columns = len(pdos_file_content.split(b"\n", 1)[0].split())
+
+    return np.fromstring(pdos_file_content, sep=" ").reshape(-1, number_of_columns)
+
+
+# Computes a signature of the pdos files from their names, sizes and modification times
+def get_pdos_files_signature(pdos_file_dir_list):
+
+    pdos_files_signature = hashlib.sha1()
+    for pdos_file_dir in pdos_file_dir_list:
+        pdos_file_stat = os.stat(pdos_file_dir)
+        pdos_files_signature.update(f"{os.path.basename(pdos_file_dir)}:{pdos_file_stat.st_size}:\
+{pdos_file_stat.st_mtime_ns}\n".encode("utf-8"))
+
+    return pdos_files_signature.hexdigest()
+
+
+# Reads the pdos files of a calculation concurrently and sums their ldos columns by element, orbital and j.
+# The aggregated arrays are cached in a .npz file, which is reused as long as the pdos files do not change.
+# For k-resolved files, the total dos and the aggregated pdos are reshaped to (number of k-points, number of energies).
+def aggregate_pdos(pdos_dir, filpdos, pdos_cache_dir, number_of_threads, k_resolved=False):
+
+    pdos_file_dir_list, pdos_label_list = find_pdos_files(pdos_dir, filpdos)
+
+    if len(pdos_file_dir_list) == 0:
+        raise FileNotFoundError(f"No pdos files found in {pdos_dir}")
+
+    pdos_total_dir = find_pdos_total_file(pdos_dir, filpdos)
+
+    # Only one job creates the cache at a time and it is written atomically, so it is never partially written
+    with file_lock(pdos_cache_dir):
+        pdos_files_signature = get_pdos_files_signature(pdos_file_dir_list + [pdos_total_dir])
+
+        if os.path.exists(pdos_cache_dir):
+            with np.load(pdos_cache_dir) as pdos_cache:
+                if str(pdos_cache["signature"]) == pdos_files_signature:
+                    print(f"Using the cached pdos data in {os.path.basename(pdos_cache_dir)}...")
+                    return {key: pdos_cache[key] for key in ("energies", "total", "labels", "pdos")}
+
+        print(f"Reading {len(pdos_file_dir_list)} pdos files with {number_of_threads} threads...")
+
+        with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+            pdos_data_list = list(executor.map(read_pdos_file, pdos_file_dir_list + [pdos_total_dir]))
+
+        pdos_total_data = pdos_data_list.pop()
+
+        # The k-resolved files have the index of the k-point as their first column
+        energy_column = 1 if k_resolved else 0
+
+        # The ldos column of every file, i.e. the pdos summed over m or m_j
+        ldos = np.stack([pdos_data[:, energy_column + 1] for pdos_data in pdos_data_list])
+
+        # Summing the files with the same label with a single matrix product
+        labels, label_indices = np.unique(pdos_label_list, return_inverse=True)
+        label_matrix = np.zeros((len(labels), len(pdos_label_list)))
+        label_matrix[label_indices, np.arange(len(pdos_label_list))] = 1
+
+        aggregated_pdos = {
+            "energies": pdos_total_data[:, energy_column],
+            "total": pdos_total_data[:, energy_column + 1],
+            "labels": labels,
+            "pdos": label_matrix @ ldos
+        }
+
+        # The energy grid is the same for every k-point
+        if k_resolved:
+            number_of_k_points = int(pdos_total_data[-1, 0])
+            aggregated_pdos["energies"] = aggregated_pdos["energies"][:len(pdos_total_data) // number_of_k_points]
+            aggregated_pdos["total"] = aggregated_pdos["total"].reshape(number_of_k_points, -1)
+            aggregated_pdos["pdos"] = aggregated_pdos["pdos"].reshape(len(labels), number_of_k_points, -1)
+
+        with atomic_output(pdos_cache_dir) as temp_pdos_cache_dir:
+            np.savez(temp_pdos_cache_dir, signature=pdos_files_signature, **aggregated_pdos)
+
+        return aggregated_pdos
+
+
+# Sums the aggregated pdos over the labels matching a selection, e.g. "Mo" (all orbitals), "Mo-d" (all j) or "Mo-d_j2.5"
+def select_pdos(aggregated_pdos, selection):
+
+    labels = aggregated_pdos["labels"]
+
+    if '-' not in selection:
+        condition = np.char.startswith(labels, f"{selection}-")
+    elif "_j" in selection:
+        condition = labels == selection
+    else:
+        condition = (labels == selection) | np.char.startswith(labels, f"{selection}_j")
+
+    return np.tensordot(condition.astype(float), aggregated_pdos["pdos"], axes=1), np.any(condition)
@@ -1,15 +1,24 @@
 import os
-from sys import argv
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 import re
 from subprocess import run, CalledProcessError
-from matplotlib.collections import LineCollection
+from qe_xml import get_xml_dir, read_xml_metadata, read_atomic_proj
+from kpdos_parser import read_kpdos_header, get_number_of_k_points, stream_kpdos, parse_kpdos_parallel, \
+    write_projbands_states, resolve_atomic_projection_indices
+from file_utils import file_lock, atomic_output, find_file, open_file
+from bands_utils import energy_window_margin, find_bands_in_window, read_bands_file
 
 
 # Usage: the following python script should be run with command line arguments in the following way:
 #
-# python plotting_pbands.py <compound name>
+# python plotting_pbands.py <compound name> [--stream] [--parallel [N]] [--raster] [--window EMIN EMAX] [--margin M]
+#
+# With --stream, the kpdos output is parsed one k-point at a time into a memory-mapped file instead of using awk.
+# With --parallel, the k-points are parsed by N processes (all cores by default) into the same memory-mapped file.
+# With --raster, the bands are drawn as density images instead of line segments, which is much faster for many bands.
+# Only the bands entering the energy window (-3 to 3 eV around the Fermi energy by default) plus a margin are kept.
+# The outputs can be compressed (.gz, .xz or .zst). A compressed kpdos output is always streamed by a single process.
 #
 # For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
 
@@ -17,13 +26,35 @@ from matplotlib.collections import LineCollection
 # INITIALIZATION
 # ============================================================================================================================
 
+parser = argparse.ArgumentParser(description="Plots the projected band structure of a compound.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--stream", action="store_true",
+    help="parse the kpdos output one k-point at a time with bounded memory (recommended for large outputs)")
+parser.add_argument("--parallel", type=int, nargs="?", const=os.cpu_count(), default=None, metavar="N",
+    help="parse the kpdos output with N processes (all cores if N is not given)")
+parser.add_argument("--raster", action="store_true",
+    help="draw the bands as density images (one per orbital) instead of line segments")
+parser.add_argument("--window", type=float, nargs=2, default=[-3.0, 3.0], metavar=("EMIN", "EMAX"),
+    help="the plotted energy window relative to the Fermi energy in eV (default: -3 3)")
+parser.add_argument("--margin", type=float, default=energy_window_margin, metavar="M",
+    help=f"keep the bands within M eV of the energy window too (default: {energy_window_margin})")
+args = parser.parse_args()
+
+if args.parallel is not None and args.parallel < 1:
+    parser.error("the number of processes of --parallel must be at least 1")
+
 print("Initializing...\n")
 
-compound_name = argv[1]  # Taking the name of the compound of interest
+compound_name = args.compound_name  # Taking the name of the compound of interest
+streaming_mode = args.stream or args.parallel is not None  # Whether to parse the kpdos output into a memory-mapped file
+number_of_processes = args.parallel  # The number of processes for parsing the kpdos output in parallel
+raster_mode = args.raster  # Whether to draw the bands as density images
+energy_window = args.window  # The plotted energy window relative to the Fermi energy
+energy_window_margin = args.margin  # The bands within this distance of the energy window are kept
 fermi_energy = 0.0
 number_of_bands = 0  # Declaring the variable
 root_dir = os.path.abspath("../")  # The root directory of the project
-project_dir = os.path.join(root_dir, argv[1])  # The calculation directory
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
 
 # Directory of scf calculation
 scf_dir_list = [
@@ -71,19 +102,36 @@ for scf_dir, pband_dir, pdos_dir, flag in zip(scf_dir_list, pbands_dir_list, pdo
     scf_output_dir_list.append(os.path.join(project_dir,
         os.path.join(scf_dir, f"{compound_name}_scf{flag}.pw.out")))  # The output of Quantum ESPRESSO nscf calculation
 
+# A compressed kpdos output is decompressed while it is streamed, since awk and the memory-mapped parallel parser
+# can only read plain files
+if any(find_file(kpdos_output_dir) not in (None, kpdos_output_dir) for kpdos_output_dir in kpdos_output_dir_list):
+    if not streaming_mode or number_of_processes is not None:
+        print("The kpdos output is compressed. Streaming it with a single process...")
+    streaming_mode = True
+    number_of_processes = None
+
 # Getting the number of bands from Quantum ESPRESSO calculation
 # ----------------------------------------------------------------------------------------------------------------------------
 
 # List of band numbers for spin-orbit and non spin-orbit case
 number_of_bands_list = []
 skip_soc = False  # Whether to skip the spin-orbit case
-for bands_output_dir, flag in zip(pw_bands_output_dir_list, spin_orbit_flag):
+for bands_output_dir, pband_dir, flag in zip(pw_bands_output_dir_list, pbands_dir_list, spin_orbit_flag):
+
+    # Preferring the XML output of pw.x over the standard output
+    xml_metadata = read_xml_metadata(pband_dir, compound_name)
+    if xml_metadata is not None and xml_metadata["number_of_bands"] is not None:
+        number_of_bands = xml_metadata["number_of_bands"]
+        number_of_bands_list.append(number_of_bands)
+
+        print(f"Band number extracted successfully. There are {number_of_bands} bands in this calculation.\n")
+        continue
 
     print(f"Reading {compound_name}_bands{flag}.pw.out...")
     try:
 
         # Reading the output of Quantum ESPRESSO pw.x bands calculation
-        band_output_file = open(bands_output_dir, "r")
+        band_output_file = open_file(bands_output_dir, "r")
         bands_calculation_output = band_output_file.read()
         band_output_file.close()
 
@@ -118,14 +166,25 @@ in the directory of the project.")
 # List of Fermi energies for spin-orbit and non spin-orbit case
 fermi_energy_list = []
 
-for scf_output_dir, nscf_output_dir, flag in zip(scf_output_dir_list, nscf_output_dir_list, spin_orbit_flag):
+for scf_output_dir, nscf_output_dir, pdos_dir, flag in zip(scf_output_dir_list, nscf_output_dir_list, pdos_dir_list,
+spin_orbit_flag):
 
     print("Getting Fermi energy...")
+
+    # Preferring the XML output of the nscf calculation over the standard output
+    xml_metadata = read_xml_metadata(pdos_dir, compound_name)
+    if xml_metadata is not None and xml_metadata["fermi_energy"] is not None:
+        fermi_energy = xml_metadata["fermi_energy"]
+        fermi_energy_list.append(fermi_energy)
+
+        print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n")
+        continue
+
     print(f"Reading {compound_name}_nscf{flag}.pw.out...")
     try:
 
         # Reading the output of Quantum ESPRESSO nscf calculation
-        nscf_output_file = open(nscf_output_dir, "r")
+        nscf_output_file = open_file(nscf_output_dir, "r")
         nscf_calculation_output = nscf_output_file.read()
         nscf_output_file.close()
 
@@ -143,14 +202,14 @@ for scf_output_dir, nscf_output_dir, flag in zip(scf_output_dir_list, nscf_outpu
         if skip_soc:
             print("Spin-orbit was set to be skipped. Continuing...")
         else:
-            if os.path.exists(scf_output_dir):
+            if find_file(scf_output_dir) is not None:
                 try:
 
                     print("No nscf calculation found.\n")
                     print(f"Reading {compound_name}_scf{flag}.pw.out...")
 
                     # Reading the output of Quantum ESPRESSO scf calculation
-                    scf_output_file = open(scf_output_dir, "r")
+                    scf_output_file = open_file(scf_output_dir, "r")
                     scf_calculation_output = scf_output_file.read()
                     scf_output_file.close()
 
@@ -172,74 +231,10 @@ in the directory of the project.")
 in the directory of the project.")
                 exit(1)
 
-# Extracting projected bands from Quantum ESPRESSO calculation
+# Getting the desired atomic projections from the user
 # ----------------------------------------------------------------------------------------------------------------------------
 
-# List of the numbers of atomic states for spin-orbit and non spin-orbit case
-number_of_atomic_states_list = []
-kpdos_calculation_output_list = []
-
-for kpdos_output_dir, projbands_dir, fermi_energy, flag in zip(kpdos_output_dir_list, projbands_dir_list,
-fermi_energy_list, spin_orbit_flag):
-
-    print(f"Reading {compound_name}{flag}.kpdos.out...")
-    print("Getting the number of bands...")
-
-    try:
-
-        # Reading the output of kpdos calculation
-        kpdos_output_file = open(kpdos_output_dir, "r")
-        kpdos_calculation_output = kpdos_output_file.read()
-        kpdos_calculation_output_list.append(kpdos_calculation_output)
-        kpdos_output_file.close()
-
-        # Extracting the atomic states from output
-        atomic_state_number_regex_pattern = r"natomwfc =\s+(\d+)"
-        atomic_state_number_regex_object = re.compile(atomic_state_number_regex_pattern)
-        atomic_state_number_matches = atomic_state_number_regex_object.finditer(kpdos_calculation_output)
-
-        print("Getting the number of atomic states...")
-
-        number_of_atomic_states = int(next(atomic_state_number_matches).group(1))
-        number_of_atomic_states_list.append(number_of_atomic_states)
-
-        print(f"There are {number_of_atomic_states} atomic states.")
-        print("Calculating projected bands...\n")
-
-        # Avoiding unnecessary execution of awk script
-        if not os.path.exists(projbands_dir):
-
-            try:
-                run(f"awk -v firststate=1 -v laststate={number_of_atomic_states} -v ef={fermi_energy} \
-                    -f ./projwfc_to_bands.awk {kpdos_output_dir} > {projbands_dir}", shell=True, check=True,
-                    capture_output=True)
-
-                print("Initialization done.\n")
-
-            # Catching the error message
-            except CalledProcessError as e:
-                print("An error occurred in projected bands calculation. See below for details:\n")
-                print((e.stderr).decode("utf-8"))
-                exit(1)
-
-        else:
-            print(f"File {compound_name}{flag}.projbands already exists!")
-            print("Initialization done.\n")
-
-    except FileNotFoundError:
-        if flag == "_soc":
-            if not skip_soc:
-                print(f"File \"{compound_name}{flag}.kpdos.out\" does not exist. Make sure the file name is correct or \
-in the directory of the project.")
-                exit(1)
-        else:
-            print(f"File \"{compound_name}{flag}.kpdos.out\" does not exist. Make sure the file name is correct or \
-in the directory of the project.")
-            exit(1)
-
-# PREPROCESSING
-# ============================================================================================================================
-
+# The projections are resolved before extracting the projected bands, so that only the required atomic states are parsed
 print("Preparing the atomic projection list for plotting projected bands...")
 
 print('''
@@ -267,329 +262,291 @@ while failure:
         for atomic_projection in atomic_projections:
             atomic_projection_list.append(atomic_projection.split('-'))
 
-        # Atomic orbitals and their corresponding orbital numbers
-        orbital_info = {
-            "s": [
-                "l=0 m= 1",
-                "l=0 j=0.5 m_j=-0.5", "l=0 j=0.5 m_j= 0.5"
-            ],
-
-            "p": [
-                "l=1 m= 1", "l=1 m= 2", "l=1 m= 3",
-                "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
-                "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
-            ],
-
-            "pz": [
-                "l=1 m= 1",
-                "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5",
-                "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5"
-            ],
-            "px": [
-                "l=1 m= 2",
-                "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
-                "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
-            ],
-            "py": [
-                "l=1 m= 3",
-                "l=1 j=0.5 m_j=-0.5", "l=1 j=0.5 m_j= 0.5", "l=1 j=1.5 m_j=-1.5",
-                "l=1 j=1.5 m_j=-0.5", "l=1 j=1.5 m_j= 0.5", "l=1 j=1.5 m_j= 1.5"
-            ],
-
-            "d": [
-                "l=2 m= 1", "l=2 m= 2", "l=2 m= 3", "l=2 m= 4", "l=2 m= 5",
-                "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5", "l=2 j=2.5 m_j=-2.5",
-                "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=2.5 m_j= 2.5"
-            ],
-
-            "dz2": [
-                "l=2 m= 1",
-                "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5",
-                "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5"
-            ],
-
-            "dxz": [
-                "l=2 m= 2",
-                "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5",
-                "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5"
-            ],
-
-            "dyz": [
-                "l=2 m= 3",
-                "l=2 j=2.5 m_j=-1.5", "l=2 j=2.5 m_j=-0.5", "l=2 j=2.5 m_j= 0.5", "l=2 j=2.5 m_j= 1.5",
-                "l=2 j=1.5 m_j=-1.5", "l=2 j=1.5 m_j=-0.5", "l=2 j=1.5 m_j= 0.5", "l=2 j=1.5 m_j= 1.5"
-            ],
-
-            "dx2y2": [
-                "l=2 m= 4",
-                "l=2 j=2.5 m_j=-2.5", "l=2 j=2.5 m_j=-1.5", "l=2 j=1.5 m_j=-1.5",
-                "l=2 j=2.5 m_j= 2.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=1.5 m_j= 1.5"
-            ],
-
-            "dxy": [
-                "l=2 m= 5",
-                "l=2 j=2.5 m_j=-2.5", "l=2 j=2.5 m_j=-1.5", "l=2 j=1.5 m_j=-1.5",
-                "l=2 j=2.5 m_j= 2.5", "l=2 j=2.5 m_j= 1.5", "l=2 j=1.5 m_j= 1.5"
-            ]
-        }
-
-        atomic_projection_indices_info_list = []
-
-        for kpdos_calculation_output in kpdos_calculation_output_list:
-
-            # Atomic projections and their respective indices in the projbands file
-            atomic_projection_indices_info = dict()
-
-            for atomic_projection in atomic_projection_list:
-                projection_indices_list = []
-
-                for orbital in orbital_info[atomic_projection[1]]:
-
-                    # Getting the index of all atomic states given by user input
-                    atomic_state_regex_pattern = rf"state #\s+(\d+): atom\s+\d+ \({atomic_projection[0]}\s+\), wfc\s+\d+ \({orbital}\)"
-                    atomic_state_regex_object = re.compile(atomic_state_regex_pattern)
-                    atomic_state_number_matches = atomic_state_regex_object.finditer(kpdos_calculation_output)
-
-                    for atomic_state in atomic_state_number_matches:
-                        projection_indices_list.append(int(atomic_state.group(1)))
-                projection_indices_list.sort()
-
-                # px and py orbitals have the same contribution
-                if atomic_projection[1] == "px" or atomic_projection[1] == "py":
-                    if "px+py" not in atomic_projection_indices_info.keys():
-                        atomic_projection_indices_info.update({f"{atomic_projection[0]}-px+py": projection_indices_list})
-
-                # dxz and dyz orbitals have the same contribution
-                elif atomic_projection[1] == "dxz" or atomic_projection[1] == "dyz":
-                    if "dxz+dyz" not in atomic_projection_indices_info.keys():
-                        atomic_projection_indices_info.update({f"{atomic_projection[0]}-dxz+dyz": projection_indices_list})
-
-                # dx2y2 and dxy orbitals have the same contribution
-                elif atomic_projection[1] == "dx2y2" or atomic_projection[1] == "dxy":
-                    if "dx2y2+dxy" not in atomic_projection_indices_info.keys():
-                        atomic_projection_indices_info.update({f"{atomic_projection[0]}-dx2y2+dxy": projection_indices_list})
+# Reads the atomic states stored in an existing projbands file, in the order of their columns
+def read_projbands_states(projbands_dir):
 
-                else:
-                    atomic_projection_indices_info.update({f"{atomic_projection[0]}-{atomic_projection[1]}":
-                    projection_indices_list})
+    projbands_states = []
+    projbands_state_regex_object = re.compile(r"#\s+state #\s*(\d+):")
 
-            atomic_projection_indices_info_list.append(atomic_projection_indices_info)
+    with open(projbands_dir, "r") as projbands_file:
 
-# PLOTTING THE DATA
-# ============================================================================================================================
-
-projbands_data_list = []
-k_points_proj_list = []
-k_points_list = []
-Energy_proj_list = []
-Energy_list = []
+        # The stored atomic states are listed in the header of the file
+        for line in projbands_file:
+            if not line.startswith("#"):
+                break
 
-for projbands_dir, bands_dir, number_of_bands, fermi_energy \
-    in zip(projbands_dir_list, bands_dir_list, number_of_bands_list, fermi_energy_list):
+            projbands_state_match = projbands_state_regex_object.match(line)
+            if projbands_state_match is not None:
+                projbands_states.append(int(projbands_state_match.group(1)))
 
-    # Reading the projected bands file
-    projbands_data = np.loadtxt(projbands_dir)
-    projbands_data_list.append(projbands_data)
+    return projbands_states
 
-    k_points_proj = np.unique(projbands_data[:, 1])
-    k_points_proj_list.append(k_points_proj)
+# Extracting projected bands from Quantum ESPRESSO calculation
+# ----------------------------------------------------------------------------------------------------------------------------
 
-    Energy_proj = np.reshape(projbands_data[:, 2], (-1, number_of_bands))
-    Energy_proj_list.append(Energy_proj)
+# List of the numbers of atomic states for spin-orbit and non spin-orbit case
+number_of_atomic_states_list = []
+atomic_projection_indices_info_list = []
+requested_states_list = []  # The atomic states needed for the requested projections
+projbands_states_list = []  # The atomic states stored in the projbands files, in the order of their columns
 
-    bands_data = np.loadtxt(os.path.join(project_dir, bands_dir))
+projbands_xml_data_list = []  # The projected bands read from the XML output of projwfc.x, if available
 
-    k_points = np.unique(bands_data[:, 0])
-    k_points_list.append(k_points)
+for kpdos_output_dir, projbands_dir, pband_dir, fermi_energy, number_of_bands, flag in zip(kpdos_output_dir_list,
+projbands_dir_list, pbands_dir_list, fermi_energy_list, number_of_bands_list, spin_orbit_flag):
 
-    Energy = np.reshape(bands_data[:, 1], (-1, len(k_points))) - fermi_energy
-    Energy_list.append(Energy)
+    print(f"Reading {compound_name}{flag}.kpdos.out...")
+    print("Getting the number of bands...")
 
-# Calculating the total weights
-# ----------------------------------------------------------------------------------------------------------------------------
+    try:
 
-#Calculates the weights of the specified orbitals from the projbands data
-def calculate_total_weights(data, atomic_state_indices, number_of_bands):
-    total_orbital_weights = np.zeros(len(data[:, 0]))
-    for atomic_state_index in atomic_state_indices:
-        # The first 4 columns are not the weights
-        total_orbital_weights += data[:, atomic_state_index + 3]
+        # Reading the header of the kpdos output. The projections are only parsed once the requested states are known.
+        kpdos_calculation_output = read_kpdos_header(kpdos_output_dir)
 
-    total_orbital_weights_reshaped = np.reshape(total_orbital_weights, (-1, number_of_bands))
-    return total_orbital_weights_reshaped
+        # Extracting the atomic states from output
+        atomic_state_number_regex_pattern = r"natomwfc =\s+(\d+)"
+        atomic_state_number_regex_object = re.compile(atomic_state_number_regex_pattern)
+        atomic_state_number_matches = atomic_state_number_regex_object.finditer(kpdos_calculation_output)
 
-atomic_projection_weights_info_list = []
+        print("Getting the number of atomic states...")
 
-for atomic_projection_indices_info, projbands_data, number_of_bands \
-    in zip(atomic_projection_indices_info_list, projbands_data_list, number_of_bands_list):
+        number_of_atomic_states = int(next(atomic_state_number_matches).group(1))
+        number_of_atomic_states_list.append(number_of_atomic_states)
 
-    atomic_projection_weights_info = dict()
-    Energy = np.reshape(bands_data[:, 1], (-1, len(k_points)))
+        print(f"There are {number_of_atomic_states} atomic states.")
+        print("Resolving the requested atomic projections...")
 
-    elements_list = [atomic_projection[0] for atomic_projection in atomic_projection_list]
-    unique_elements_list = [item for i, item in enumerate(elements_list) if item not in elements_list[:i]]
+        atomic_projection_indices_info = resolve_atomic_projection_indices(kpdos_calculation_output,
+        atomic_projection_list)
+        atomic_projection_indices_info_list.append(atomic_projection_indices_info)
 
-    number_of_subplots = len(unique_elements_list) + 1
+        requested_states = sorted({state for indices in atomic_projection_indices_info.values() for state in indices})
+        requested_states_list.append(requested_states)
 
-    for atomic_projection, indices in atomic_projection_indices_info.items():
-        total_orbital_weight = calculate_total_weights(projbands_data, indices, number_of_bands)
-        atomic_projection_weights_info.update({f"{atomic_projection}": total_orbital_weight})
+        if len(requested_states) == 0:
+            print("ERROR: None of the requested projections matches an atomic state of the kpdos output.")
+            exit(1)
 
-    atomic_projection_weights_info_list.append(atomic_projection_weights_info)
+        print(f"{len(requested_states)} of {number_of_atomic_states} atomic states are needed for the requested projections.")
+        print("Calculating projected bands...\n")
 
-# Initializing the plotting parameters
-# ----------------------------------------------------------------------------------------------------------------------------
+        # Preferring the projections of the XML output of projwfc.x over parsing the standard output
+        projbands_xml_data = None
+        projbands_xml_dir = get_xml_dir(pband_dir, compound_name, "atomic_proj.xml")
 
-# Read from bands.out file
-high_symmetry_k_points = [0.0000, 0.5774, 0.9107, 1.5774]
+        if find_file(projbands_xml_dir) is not None:
+            print(f"Reading the projections from {os.path.relpath(projbands_xml_dir, pband_dir)}...")
+            try:
+                projbands_xml_data = read_atomic_proj(projbands_xml_dir, requested_states, fermi_energy)
+            except ValueError as e:
+                print(f"{e}\nFalling back to the standard output...")
 
-k_labels = [r"$\Gamma$", r"$M$", r"$K$", r"$\Gamma$"]
+        projbands_xml_data_list.append(projbands_xml_data)
 
-def init_plot(ax, xlabel, ylabel, title, xtick_points,
-    xtick_labels):
+        # The streamed projected bands are stored in a .npy file and their atomic states in a separate file
+        if streaming_mode:
+            projbands_data_dir = f"{projbands_dir}.npy"
+            projbands_states_dir = f"{projbands_dir}.states"
+        else:
+            projbands_data_dir = projbands_dir
+            projbands_states_dir = projbands_dir
 
-    ax.set_xlabel(xlabel)
-    ax.set_ylabel(ylabel)
-    ax.set_title(title)  # Edit the title
-    ax.set_xticks(xtick_points, xtick_labels)
+        if projbands_xml_data is not None:
+            projbands_states = requested_states
+            print("Initialization done.\n")
 
-def plot_bands(ax, xdata, ydata, data_label="data", color="blue"):
+        else:
 
-    label = ax.scatter([], [], label=data_label, color=color)
+            # Only one job creates the projected bands file at a time. The others wait for it and then reuse it.
+            with file_lock(projbands_data_dir):
 
-    for band in range(len(Energy)):
-        ax.plot(xdata, ydata[band, :], color=color)
+                # Avoiding unnecessary parsing of the kpdos output if the existing file already contains the requested states
+                projbands_states = []
+                if os.path.exists(projbands_data_dir) and os.path.exists(projbands_states_dir):
+                    projbands_states = read_projbands_states(projbands_states_dir)
 
-    return label
+                if len(projbands_states) > 0 and set(requested_states).issubset(projbands_states):
+                    print(f"File {os.path.basename(projbands_data_dir)} already exists!")
+                    print("Initialization done.\n")
 
-def plot_projbands(ax, xdata, ydata, orbital_weights, number_of_bands, spin_orbit = True, data_label="data", color="blue"):
+                else:
 
-    label = ax.scatter([], [], label=data_label, color=color)
+                    # Keeping the atomic states of the existing file, so the jobs using it still find theirs
+                    stored_states = sorted(set(requested_states) | set(projbands_states))
 
-    # Filtering the non-zero weights
-    condition = orbital_weights != 0
+                    if streaming_mode:
 
-    # Plotting the bands
-    for band in range(number_of_bands):
+                        # Removing the list of states first, so it never describes the data of another file
+                        if os.path.exists(projbands_states_dir):
+                            os.remove(projbands_states_dir)
 
-        x = xdata[condition[:, band]]
-        y = ydata[condition[:, band], band].T
-        weights = orbital_weights[condition[:, band], band]
-        weights = 3 * weights[:-1]  # Multiplying the weights by a scaling factor to get thicker bands
-        points = np.array([x, y]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([points[:-1], points[1:]], axis=1)
-        if spin_orbit:
-            line_collections = LineCollection(segments, linewidths=weights, color=color, alpha=0.45)
-        else:
-            line_collections = LineCollection(segments, linewidths=weights, color=color)
+                        with atomic_output(projbands_data_dir) as temp_projbands_data_dir:
+                            if number_of_processes is not None:
+                                print(f"Parsing the k-points into {compound_name}{flag}.projbands.npy with \
+{number_of_processes} processes...")
 
-        ax.add_collection(line_collections)
+                                parse_kpdos_parallel(kpdos_output_dir, temp_projbands_data_dir, stored_states,
+                                    number_of_bands, number_of_processes, fermi_energy)
+                            else:
+                                number_of_k_points = get_number_of_k_points(kpdos_output_dir, kpdos_calculation_output)
+                                print(f"Streaming {number_of_k_points} k-points into {compound_name}{flag}.projbands.npy...")
 
-    return label
+                                stream_kpdos(kpdos_output_dir, temp_projbands_data_dir, stored_states, number_of_bands,
+                                    number_of_k_points, fermi_energy)
 
-orbital_plot_color_info = {
-    "s": "magenta",
-    "p": "green",
-    "d": "red",
-    "pz": "blue",
-    "px+py": "green",
-    "dz2": "blue",
-    "dxz+dyz": "green",
-    "dx2y2+dxy": "red"
-}
+                        with atomic_output(projbands_states_dir) as temp_projbands_states_dir:
+                            write_projbands_states(temp_projbands_states_dir, stored_states)
 
-atomic_projection_plot_info_list = []
+                        projbands_states = stored_states
 
-for atomic_projection_weights_info in atomic_projection_weights_info_list:
+                        print("Initialization done.\n")
 
-    atomic_projection_plot_info = dict()
+                    else:
 
-    for i in range(len(unique_elements_list)):
-        orbitals_list = []
-        orbitals_plot_color_list = []
-        orbital_weights_list = []
-        atomic_projections_list = []
+                        try:
+                            with atomic_output(projbands_dir) as temp_projbands_dir:
+                                run(f"awk -v states={','.join(str(state) for state in stored_states)} \
+                                    -v ef={fermi_energy} -f ./projwfc_to_bands.awk {kpdos_output_dir} \
+                                    > {temp_projbands_dir}", shell=True, check=True, capture_output=True)
+                            projbands_states = stored_states
 
-        for orbital, orbital_plot_color in orbital_plot_color_info.items():
-            atomic_projection = f"{unique_elements_list[i]}-{orbital}"
-            if atomic_projection in atomic_projection_indices_info.keys():
-                atomic_projection_list.append(atomic_projection)
-                orbitals_list.append(orbital)
-                orbitals_plot_color_list.append(orbital_plot_color_info[orbital])
-                orbital_weights_list.append(atomic_projection_weights_info[atomic_projection])
+                            print("Initialization done.\n")
 
-        atomic_projection_plot_info.update({f"{unique_elements_list[i]}":{"index": i + 1, "projected_orbitals": orbitals_list,
-        "plot_colors": orbitals_plot_color_list, "orbital_weights": orbital_weights_list}})
+                        # Catching the error message
+                        except CalledProcessError as e:
+                            print("An error occurred in projected bands calculation. See below for details:\n")
+                            print((e.stderr).decode("utf-8"))
+                            exit(1)
 
-    atomic_projection_plot_info_list.append(atomic_projection_plot_info)
+        projbands_states_list.append(projbands_states)
 
-# Creating the LaTeX symbols for the comopound name to display in the plot
-# ----------------------------------------------------------------------------------------------------------------------------
+    except FileNotFoundError:
+        if flag == "_soc":
+            if not skip_soc:
+                print(f"File \"{compound_name}{flag}.kpdos.out\" does not exist. Make sure the file name is correct or \
+in the directory of the project.")
+                exit(1)
+        else:
+            print(f"File \"{compound_name}{flag}.kpdos.out\" does not exist. Make sure the file name is correct or \
+in the directory of the project.")
+            exit(1)
 
-compound_name_regex_pattern = r"(([A-Z][a-z]?)(\d?))"
-compound_name_regex_object = re.compile(compound_name_regex_pattern)
-element_matches = compound_name_regex_object.finditer(compound_name)
+# PLOTTING THE DATA
+# ============================================================================================================================
 
-element_names = []
-element_numbers = []
-for element in element_matches:
-    element_names.append(element.group(2))
-    if element.group(3) == '':
-        element_numbers.append(1)
+projbands_data_list = []
+k_points_proj_list = []
+k_points_list = []
+Energy_proj_list = []
+Energy_list = []
+number_of_bands_in_window_list = []
+
+for projbands_dir, bands_dir, number_of_bands, fermi_energy, requested_states, projbands_states, projbands_xml_data \
+    in zip(projbands_dir_list, bands_dir_list, number_of_bands_list, fermi_energy_list, requested_states_list,
+    projbands_states_list, projbands_xml_data_list):
+
+    # Reading only the k-length, energy and requested weight columns of the projected bands file
+    if projbands_xml_data is not None:
+        # The projections from the XML output already have exactly the requested columns
+        projbands_data = projbands_xml_data
+    elif streaming_mode:
+        # The streamed file only has the k-length, energy and weight columns
+        # The list of states is read again together with the file, in case another job has replaced them since
+        with file_lock(f"{projbands_dir}.npy"):
+            projbands_states = read_projbands_states(f"{projbands_dir}.states")
+            projbands_data = np.load(f"{projbands_dir}.npy", mmap_mode="r")
+        weight_columns = [projbands_states.index(state) + 2 for state in requested_states]
     else:
-        element_numbers.append(int(element.group(3)))
+        # The first 4 columns are the k index, k-length, energy and the total weight of the stored states
+        with file_lock(projbands_dir):
+            projbands_states = read_projbands_states(projbands_dir)
+            weight_columns = [projbands_states.index(state) + 4 for state in requested_states]
+            projbands_data = np.loadtxt(projbands_dir, usecols=[1, 2] + weight_columns, ndmin=2)
+
+    # Keeping only the bands which enter the energy window. The rows are ordered by k-point and then by band.
+    # For the memory-mapped file, only the rows and columns of these bands are read from the disk.
+    projbands_data = np.reshape(projbands_data, (-1, number_of_bands, projbands_data.shape[1]))
+    bands_in_window = find_bands_in_window(projbands_data[:, :, 1].T, energy_window, energy_window_margin)
+
+    if len(bands_in_window) == 0:
+        print(f"ERROR: None of the {number_of_bands} bands of {os.path.basename(projbands_dir)} enters the energy \
+window {energy_window[0]} to {energy_window[1]} eV (with a margin of {energy_window_margin} eV). Choose another window \
+with --window.")
+        exit(1)
+
+    if streaming_mode and projbands_xml_data is None:
+        projbands_data = projbands_data[:, bands_in_window][:, :, [0, 1] + weight_columns]
+    else:
+        projbands_data = projbands_data[:, bands_in_window]
 
-compound_name_latex = r'$'
+    number_of_bands_in_window_list.append(len(bands_in_window))
+    print(f"{len(bands_in_window)} of {number_of_bands} bands are in the energy window {energy_window} eV.\n")
 
-for i in range(len(element_names)):
-    compound_name_latex +=  r'{' + rf"{element_names[i]}" + r'}'
-    if element_numbers[i] != 1:
-        compound_name_latex += r'_' + r'{' + rf"{element_numbers[i]}" + r'}'
+    projbands_data = np.reshape(projbands_data, (-1, projbands_data.shape[2]))
+    projbands_data_list.append(projbands_data)
 
-compound_name_latex += r'$'
+    # The k-length of the first band of every k-point, so the repeated k-points of the path are kept
+    k_points_proj = projbands_data[::len(bands_in_window), 0]
+    k_points_proj_list.append(k_points_proj)
 
-# Plotting the data
+    Energy_proj = np.reshape(projbands_data[:, 1], (-1, len(bands_in_window)))
+    Energy_proj_list.append(Energy_proj)
+
+    k_points, Energy = read_bands_file(os.path.join(project_dir, bands_dir))
+    k_points_list.append(k_points)
+
+    Energy = Energy - fermi_energy
+    Energy = Energy[find_bands_in_window(Energy, energy_window, energy_window_margin)]
+    Energy_list.append(Energy)
+
+# Calculating the total weights
 # ----------------------------------------------------------------------------------------------------------------------------
 
-for atomic_projection_plot_info, flag, k_points, Energy, k_points_proj, Energy_proj, number_of_bands, spin_orbit_state \
-    in zip(atomic_projection_plot_info_list, spin_orbit_flag, k_points_list, Energy_list,
-    k_points_proj_list, Energy_proj_list, number_of_bands_list, [False, True]):
+#Calculates the weights of the specified orbitals from the projbands data
+def calculate_total_weights(data, atomic_state_indices, requested_states, number_of_bands):
+    total_orbital_weights = np.zeros(len(data[:, 0]))
+    for atomic_state_index in atomic_state_indices:
+        # The first 2 columns are not the weights
+        total_orbital_weights += data[:, requested_states.index(atomic_state_index) + 2]
 
-    plt.style.use("ggplot")
+    total_orbital_weights_reshaped = np.reshape(total_orbital_weights, (-1, number_of_bands))
+    return total_orbital_weights_reshaped
 
-    fig, axs = plt.subplots(1, number_of_subplots, sharey=True, layout="constrained")
+atomic_projection_weights_info_list = []
 
-    fig.set_figheight(6)
-    fig.set_figwidth(12)
+for atomic_projection_indices_info, projbands_data, requested_states, number_of_bands \
+    in zip(atomic_projection_indices_info_list, projbands_data_list, requested_states_list,
+    number_of_bands_in_window_list):
 
-    if spin_orbit_state:
-        fig.suptitle("Projected Band Structure for " + compound_name_latex + "with Spin-Orbit Coupling")
-    else:
-        fig.suptitle("Projected Band Structure for " + compound_name_latex + "without Spin-Orbit Coupling")
+    atomic_projection_weights_info = dict()
 
-    init_plot(axs[0], "k", "E (eV)", "TOTAL", high_symmetry_k_points, k_labels)
-    bands_label = plot_bands(axs[0], k_points, Energy, "total", "blue")
-    axs[0].legend(handles=[bands_label, ])
+    for atomic_projection, indices in atomic_projection_indices_info.items():
+        total_orbital_weight = calculate_total_weights(projbands_data, indices, requested_states, number_of_bands)
+        atomic_projection_weights_info.update({f"{atomic_projection}": total_orbital_weight})
 
-    for element in atomic_projection_plot_info.keys():
+    atomic_projection_weights_info_list.append(atomic_projection_weights_info)
 
-        legend_labels = []
+# Plotting the data
+# ----------------------------------------------------------------------------------------------------------------------------
 
-        for i in range(len(atomic_projection_plot_info[element]["projected_orbitals"])):
+# matplotlib is only imported once the data is ready to be plotted, since importing it is slow
+import matplotlib.pyplot as plt
+from plot_utils import get_compound_name_latex, plot_projected_band_structure
 
-            init_plot(axs[atomic_projection_plot_info[element]["index"]], "k", "E (eV)",
-            element, high_symmetry_k_points, k_labels)
+compound_name_latex = get_compound_name_latex(compound_name)
 
-            label = plot_projbands(axs[atomic_projection_plot_info[element]["index"]], k_points_proj, Energy_proj,
-            atomic_projection_plot_info[element]["orbital_weights"][i], number_of_bands, spin_orbit_state,
-            atomic_projection_plot_info[element]["projected_orbitals"][i],
-            atomic_projection_plot_info[element]["plot_colors"][i])
+for atomic_projection_weights_info, flag, k_points, Energy, k_points_proj, Energy_proj, spin_orbit_state \
+    in zip(atomic_projection_weights_info_list, spin_orbit_flag, k_points_list, Energy_list,
+    k_points_proj_list, Energy_proj_list, [False, True]):
 
-            legend_labels.append(label)
+    if spin_orbit_state:
+        title = "Projected Band Structure for " + compound_name_latex + "with Spin-Orbit Coupling"
+    else:
+        title = "Projected Band Structure for " + compound_name_latex + "without Spin-Orbit Coupling"
 
-        axs[atomic_projection_plot_info[element]["index"]].legend(
-            handles=legend_labels)
+    plot_projected_band_structure(title, k_points, Energy, k_points_proj, Energy_proj, atomic_projection_weights_info,
+        spin_orbit_state, raster_mode, energy_window)
 
-    plt.ylim(-3, 3)
-    plt.savefig(os.path.join(project_dir, f"{compound_name}_projbands{flag}.png"))
+    with atomic_output(os.path.join(project_dir, f"{compound_name}_projbands{flag}.png")) as temp_figure_dir:
+        plt.savefig(temp_figure_dir)
     plt.show()
@@ -0,0 +1,214 @@
+import os
+import argparse
+import re
+import numpy as np
+from qe_xml import get_xml_dir, read_xml_metadata, read_data_file_schema
+from file_utils import atomic_output, find_file, open_file
+from pdos_utils import aggregate_pdos
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python plot_pdos.py <compound name> [--threads N] [--kresolved]
+#
+# The pdos files written by projwfc.x are read concurrently by N threads (8 by default) and aggregated by element,
+# orbital and j. The aggregated data is cached next to the pdos files, so it is only read once.
+#
+# With --kresolved, the k-resolved pdos files of the kpdos calculation in projected_bands are plotted instead,
+# as a heatmap of the spectral weight along the k-path.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Plots the projected density of states of a compound.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--threads", type=int, default=8, metavar="N", help="the number of threads for reading the pdos files")
+parser.add_argument("--kresolved", action="store_true",
+    help="plot the k-resolved pdos of the kpdos calculation as a heatmap along the k-path")
+args = parser.parse_args()
+
+if args.threads < 1:
+    parser.error("the number of threads of --threads must be at least 1")
+
+print("Initializing...\n")
+
+compound_name = args.compound_name  # Taking the name of the compound of interest
+number_of_threads = args.threads  # The number of threads for reading the pdos files
+k_resolved = args.kresolved  # Whether to plot the k-resolved pdos of the kpdos calculation
+root_dir = os.path.abspath("../")  # The root directory of the project
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
+
+# Directory of pdos calculation
+pdos_dir_list = [
+    os.path.join(project_dir, "pdos"), os.path.join(project_dir, "spin_orbit/pdos")
+]
+
+# Directory of projected bands calculation
+pbands_dir_list = [
+    os.path.join(project_dir, "projected_bands"), os.path.join(project_dir, "spin_orbit/projected_bands")
+]
+
+# The flag that comes after the file name. Namely, "_soc" for spin-orbit case and nothing otherwise
+spin_orbit_flag = ["", "_soc"]
+
+# Output file directories
+nscf_output_dir_list = []
+
+for pdos_dir, flag in zip(pdos_dir_list, spin_orbit_flag):
+
+    nscf_output_dir_list.append(os.path.join(pdos_dir, f"{compound_name}_nscf{flag}.pw.out"))  # The output of Quantum ESPRESSO nscf calculation
+
+# Getting the Fermi energy from Quantum ESPRESSO calculation
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# List of Fermi energies for spin-orbit and non spin-orbit case
+fermi_energy_list = []
+skip_soc = False  # Whether to skip the spin-orbit case
+
+for nscf_output_dir, pdos_dir, flag in zip(nscf_output_dir_list, pdos_dir_list, spin_orbit_flag):
+
+    print("Getting Fermi energy...")
+
+    # Preferring the XML output of the nscf calculation over the standard output
+    xml_metadata = read_xml_metadata(pdos_dir, compound_name)
+    if xml_metadata is not None and xml_metadata["fermi_energy"] is not None:
+        fermi_energy = xml_metadata["fermi_energy"]
+        fermi_energy_list.append(fermi_energy)
+
+        print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n")
+        continue
+
+    print(f"Reading {compound_name}_nscf{flag}.pw.out...")
+    try:
+
+        # Reading the output of Quantum ESPRESSO nscf calculation
+        with open_file(nscf_output_dir, "r") as nscf_output_file:
+            nscf_calculation_output = nscf_output_file.read()
+
+        # Getting fermi energy from the calculation output
+        Fermi_energy_regex_pattern = r"the Fermi energy is\s+(-?\d\.\d+)"
+        Fermi_energy_regex_object = re.compile(Fermi_energy_regex_pattern)
+        Fermi_energy_matches = Fermi_energy_regex_object.finditer(nscf_calculation_output)
+
+        fermi_energy = float(next(Fermi_energy_matches).group(1))  # Accessing the value of the iterator
+        fermi_energy_list.append(fermi_energy)
+
+        print(f"Fermi energy extracted successfully. Fermi energy is {fermi_energy} eV.\n")
+
+    except FileNotFoundError:
+        print(f"File \"{compound_name}_nscf{flag}.pw.out\" does not exist. Make sure the file name is correct or \
+in the directory of the project.")
+        if flag == "_soc":
+            skip_soc_input = input("Do you want to skip spin-orbit case? Enter \"yes\" if you want to skip spin-orbit or \
+\"no\" to quit the program.")
+            if skip_soc_input == "no":
+                exit(1)
+            else:
+                skip_soc = True
+        else:
+            exit(1)
+
+# Reading and aggregating the pdos files
+# ----------------------------------------------------------------------------------------------------------------------------
+
+# Gets the length of the k-path for each k-point of the kpdos calculation from the XML output of the bands calculation.
+# The index of the k-points is used instead if the XML output is not available.
+def get_k_path_lengths(pband_dir, number_of_k_points):
+
+    xml_dir = get_xml_dir(pband_dir, compound_name)
+
+    if find_file(xml_dir) is not None:
+        try:
+            k_points = read_data_file_schema(xml_dir)["k_points"]
+            if len(k_points) == number_of_k_points:
+                k_lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(k_points, axis=0), axis=1))])
+
+                # Repeated k-points would make the axis of the image non-monotonic
+                k_lengths += np.arange(number_of_k_points) * 1e-9
+                return k_lengths, True
+        except ValueError as e:
+            print(e)
+
+    return np.arange(number_of_k_points, dtype=float), False
+
+aggregated_pdos_list = []
+
+for pdos_dir, pband_dir, fermi_energy, flag in zip(pdos_dir_list, pbands_dir_list, fermi_energy_list, spin_orbit_flag):
+
+    if k_resolved:
+        print(f"Aggregating the k-resolved pdos files of the{' spin-orbit' if flag == '_soc' else ''} kpdos calculation...")
+        data_dir, filpdos, pdos_cache_filename = pband_dir, f"{compound_name}.k", f"{compound_name}{flag}.kpdos_cache.npz"
+    else:
+        print(f"Aggregating the pdos files of the{' spin-orbit' if flag == '_soc' else ''} pdos calculation...")
+        data_dir, filpdos, pdos_cache_filename = pdos_dir, compound_name, f"{compound_name}{flag}.pdos_cache.npz"
+
+    try:
+        aggregated_pdos = aggregate_pdos(data_dir, filpdos, os.path.join(data_dir, pdos_cache_filename),
+            number_of_threads, k_resolved)
+
+    except FileNotFoundError as e:
+        print(f"{e}. Make sure the calculation is done and the files are in the directory of the project.")
+        exit(1)
+
+    aggregated_pdos["energies"] = aggregated_pdos["energies"] - fermi_energy
+
+    if k_resolved:
+        aggregated_pdos["k_lengths"], aggregated_pdos["k_path_found"] = \
+            get_k_path_lengths(pband_dir, aggregated_pdos["total"].shape[0])
+
+    aggregated_pdos_list.append(aggregated_pdos)
+
+    print(f"Found the following projections: {' '.join(aggregated_pdos['labels'])}\n")
+
+# PLOTTING THE DATA
+# ============================================================================================================================
+
+# matplotlib is only imported once the data is ready to be plotted, since importing it is slow
+import matplotlib.pyplot as plt
+from plot_utils import get_compound_name_latex, plot_pdos_figure, plot_kresolved_pdos_figure
+
+compound_name_latex = get_compound_name_latex(compound_name)
+
+print('''
+The projection list should be <element name>, <element name>-<orbital> or <element name>-<orbital>_j<j>
+separated by a single space. Example usage would be Mo S-p Mo-d_j2.5
+The aggregated data is kept in memory, so you can plot as many selections as you like.
+''')
+
+if k_resolved:
+    print("Each selection is plotted as a separate heatmap. Use \"total\" for the total dos.\n")
+
+while True:
+    user_input = input("Enter the desired projections you wish to plot or q to quit: ")
+
+    if user_input == 'q':
+        break
+    elif user_input == '':
+        print("User input cannot be null!")
+        continue
+
+    selections = user_input.split(' ')
+
+    for aggregated_pdos, flag, spin_orbit_state in zip(aggregated_pdos_list, spin_orbit_flag, [False, True]):
+
+        if spin_orbit_state:
+            title = compound_name_latex + "with Spin-Orbit Coupling"
+        else:
+            title = compound_name_latex + "without Spin-Orbit Coupling"
+
+        if k_resolved:
+            plot_kresolved_pdos_figure("k-Resolved Density of States for " + title, aggregated_pdos, selections)
+
+            with atomic_output(os.path.join(project_dir, f"{compound_name}_kresolved_pdos{flag}.png")) as temp_figure_dir:
+                plt.savefig(temp_figure_dir)
+            plt.show()
+            continue
+
+        plot_pdos_figure("Projected Density of States for " + title, aggregated_pdos, selections)
+
+        with atomic_output(os.path.join(project_dir, f"{compound_name}_pdos{flag}.png")) as temp_figure_dir:
+            plt.savefig(temp_figure_dir)
+        plt.show()
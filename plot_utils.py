@@ -0,0 +1,356 @@
+import re
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
+from matplotlib.image import NonUniformImage
+from pdos_utils import select_pdos
+
+
+# Plotting utilities for the (projected) band structures and densities of states, used by plot_pbands.py,
+# plot_pdos.py and qic.py. The figures are built from arrays which are already read, so they can be drawn again with
+# other projections without reading anything. matplotlib is imported with this module, so the scripts only import it
+# once the data is ready to be plotted. These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# Read from bands.out file
+high_symmetry_k_points = [0.0000, 0.5774, 0.9107, 1.5774]
+
+k_labels = [r"$\Gamma$", r"$M$", r"$K$", r"$\Gamma$"]
+
+# The plotted energy window relative to the Fermi energy in eV
+default_energy_window = (-3.0, 3.0)
+
+# The resolution of the density images of the raster mode as (energy pixels, k pixels)
+raster_resolution = (600, 400)
+
+orbital_plot_color_info = {
+    "s": "magenta",
+    "p": "green",
+    "d": "red",
+    "pz": "blue",
+    "px+py": "green",
+    "dz2": "blue",
+    "dxz+dyz": "green",
+    "dx2y2+dxy": "red"
+}
+
+
+# Creates the LaTeX symbols of the name of a compound to display in the plots, e.g. ${Mo}{S}_{2}$
+def get_compound_name_latex(compound_name):
+
+    compound_name_regex_object = re.compile(r"(([A-Z][a-z]?)(\d?))")
+    element_matches = compound_name_regex_object.finditer(compound_name)
+
+    compound_name_latex = r'$'
+
+    for element in element_matches:
+        compound_name_latex += r'{' + rf"{element.group(2)}" + r'}'
+        if element.group(3) not in ('', '1'):
+            compound_name_latex += r'_' + r'{' + rf"{element.group(3)}" + r'}'
+
+    compound_name_latex += r'$'
+
+    return compound_name_latex
+
+
+def init_plot(ax, xlabel, ylabel, title, xtick_points, xtick_labels):
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)  # Edit the title
+    ax.set_xticks(xtick_points, xtick_labels)
+
+
+def plot_bands(ax, xdata, ydata, data_label="data", color="blue"):
+
+    label = ax.scatter([], [], label=data_label, color=color)
+
+    for band in range(len(ydata)):
+        ax.plot(xdata, ydata[band, :], color=color)
+
+    return label
+
+
+def plot_projbands(ax, xdata, ydata, orbital_weights, number_of_bands, spin_orbit=True, data_label="data", color="blue"):
+
+    label = ax.scatter([], [], label=data_label, color=color)
+
+    # Filtering the non-zero weights
+    condition = orbital_weights != 0
+
+    # Plotting the bands
+    for band in range(number_of_bands):
+
+        x = xdata[condition[:, band]]
+        y = ydata[condition[:, band], band].T
+        weights = orbital_weights[condition[:, band], band]
+        weights = 3 * weights[:-1]  # Multiplying the weights by a scaling factor to get thicker bands
+        points = np.array([x, y]).T.reshape(-1, 1, 2)
+        segments = np.concatenate([points[:-1], points[1:]], axis=1)
+        if spin_orbit:
+            line_collections = LineCollection(segments, linewidths=weights, color=color, alpha=0.45)
+        else:
+            line_collections = LineCollection(segments, linewidths=weights, color=color)
+
+        ax.add_collection(line_collections)
+
+    return label
+
+
+# Bins the bands onto an (energy x k) pixel grid. The bands are linearly interpolated between the k-points
+# with a few samples per pixel column and every pixel between two consecutive samples is filled, so steep bands
+# stay connected. The density of each pixel is the sum of the weights of the bands passing through it.
+def rasterize_bands(xdata, ydata, weights, resolution=raster_resolution, energy_range=default_energy_window,
+    oversampling=4, thickness=3):
+
+    energy_pixels, k_pixels = resolution
+
+    # Interpolating the bands and their weights at the sampled k values
+    k_samples = np.linspace(xdata[0], xdata[-1], k_pixels * oversampling + 1)
+    k_indices = np.clip(np.searchsorted(xdata, k_samples, side="right") - 1, 0, len(xdata) - 2)
+    k_steps = xdata[k_indices + 1] - xdata[k_indices]
+    t = np.divide(k_samples - xdata[k_indices], k_steps, out=np.zeros_like(k_samples), where=k_steps > 0)[:, None]
+
+    sampled_energies = (1 - t) * ydata[k_indices] + t * ydata[k_indices + 1]
+    sampled_weights = (1 - t) * weights[k_indices] + t * weights[k_indices + 1]
+
+    # The pixel rows covered by the bands between two consecutive samples, widened to the thickness of a line
+    rows = (sampled_energies - energy_range[0]) / (energy_range[1] - energy_range[0]) * energy_pixels
+    lower_rows = np.floor(np.minimum(rows[:-1], rows[1:])) - thickness // 2
+    upper_rows = np.floor(np.maximum(rows[:-1], rows[1:])) + thickness // 2 + 1
+    span_weights = (sampled_weights[:-1] + sampled_weights[1:]) / 2
+    columns = np.broadcast_to((np.arange(len(k_samples) - 1) // oversampling)[:, None], lower_rows.shape)
+
+    condition = (upper_rows > 0) & (lower_rows < energy_pixels)
+    lower_rows = np.clip(lower_rows[condition], 0, energy_pixels).astype(int)
+    upper_rows = np.clip(upper_rows[condition], 0, energy_pixels).astype(int)
+    columns = columns[condition]
+    span_weights = span_weights[condition]
+
+    # Accumulating all the spans at once as steps along the energy axis and summing them up
+    steps = np.bincount(lower_rows * k_pixels + columns, weights=span_weights,
+        minlength=(energy_pixels + 1) * k_pixels)
+    steps -= np.bincount(upper_rows * k_pixels + columns, weights=span_weights,
+        minlength=(energy_pixels + 1) * k_pixels)
+
+    density = np.cumsum(steps.reshape(energy_pixels + 1, k_pixels), axis=0)[:-1]
+
+    return density / oversampling
+
+
+# Draws a density image of the bands with a single color and the density as the transparency.
+# The cost and the size of the image do not depend on the number of bands.
+def plot_density_image(ax, xdata, density, color, alpha=1.0, energy_range=default_energy_window):
+
+    image = np.zeros(density.shape + (4,))
+    image[..., :3] = to_rgb(color)
+    image[..., 3] = alpha * np.clip(density, 0, 1)
+
+    ax.imshow(image, origin="lower", aspect="auto", interpolation="nearest",
+        extent=(xdata[0], xdata[-1], energy_range[0], energy_range[1]))
+
+
+def plot_bands_raster(ax, xdata, ydata, data_label="data", color="blue", energy_range=default_energy_window):
+
+    label = ax.scatter([], [], label=data_label, color=color)
+
+    # The bands of the bands.gnu file are stored as (band, k-point)
+    density = rasterize_bands(xdata, ydata.T, np.ones(ydata.T.shape), energy_range=energy_range)
+    plot_density_image(ax, xdata, density, color, energy_range=energy_range)
+
+    return label
+
+
+def plot_projbands_raster(ax, xdata, ydata, orbital_weights, spin_orbit=True, data_label="data", color="blue",
+    energy_range=default_energy_window):
+
+    label = ax.scatter([], [], label=data_label, color=color)
+
+    # Multiplying the weights by a scaling factor to get thicker bands, as in plot_projbands
+    density = rasterize_bands(xdata, ydata, orbital_weights, energy_range=energy_range, thickness=5)
+    plot_density_image(ax, xdata, density, color, alpha=0.45 if spin_orbit else 1.0, energy_range=energy_range)
+
+    return label
+
+
+# Groups the weights of the projections (one array per "<element>-<orbital>" projection, with one row per k-point and
+# one column per band) by element, with one subplot per element in the order of the projections and the orbitals
+# which have a plot color
+def get_projection_plot_info(projection_weights):
+
+    elements_list = [projection.split("-")[0] for projection in projection_weights]
+    unique_elements_list = [item for i, item in enumerate(elements_list) if item not in elements_list[:i]]
+
+    projection_plot_info = dict()
+
+    for i, element in enumerate(unique_elements_list):
+        orbitals_list = []
+        orbitals_plot_color_list = []
+        orbital_weights_list = []
+
+        for orbital, orbital_plot_color in orbital_plot_color_info.items():
+            if f"{element}-{orbital}" in projection_weights:
+                orbitals_list.append(orbital)
+                orbitals_plot_color_list.append(orbital_plot_color)
+                orbital_weights_list.append(projection_weights[f"{element}-{orbital}"])
+
+        projection_plot_info[element] = {"index": i + 1, "projected_orbitals": orbitals_list,
+            "plot_colors": orbitals_plot_color_list, "orbital_weights": orbital_weights_list}
+
+    return projection_plot_info
+
+
+# Plots a projected band structure: the total bands (one row per band) in the first subplot and the projections
+# (see get_projection_plot_info) on the projected bands (one row per k-point) in one subplot per element, with the
+# energies relative to the Fermi energy. The bands are drawn as density images in raster mode. Returns the figure.
+def plot_projected_band_structure(title, k_points, energies, k_points_proj, energies_proj, projection_weights,
+    spin_orbit=False, raster_mode=False, energy_window=default_energy_window, xtick_points=high_symmetry_k_points,
+    xtick_labels=k_labels):
+
+    projection_plot_info = get_projection_plot_info(projection_weights)
+
+    plt.style.use("ggplot")
+
+    fig, axs = plt.subplots(1, len(projection_plot_info) + 1, sharey=True, layout="constrained", squeeze=False)
+    axs = axs[0]
+
+    fig.set_figheight(6)
+    fig.set_figwidth(12)
+    fig.suptitle(title)
+
+    init_plot(axs[0], "k", "E (eV)", "TOTAL", xtick_points, xtick_labels)
+    if raster_mode:
+        bands_label = plot_bands_raster(axs[0], k_points, energies, "total", "blue", energy_window)
+    else:
+        bands_label = plot_bands(axs[0], k_points, energies, "total", "blue")
+    axs[0].legend(handles=[bands_label, ])
+
+    for element, element_plot_info in projection_plot_info.items():
+
+        ax = axs[element_plot_info["index"]]
+        init_plot(ax, "k", "E (eV)", element, xtick_points, xtick_labels)
+
+        legend_labels = []
+
+        for orbital, orbital_weights, plot_color in zip(element_plot_info["projected_orbitals"],
+            element_plot_info["orbital_weights"], element_plot_info["plot_colors"]):
+
+            if raster_mode:
+                label = plot_projbands_raster(ax, k_points_proj, energies_proj, orbital_weights, spin_orbit, orbital,
+                    plot_color, energy_window)
+            else:
+                label = plot_projbands(ax, k_points_proj, energies_proj, orbital_weights, energies_proj.shape[1],
+                    spin_orbit, orbital, plot_color)
+
+            legend_labels.append(label)
+
+        ax.legend(handles=legend_labels)
+
+    axs[0].set_ylim(energy_window)
+
+    return fig
+
+
+# Plots the projected density of states of the selections (see select_pdos) over the total density of states, with
+# the energies relative to the Fermi energy. Returns the figure.
+def plot_pdos_figure(title, aggregated_pdos, selections, energy_window=default_energy_window):
+
+    plt.style.use("ggplot")
+
+    fig, ax = plt.subplots(layout="constrained")
+
+    fig.set_figheight(6)
+    fig.set_figwidth(10)
+
+    ax.set_title(title)
+
+    ax.set_xlabel("E (eV)")
+    ax.set_ylabel("DOS (states/eV)")
+
+    ax.fill_between(aggregated_pdos["energies"], aggregated_pdos["total"], color="gray", alpha=0.3, label="total")
+
+    for selection in selections:
+        selected_pdos, found = select_pdos(aggregated_pdos, selection)
+
+        if not found:
+            print(f"No projections found for {selection}!")
+            continue
+
+        ax.plot(aggregated_pdos["energies"], selected_pdos, label=selection)
+
+    ax.axvline(0, color="black", linestyle="--", linewidth=0.8)
+    ax.set_xlim(energy_window)
+    ax.legend()
+
+    return fig
+
+
+# Plots the k-resolved pdos in the plotted energy range as a single image, so the cost only depends on the number of
+# pixels and not on the number of bands
+def plot_kresolved_pdos(ax, k_lengths, energies, kresolved_pdos, title, energy_window=default_energy_window):
+
+    energy_condition = (energies >= energy_window[0]) & (energies <= energy_window[1])
+    windowed_pdos = kresolved_pdos[:, energy_condition].T
+
+    image = NonUniformImage(ax, interpolation="nearest", cmap="inferno",
+        extent=(k_lengths[0], k_lengths[-1], energy_window[0], energy_window[1]))
+    image.set_data(k_lengths, energies[energy_condition], windowed_pdos)
+
+    # Saturating the few brightest pixels to make the bands visible
+    image.set_clim(0, max(np.percentile(windowed_pdos, 99.5), 1e-12))
+
+    ax.add_image(image)
+    ax.set_xlim(k_lengths[0], k_lengths[-1])
+    ax.set_ylim(energy_window)
+    ax.set_title(title)
+
+    return image
+
+
+# Plots the k-resolved pdos of the selections (or "total" for the total dos) as heatmaps along the k-path with a shared
+# color scale. Returns the figure.
+def plot_kresolved_pdos_figure(title, aggregated_pdos, selections, energy_window=default_energy_window,
+    xtick_points=high_symmetry_k_points, xtick_labels=k_labels):
+
+    plt.style.use("ggplot")
+
+    fig, axs = plt.subplots(1, len(selections), sharey=True, layout="constrained", squeeze=False)
+    axs = axs[0]
+
+    fig.set_figheight(6)
+    fig.set_figwidth(4 * len(selections) + 2)
+    fig.suptitle(title)
+
+    images = []
+
+    for ax, selection in zip(axs, selections):
+        if selection == "total":
+            selected_pdos, found = aggregated_pdos["total"], True
+        else:
+            selected_pdos, found = select_pdos(aggregated_pdos, selection)
+
+        if not found:
+            print(f"No projections found for {selection}!")
+            continue
+
+        images.append(plot_kresolved_pdos(ax, aggregated_pdos["k_lengths"], aggregated_pdos["energies"],
+            selected_pdos, selection, energy_window))
+
+        if aggregated_pdos["k_path_found"]:
+            ax.set_xticks(xtick_points, xtick_labels)
+        ax.set_xlabel("k")
+        ax.grid(False)
+
+    axs[0].set_ylabel("E (eV)")
+
+    # Sharing the same color scale between the heatmaps
+    if len(images) > 0:
+        maximum_dos = max(image.get_clim()[1] for image in images)
+        for image in images:
+            image.set_clim(0, maximum_dos)
+        fig.colorbar(images[0], ax=axs[-1], label="DOS (states/eV)")
+
+    return fig
@@ -3,11 +3,13 @@
 #
 # execution:
 # awk -v ef=[EF] -v firststate=[FIRSTSTATE] -v laststate=[LASTSTATE] -f projwfc_to_bands.awk [PROJWFCOUTPUT]
+# awk -v ef=[EF] -v states=[STATE1,STATE2,...] -f projwfc_to_bands.awk [PROJWFCOUTPUT]
 #
 # variables to be initialized when calling (all are optional)
 # ef : Fermi energy                         (if unspecified/0: don't translate)
 # firststate : first atomic wfc to consider (if unspecified/0: write bands only)
 # laststate  :  last atomic wfc to consider (if unspecified/0: write bands only)
+# states     : comma separated list of atomic wfcs to consider (overrides firststate and laststate)
 #
 # Guido Fratesi 2017-01-23
 # Tested on output of QuantumESPRESSO 6.0
@@ -17,7 +19,14 @@ BEGIN {
     natwfc=0;
     firststate=strtonum(firststate);
     laststate=strtonum(laststate);
-    if ((firststate)&&(laststate)) {
+    if (states!="") {
+	nstates=split(states,lstates,",");
+	for (i=1;i<=nstates;i++) {
+	    latwfc[natwfc]=sprintf("[#%4s]", strtonum(lstates[i]));
+	    natwfc++;
+	}
+    }
+    else if ((firststate)&&(laststate)) {
 	for (i=firststate;i<=laststate;i++) {
 	    latwfc[natwfc]=sprintf("[#%4s]", i);
 	    natwfc++;
@@ -0,0 +1,133 @@
+import os
+import argparse
+import re
+from qe_xml import get_xml_dir, read_data_file_schema, bohr_to_angstrom
+from kpdos_parser import read_kpdos_header
+from file_utils import find_file, open_file
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python qe_info.py <compound name> [--key KEY]
+#
+# Prints the metadata of the calculations of a compound (Fermi energy, number of bands, number of k-points, alat,
+# spin-orbit and the number of atomic wavefunctions) as one "<calculation> <key> <value>" line per quantity,
+# e.g. "projected_bands_soc fermi_energy -1.2345". With --key, only the lines of the given quantity are printed.
+# Only the XML outputs, the headers of the kpdos outputs and the standard outputs are read. Neither NumPy nor
+# matplotlib is imported, so it is fast enough to be called for many compounds in batch scripts.
+# The outputs can be compressed (.gz, .xz or .zst).
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Prints the metadata of the calculations of a compound.")
+parser.add_argument("compound_name", help="the name of the compound of interest")
+parser.add_argument("--key", choices=["fermi_energy", "number_of_bands", "number_of_k_points", "alat", "spin_orbit",
+    "natomwfc"], help="print only the given quantity")
+args = parser.parse_args()
+
+compound_name = args.compound_name  # Taking the name of the compound of interest
+root_dir = os.path.abspath("../")  # The root directory of the project
+project_dir = os.path.join(root_dir, compound_name)  # The calculation directory
+
+# The calculation directories and the file names of their standard outputs, with "{flag}" being "_soc" for the
+# spin-orbit case and nothing otherwise
+calculation_info = {
+    "scf": f"{compound_name}_scf{{flag}}.pw.out",
+    "projected_bands": f"{compound_name}_bands{{flag}}.pw.out",
+    "pdos": f"{compound_name}_nscf{{flag}}.pw.out",
+    "wannier": f"{compound_name}_nscf_wannier{{flag}}.pw.out"
+}
+
+# The quantities in the standard output of pw.x. The Fermi energy is taken from the last match.
+pw_output_regex_info = {
+    "fermi_energy": re.compile(r"the Fermi energy is\s+(-?\d+\.\d+)"),
+    "number_of_bands": re.compile(r"number of Kohn-Sham states=\s+(\d+)"),
+    "number_of_k_points": re.compile(r"number of k points=\s+(\d+)"),
+    "alat": re.compile(r"lattice parameter \(alat\)\s+=\s+(\d+\.\d+)")
+}
+
+# The problem sizes in the header of the kpdos output
+kpdos_header_regex_info = {
+    "natomwfc": re.compile(r"natomwfc\s+=\s+(\d+)"),
+    "number_of_bands": re.compile(r"nbnd\s+=\s+(\d+)"),
+    "number_of_k_points": re.compile(r"nkstot\s+=\s+(\d+)")
+}
+
+# READING THE METADATA
+# ============================================================================================================================
+
+# Reads the metadata of a pw.x calculation from its XML output, or from its standard output if there is no XML output
+def read_pw_metadata(calculation_dir, pw_output_dir):
+
+    xml_dir = get_xml_dir(calculation_dir, compound_name)
+    if find_file(xml_dir) is not None:
+        try:
+            xml_metadata = read_data_file_schema(xml_dir, read_eigenvalues=False)
+            return {key: xml_metadata[key] for key in ("fermi_energy", "number_of_bands", "number_of_k_points",
+                "alat", "spin_orbit")}
+        except ValueError:
+            pass
+
+    if find_file(pw_output_dir) is None:
+        return dict()
+
+    with open_file(pw_output_dir, "r") as pw_output_file:
+        pw_calculation_output = pw_output_file.read()
+
+    pw_metadata = dict()
+    for key, regex_object in pw_output_regex_info.items():
+        matches = regex_object.findall(pw_calculation_output)
+        if len(matches) == 0:
+            continue
+
+        if key == "fermi_energy":
+            pw_metadata[key] = float(matches[-1])
+        elif key == "alat":
+            pw_metadata[key] = float(matches[0]) * bohr_to_angstrom
+        else:
+            pw_metadata[key] = int(matches[0])
+
+    return pw_metadata
+
+# Reads the problem sizes from the header of a kpdos output
+def read_kpdos_metadata(kpdos_output_dir):
+
+    if find_file(kpdos_output_dir) is None:
+        return dict()
+
+    kpdos_header = read_kpdos_header(kpdos_output_dir)
+
+    kpdos_metadata = dict()
+    for key, regex_object in kpdos_header_regex_info.items():
+        match = regex_object.search(kpdos_header)
+        if match is not None:
+            kpdos_metadata[key] = int(match.group(1))
+
+    return kpdos_metadata
+
+# PRINTING THE METADATA
+# ============================================================================================================================
+
+for spin_orbit_dir, flag in zip(["", "spin_orbit"], ["", "_soc"]):
+    for calculation, pw_output_name in calculation_info.items():
+
+        calculation_dir = os.path.join(project_dir, spin_orbit_dir, calculation)
+        if not os.path.isdir(calculation_dir):
+            continue
+
+        metadata = read_pw_metadata(calculation_dir, os.path.join(calculation_dir, pw_output_name.format(flag=flag)))
+
+        # The kpdos output has the number of atomic wavefunctions used for the projections
+        if calculation == "projected_bands":
+            kpdos_metadata = read_kpdos_metadata(os.path.join(calculation_dir, f"{compound_name}{flag}.kpdos.out"))
+            metadata.update({key: value for key, value in kpdos_metadata.items() if key not in metadata})
+
+        for key, value in metadata.items():
+            if value is None or (args.key is not None and key != args.key):
+                continue
+
+            print(f"{calculation + flag:<20} {key:<18} {value}")
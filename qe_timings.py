@@ -0,0 +1,294 @@
+import os
+import argparse
+import re
+import csv
+from file_utils import compressed_extensions, open_file, atomic_output, list_compound_names
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python qe_timings.py [<compound name> ...] [--output FILE]
+#
+# Harvests the timings, the memory estimates and the parallelization settings from all the outputs of Quantum
+# ESPRESSO (the "*.out" files, possibly compressed) in the project directories created by init_calc.py, of the given
+# compounds or of all the compounds if none is given. They are written as one row per output to a CSV file
+# (qe_timings.csv in the root directory of the projects by default), with the wall time of every routine in the
+# "wall_<routine>" columns.
+#
+# The runs with the same problem size (program, spin-orbit coupling, number of k-points, number of bands and FFT grid)
+# but a different number of cores are compared, in any compound or calculation directory, and their speedup and
+# parallel efficiency relative to the run with the fewest cores are printed and added to the CSV file. This helps to
+# choose -nk, -nd and the number of nodes. Every rerun overwrites the output in its calculation directory, so keep
+# the outputs of the runs to compare under different names or in copies of the project.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Harvests the timings and the memory usage of Quantum ESPRESSO outputs.")
+parser.add_argument("compound_names", nargs="*", metavar="compound_name",
+    help="the names of the compounds of interest (all the compounds if none is given)")
+parser.add_argument("--output", default=None, metavar="FILE",
+    help="the CSV file to write (default: qe_timings.csv in the root directory of the projects)")
+args = parser.parse_args()
+
+print("Initializing...\n")
+
+root_dir = os.path.abspath("../")  # The root directory of the projects
+timings_output_dir = args.output if args.output is not None else os.path.join(root_dir, "qe_timings.csv")
+
+# Taking all the project directories if no compound is given, except for the directory of the toolkit itself
+compound_names = args.compound_names
+if len(compound_names) == 0:
+    compound_names = list_compound_names(root_dir)
+
+# The first line of every output of Quantum ESPRESSO, e.g. "Program PWSCF v.7.2 starts on ...", which is looked for
+# in the first lines of the files only
+header_length = 20
+program_regex_object = re.compile(r"Program\s+([\w.]+)\s+v\.\s*(\S+)\s+starts")
+
+# The quantities which are read from the outputs and their regex patterns. The memory is converted to MB, and the
+# volume (in bohr^3) and the cutoffs (in Ry) are used by init_calc.py to calibrate its estimates.
+output_regex_info = {
+    "mpi_processes": re.compile(r"Number of MPI processes:\s+(\d+)"),
+    "threads": re.compile(r"Threads/MPI process:\s+(\d+)"),
+    "nodes": re.compile(r"MPI processes distributed on\s+(\d+) nodes"),
+    "npool": re.compile(r"K-points division:\s+npool\s+=\s+(\d+)"),
+    "nbgrp": re.compile(r"band groups division:\s+nbgrp\s+=\s+(\d+)"),
+    "r_and_g_procs": re.compile(r"R & G space division:\s+proc/nbgrp/npool/nimage\s+=\s+(\d+)"),
+    "ndiag": re.compile(r"size of sub-group:\s+(\d+)\s*\*\s*(\d+) procs"),
+    "number_of_k_points": re.compile(r"number of k points=\s+(\d+)"),
+    "number_of_bands": re.compile(r"number of Kohn-Sham states=\s+(\d+)"),
+    "fft_grid": re.compile(r"Dense\s+grid:.*FFT dimensions: \(\s*(\d+),\s*(\d+),\s*(\d+)\)"),
+    "volume": re.compile(r"unit-cell volume\s+=\s+([\d.]+)"),
+    "ecutwfc": re.compile(r"kinetic-energy cutoff\s+=\s+([\d.]+)\s+Ry"),
+    "ecutrho": re.compile(r"charge density cutoff\s+=\s+([\d.]+)\s+Ry"),
+    "spin_orbit": re.compile(r"Noncollinear calculation with spin-orbit"),
+    "ram_per_process_mb": re.compile(r"Estimated (?:max|static) dynamical RAM per process >\s+([\d.]+)\s*([KMG])"),
+    "ram_total_mb": re.compile(r"Estimated total dynamical RAM >\s+([\d.]+)\s*([KMG])")
+}
+
+# Any line with one of the quantities, so the (many) other lines of e.g. the kpdos outputs are skipped with one search
+output_line_regex_object = re.compile("|".join(regex_object.pattern for regex_object in output_regex_info.values()))
+
+# A line of the timing report, e.g. "electrons    :      3.21s CPU      3.50s WALL (       1 calls)"
+timing_regex_object = re.compile(r"^\s+([A-Za-z_][\w:]*)\s*:\s*(.+?)\s+CPU\s+(.+?)\s+WALL")
+
+# The parts of a time in the timing report, e.g. "1h23m", "12m34.56s" or "1d 2h 3m"
+time_part_regex_object = re.compile(r"([\d.]+)\s*([dhms])")
+seconds_per_unit = {"d": 86400.0, "h": 3600.0, "m": 60.0, "s": 1.0}
+
+megabytes_per_unit = {"K": 1 / 1024, "M": 1.0, "G": 1024.0}
+
+# The columns of the CSV file before the timings of the routines
+info_columns = ["compound", "calculation", "file", "program", "version", "job_done", "cores", "mpi_processes",
+    "threads", "nodes", "npool", "nbgrp", "r_and_g_procs", "ndiag", "number_of_k_points", "number_of_bands", "fft_grid",
+    "volume", "ecutwfc", "ecutrho", "spin_orbit", "ram_per_process_mb", "ram_total_mb", "cpu_time", "wall_time", "speedup", "parallel_efficiency"]
+
+# FINDING THE OUTPUTS
+# ============================================================================================================================
+
+# Finds the outputs of Quantum ESPRESSO in a project directory. A compressed output is skipped if the uncompressed
+# one exists too. The output directories of the calculations (with the wavefunctions) are not searched.
+def find_outputs(project_dir):
+
+    output_dir_list = []
+    for dirpath, dirnames, filenames in os.walk(project_dir):
+        dirnames[:] = sorted(dirname for dirname in dirnames if dirname != "out" and not dirname.endswith(".save"))
+
+        for filename in sorted(filenames):
+            output_name = filename
+            for extension in compressed_extensions:
+                if filename.endswith(extension):
+                    output_name = filename[:-len(extension)]
+
+            if not output_name.endswith(".out"):
+                continue
+            if output_name != filename and output_name in filenames:
+                continue
+
+            output_dir_list.append(os.path.join(dirpath, output_name))
+
+    return output_dir_list
+
+# READING THE OUTPUTS
+# ============================================================================================================================
+
+# Converts a time of the timing report to seconds
+def parse_time(time_string):
+    return sum(float(value) * seconds_per_unit[unit] for value, unit in time_part_regex_object.findall(time_string))
+
+# Reads the timings, the memory estimates and the parallelization settings of an output, line by line.
+# Returns None if the file is not an output of Quantum ESPRESSO, i.e. its first lines do not name the program.
+def read_output(output_dir):
+
+    output_info = dict()
+    routine_timings = dict()
+
+    with open_file(output_dir, "r") as output_file:
+        for line_number, line in enumerate(output_file):
+
+            if "program" not in output_info:
+                program_match = program_regex_object.search(line)
+                if program_match is not None:
+                    output_info["program"] = program_match.group(1)
+                    output_info["version"] = program_match.group(2)
+                elif line_number >= header_length:
+                    return None
+                continue
+
+            if "JOB DONE" in line:
+                output_info["job_done"] = True
+                continue
+
+            timing_match = timing_regex_object.match(line) if "WALL" in line else None
+            if timing_match is not None:
+                routine = timing_match.group(1)
+                cpu_time, wall_time = parse_time(timing_match.group(2)), parse_time(timing_match.group(3))
+
+                # The total time of the program has the name of the program
+                if routine == output_info["program"]:
+                    output_info["cpu_time"] = cpu_time
+                    output_info["wall_time"] = wall_time
+                elif routine not in routine_timings:
+                    routine_timings[routine] = wall_time
+                continue
+
+            if output_line_regex_object.search(line) is None:
+                continue
+
+            for key, regex_object in output_regex_info.items():
+                match = regex_object.search(line)
+                if match is None:
+                    continue
+
+                if key == "ndiag":
+                    output_info[key] = int(match.group(1)) * int(match.group(2))
+                elif key == "fft_grid":
+                    output_info[key] = "x".join(match.groups())
+                elif key == "spin_orbit":
+                    output_info[key] = True
+                elif key.endswith("_mb"):
+
+                    # The memory estimate is printed for every step of a relaxation. The largest one is kept.
+                    ram = float(match.group(1)) * megabytes_per_unit[match.group(2)]
+                    output_info[key] = max(ram, output_info.get(key, 0.0))
+
+                # Only the first value is kept, e.g. the number of k-points before the symmetry reduction of nscf runs
+                elif key not in output_info:
+                    output_info[key] = float(match.group(1)) if key in ("volume", "ecutwfc", "ecutrho") \
+                        else int(match.group(1))
+                break
+
+    if "program" not in output_info:
+        return None
+
+    output_info.setdefault("job_done", False)
+    output_info.setdefault("spin_orbit", False)
+
+    # Serial runs of older versions do not print the parallelization settings
+    output_info.setdefault("mpi_processes", 1)
+    output_info.setdefault("threads", 1)
+    output_info["cores"] = output_info["mpi_processes"] * output_info["threads"]
+
+    # The subspace diagonalization is serial unless the size of the sub-group is printed
+    output_info.setdefault("ndiag", 1)
+
+    return output_info, routine_timings
+
+
+timings_table = []  # One row per output
+routine_names = []  # The routines in the order of their first appearance
+
+for compound_name in compound_names:
+
+    project_dir = os.path.join(root_dir, compound_name)
+    output_dir_list = find_outputs(project_dir)
+
+    print(f"Reading {len(output_dir_list)} outputs of {compound_name}...")
+
+    for output_dir in output_dir_list:
+        try:
+            output = read_output(output_dir)
+        except (OSError, UnicodeDecodeError, EOFError) as e:
+            print(f"Could not read {os.path.relpath(output_dir, root_dir)}: {e}")
+            continue
+
+        if output is None:
+            continue
+
+        output_info, routine_timings = output
+        output_info["compound"] = compound_name
+        output_info["calculation"] = os.path.relpath(os.path.dirname(output_dir), project_dir)
+        output_info["file"] = os.path.basename(output_dir)
+
+        if "wall_time" not in output_info:
+            print(f"{output_info['calculation']}/{output_info['file']} has no timing report. Is the job still running?")
+
+        for routine, wall_time in routine_timings.items():
+            if routine not in routine_names:
+                routine_names.append(routine)
+            output_info[f"wall_{routine}"] = wall_time
+
+        timings_table.append(output_info)
+
+print(f"\n{len(timings_table)} outputs of Quantum ESPRESSO found.\n")
+
+# SUMMARIZING THE SCALING
+# ============================================================================================================================
+
+# Grouping the finished runs of the same program with the same problem size, in any compound or calculation, since
+# every rerun in a calculation directory overwrites its output. The runs with a wall time of zero (e.g. short
+# post-processing runs) cannot be compared.
+scaling_groups = dict()
+for output_info in timings_table:
+    if output_info.get("wall_time", 0) <= 0:
+        continue
+
+    group_key = tuple(output_info.get(key) for key in ("program", "spin_orbit", "number_of_k_points", "number_of_bands",
+        "fft_grid"))
+    scaling_groups.setdefault(group_key, []).append(output_info)
+
+# The speedup and the efficiency are only given for the groups of several runs and are left empty otherwise
+for group_key, group in scaling_groups.items():
+    if len(group) < 2:
+        continue
+
+    group.sort(key=lambda output_info: (output_info["cores"], output_info["wall_time"]))
+
+    # The speedup and the efficiency are relative to the (fastest) run with the fewest cores
+    reference_run = group[0]
+    for output_info in group:
+        output_info["speedup"] = reference_run["wall_time"] / output_info["wall_time"]
+        output_info["parallel_efficiency"] = output_info["speedup"] * reference_run["cores"] / output_info["cores"]
+
+    program, spin_orbit, number_of_k_points, number_of_bands, fft_grid = group_key
+    print(f"Scaling of {program}{' with spin-orbit coupling' if spin_orbit else ''} ({number_of_k_points} k-points, \
+{number_of_bands} bands, FFT grid {fft_grid}):")
+    print(f"{'cores':>7} {'npool':>6} {'ndiag':>6} {'wall time (s)':>14} {'speedup':>8} {'efficiency':>11} \
+{'RAM/process (MB)':>17}  file")
+
+    for output_info in group:
+        ram_per_process = output_info.get("ram_per_process_mb")
+        print(f"{output_info['cores']:>7} {output_info.get('npool', 1):>6} {output_info['ndiag']:>6} \
+{output_info['wall_time']:>14.2f} {output_info['speedup']:>8.2f} {output_info['parallel_efficiency']:>11.0%} \
+{'' if ram_per_process is None else f'{ram_per_process:.1f}':>17}  \
+{output_info['compound']}/{output_info['calculation']}/{output_info['file']}")
+
+    print()
+
+# WRITING THE TABLE
+# ============================================================================================================================
+
+print(f"Writing {timings_output_dir}...")
+
+with atomic_output(timings_output_dir) as temp_timings_output_dir:
+    with open(temp_timings_output_dir, "w", newline="") as timings_output_file:
+        csv_writer = csv.DictWriter(timings_output_file, fieldnames=info_columns + [f"wall_{routine}"
+            for routine in routine_names], restval="")
+        csv_writer.writeheader()
+        csv_writer.writerows(timings_table)
+
+print("Done.")
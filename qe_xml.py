@@ -0,0 +1,198 @@
+import os
+import xml.etree.ElementTree as ET
+from file_utils import find_file, open_file
+
+
+# Readers for the XML files written by Quantum ESPRESSO (data-file-schema.xml of pw.x and atomic_proj.xml of projwfc.x).
+# The files are parsed incrementally with iterparse and the numeric data is written directly into NumPy arrays.
+# These are used by plot_pbands.py and compare_bands.py and are not meant to be run directly.
+# NumPy is only imported when the eigenvalues or the projections are read, so reading the metadata stays fast.
+# The XML files can be compressed (.gz, .xz or .zst).
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+hartree_to_ev = 27.211386245988
+rydberg_to_ev = hartree_to_ev / 2
+bohr_to_angstrom = 0.529177
+
+
+# Gets the path of an XML file written by Quantum ESPRESSO in the outdir of a calculation directory.
+# The outdir is './out' in all the input files generated by init_calc.py.
+def get_xml_dir(calculation_dir, prefix, filename="data-file-schema.xml"):
+    return os.path.join(calculation_dir, "out", f"{prefix}.save", filename)
+
+
+# Reads the metadata of the data-file-schema.xml in a calculation directory.
+# Returns None if the file does not exist or cannot be read, so that the standard output can be parsed instead.
+def read_xml_metadata(calculation_dir, prefix):
+
+    xml_dir = get_xml_dir(calculation_dir, prefix)
+    if find_file(xml_dir) is None:
+        return None
+
+    print(f"Reading {os.path.relpath(find_file(xml_dir), calculation_dir)}...")
+    try:
+        return read_data_file_schema(xml_dir, read_eigenvalues=False)
+    except ValueError as e:
+        print(f"{e}\nFalling back to the standard output...")
+        return None
+
+
+# Removes the namespace from an XML tag, e.g. "{http://www.quantum-espresso.org/ns/qes/qes-1.0}espresso" -> "espresso"
+def strip_namespace(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# Reads the lattice, Fermi energy, k-points and eigenvalues from the data-file-schema.xml of a pw.x calculation.
+# Only the output section is used. The energies are converted to eV, the alat parameter and the cell vectors to
+# angstrom and the k-points are in cartesian coordinates in units of 2pi/alat, as in the standard output of pw.x.
+# If read_eigenvalues is False, the parsing stops before the k-points so only the metadata is read.
+def read_data_file_schema(xml_dir, read_eigenvalues=True):
+
+    data_file_info = {
+        "alat": None,
+        "cell": [None, None, None],
+        "fermi_energy": None,
+        "number_of_bands": None,
+        "number_of_k_points": None,
+        "spin_orbit": False,
+        "k_points": None,
+        "eigenvalues": None
+    }
+
+    in_output = False
+    k_index = 0
+
+    try:
+        with open_file(xml_dir, "rb") as xml_file:
+            for event, element in ET.iterparse(xml_file, events=("start", "end")):
+                tag = strip_namespace(element.tag)
+
+                if tag == "output":
+                    in_output = event == "start"
+                    continue
+
+                if event == "start" or not in_output:
+                    continue
+
+                if parse_data_file_element(data_file_info, tag, element, k_index, read_eigenvalues):
+                    break
+
+                if tag == "ks_energies":
+                    k_index += 1
+
+    # Malformed or incomplete files (e.g. of a calculation which is still running)
+    except (ET.ParseError, AttributeError, TypeError, IndexError) as e:
+        raise ValueError(f"Could not read {xml_dir}: {e}")
+
+    return data_file_info
+
+
+# Stores the data of a single element of the output section of data-file-schema.xml.
+# Returns True when the rest of the file does not need to be parsed.
+def parse_data_file_element(data_file_info, tag, element, k_index, read_eigenvalues):
+
+    if tag == "atomic_structure":
+        data_file_info["alat"] = float(element.get("alat")) * bohr_to_angstrom
+
+    elif tag in ("a1", "a2", "a3"):
+        data_file_info["cell"][int(tag[1]) - 1] = [float(x) * bohr_to_angstrom for x in element.text.split()]
+
+    elif tag == "spinorbit":
+        data_file_info["spin_orbit"] = element.text.strip() == "true"
+
+    elif tag == "nbnd":
+        data_file_info["number_of_bands"] = int(element.text)
+
+    elif tag == "fermi_energy":
+        data_file_info["fermi_energy"] = float(element.text) * hartree_to_ev
+
+    # The number of k-points comes before the eigenvalues, so the arrays can be preallocated
+    elif tag == "nks":
+        data_file_info["number_of_k_points"] = int(element.text)
+        if not read_eigenvalues:
+            return True
+
+        import numpy as np
+
+        data_file_info["k_points"] = np.zeros((data_file_info["number_of_k_points"], 3))
+        data_file_info["eigenvalues"] = np.zeros((data_file_info["number_of_k_points"],
+            data_file_info["number_of_bands"]))
+
+    elif tag == "ks_energies":
+        data_file_info["k_points"][k_index] = [float(x) for x in element.find("k_point").text.split()]
+        data_file_info["eigenvalues"][k_index] = \
+            [float(x) * hartree_to_ev for x in element.find("eigenvalues").text.split()]
+
+        # Releasing the parsed k-point to keep the memory usage independent of the number of k-points
+        element.clear()
+
+    return False
+
+
+# Reads the projections onto the given atomic states from the atomic_proj.xml of a projwfc.x calculation.
+# The result has the same layout as the projbands file (k-length, E-EF and one column per state) with one row
+# per k-point and band. The projections onto the other atomic states are skipped without being converted.
+def read_atomic_proj(xml_dir, stored_states, fermi_energy):
+
+    import numpy as np
+
+    state_columns = {state: i for i, state in enumerate(stored_states)}
+
+    projbands_data = None
+    number_of_bands = 0
+    k_vectors = []
+    k_index = -1
+
+    try:
+        with open_file(xml_dir, "rb") as xml_file:
+            for event, element in ET.iterparse(xml_file, events=("end",)):
+                tag = strip_namespace(element.tag)
+
+                if tag == "HEADER":
+                    if element.get("NUMBER_OF_BANDS") is None:
+                        raise ValueError(f"Unsupported atomic_proj.xml format in {xml_dir}")
+
+                    if element.get("NUMBER_OF_SPIN_COMPONENTS", "1") != "1":
+                        raise ValueError(f"Spin-polarized projections are not supported in {xml_dir}")
+
+                    number_of_bands = int(element.get("NUMBER_OF_BANDS"))
+                    number_of_k_points = int(element.get("NUMBER_OF_K-POINTS"))
+                    projbands_data = np.zeros((number_of_k_points * number_of_bands, 2 + len(stored_states)))
+
+                elif tag == "K-POINT":
+                    k_index += 1
+                    k_vectors.append(np.array(element.text.split(), dtype=float))
+
+                elif tag == "E":
+                    rows = slice(k_index * number_of_bands, (k_index + 1) * number_of_bands)
+                    projbands_data[rows, 1] = np.array(element.text.split(), dtype=float) * rydberg_to_ev - fermi_energy
+
+                elif tag == "ATOMIC_WFC":
+                    column = state_columns.get(int(element.get("index")))
+
+                    # The projections are stored as the real and imaginary parts for every band
+                    if column is not None:
+                        projections = np.array(element.text.split(), dtype=float).reshape(-1, 2)
+                        rows = slice(k_index * number_of_bands, (k_index + 1) * number_of_bands)
+                        projbands_data[rows, 2 + column] = np.sum(projections**2, axis=1)
+
+                    element.clear()
+
+                elif tag == "PROJS":
+                    element.clear()
+
+    # Malformed or incomplete files (e.g. of a calculation which is still running)
+    except (ET.ParseError, AttributeError, TypeError, IndexError) as e:
+        raise ValueError(f"Could not read {xml_dir}: {e}")
+
+    if projbands_data is None:
+        raise ValueError(f"No projections found in {xml_dir}")
+
+    # Measuring the length of the path in reciprocal space
+    k_vectors = np.array(k_vectors)
+    k_lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(k_vectors, axis=0), axis=1))])
+    projbands_data[:, 0] = np.repeat(k_lengths, number_of_bands)
+
+    return projbands_data
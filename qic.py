@@ -0,0 +1,297 @@
+import os
+import re
+import functools
+import numpy as np
+from qe_xml import get_xml_dir, read_data_file_schema, read_atomic_proj
+from kpdos_parser import read_kpdos_header, iterate_k_point_blocks, parse_k_point_block, \
+    resolve_atomic_projection_indices
+from bands_utils import read_bands_file
+from structure_utils import read_poscar
+from pdos_utils import find_pdos_files, find_pdos_total_file, get_pdos_files_signature, aggregate_pdos
+from wannier_utils import read_hr_file, read_compact_model
+from store_utils import query_store
+from file_utils import find_file, open_file
+
+
+# Importable interface to the data of the calculations, e.g. for Jupyter notebooks:
+#
+# import qic
+# files = qic.get_calculation_files("MoS2")
+# projections = qic.read_projections(files["kpdos_output"], files["atomic_proj"])
+# weights = qic.get_projection_weights(projections, "Mo-d")
+# figure = qic.plot_projected_bands(projections, ["Mo-d", "S-p"], fermi_energy)
+# gaps = qic.query_results(["band_gap"], where={"metal": False})
+#
+# The readers return dictionaries of NumPy arrays, like the rest of the toolkit. Every result is kept in memory and
+# reused as long as the files it was read from do not change (same path, size and modification time), so
+# re-plotting with a different projection does not read anything again. The cached arrays are read-only, since
+# they are shared between all the callers. The files can be compressed (.gz, .xz or .zst).
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The results which are already loaded, keyed by the reader, the identity of its files and its other arguments
+result_cache = dict()
+
+
+# Gets the identity of a file (or of its compressed variant), which changes whenever the file is modified
+def get_file_identity(file_dir):
+    found_file_dir = find_file(file_dir)
+    file_stat = os.stat(found_file_dir)
+    return os.path.abspath(found_file_dir), file_stat.st_size, file_stat.st_mtime_ns
+
+
+# Gets the identity of an argument of a reader: the identity of its file if it is the path of a file, and the argument
+# itself otherwise
+def get_argument_identity(argument):
+
+    if isinstance(argument, str) and find_file(argument) is not None:
+        return get_file_identity(argument)
+
+    return argument
+
+
+# Memoizes a reader by the identity of the files among its arguments and the values of the others
+def memoize_by_file(reader):
+
+    @functools.wraps(reader)
+    def memoized_reader(*args, **kwargs):
+        key = (reader.__name__,) + tuple(get_argument_identity(argument) for argument in args) \
+            + tuple((name, get_argument_identity(value)) for name, value in sorted(kwargs.items()))
+
+        if key not in result_cache:
+            result = reader(*args, **kwargs)
+            for value in result.values():
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+            result_cache[key] = result
+
+        return result_cache[key]
+
+    return memoized_reader
+
+
+# Forgets all the loaded results
+def clear_cache():
+    result_cache.clear()
+
+
+# Gets the paths of the files of a compound, with the same layout as the one created by init_calc.py
+def get_calculation_files(compound_name, root_dir="../", spin_orbit=False):
+
+    project_dir = os.path.join(os.path.abspath(root_dir), compound_name)
+    if spin_orbit:
+        project_dir = os.path.join(project_dir, "spin_orbit")
+    flag = "_soc" if spin_orbit else ""
+
+    pband_dir = os.path.join(project_dir, "projected_bands")
+    wannier_dir = os.path.join(project_dir, "wannier")
+
+    return {
+        "scf_data_file": get_xml_dir(os.path.join(project_dir, "scf"), compound_name),
+        "pdos_data_file": get_xml_dir(os.path.join(project_dir, "pdos"), compound_name),
+        "pdos": os.path.join(project_dir, "pdos"),
+        "pdos_cache": os.path.join(project_dir, "pdos", f"{compound_name}{flag}.pdos_cache.npz"),
+        "bands_data_file": get_xml_dir(pband_dir, compound_name),
+        "bands": os.path.join(pband_dir, f"{compound_name}.bands.gnu"),
+        "kpdos_output": os.path.join(pband_dir, f"{compound_name}{flag}.kpdos.out"),
+        "atomic_proj": get_xml_dir(pband_dir, compound_name, "atomic_proj.xml"),
+        "wannier_bands": os.path.join(wannier_dir, f"{compound_name}_wannier{flag}_band.dat"),
+        "wannier_hamiltonian": os.path.join(wannier_dir, f"{compound_name}_wannier{flag}_hr.dat"),
+        "compact_wannier_hamiltonian": os.path.join(wannier_dir, f"{compound_name}_wannier{flag}_hr.npz"),
+        "orbital_character": os.path.join(pband_dir, f"{compound_name}{flag}.orbital_character.npz")
+    }
+
+
+# STRUCTURE
+# ============================================================================================================================
+
+# Reads the lattice vectors and the atomic positions of a POSCAR file (see structure_utils.py)
+@memoize_by_file
+def read_structure(poscar_dir):
+    return read_poscar(poscar_dir)
+
+
+# BANDS
+# ============================================================================================================================
+
+# Reads the metadata, k-points and eigenvalues of the data-file-schema.xml of a pw.x calculation (see qe_xml.py)
+@memoize_by_file
+def read_data_file(xml_dir):
+    return read_data_file_schema(xml_dir)
+
+
+# Reads a bands.gnu or _band.dat file with the energies relative to the given Fermi energy (one row per band)
+@memoize_by_file
+def read_bands(bands_dir, fermi_energy=0.0):
+
+    k_points, energies = read_bands_file(bands_dir)
+
+    return {
+        "k_points": k_points,
+        "energies": energies - fermi_energy
+    }
+
+
+# PROJECTIONS
+# ============================================================================================================================
+
+# Reads the projections of the bands onto all the atomic states of a kpdos calculation.
+# The table of atomic states is read from the standard output of projwfc.x. The projections are read from
+# atomic_proj.xml if it is given and exists, which is much faster, and from the standard output otherwise.
+# The energies are absolute (in eV) with one row per k-point, and the weights have one column per atomic state.
+@memoize_by_file
+def read_projections(kpdos_output_dir, atomic_proj_dir=None):
+
+    kpdos_header = read_kpdos_header(kpdos_output_dir)
+    number_of_atomic_states = int(re.search(r"natomwfc\s*=\s*(\d+)", kpdos_header).group(1))
+    number_of_bands = int(re.search(r"nbnd\s*=\s*(\d+)", kpdos_header).group(1))
+    atomic_states = list(range(1, number_of_atomic_states + 1))
+
+    if atomic_proj_dir is not None and find_file(atomic_proj_dir) is not None:
+        projbands_data = read_atomic_proj(atomic_proj_dir, atomic_states, 0.0)
+        projbands_data = projbands_data.reshape(-1, number_of_bands, projbands_data.shape[1])
+
+        k_points = projbands_data[:, 0, 0]
+        energies = projbands_data[:, :, 1]
+        weights = projbands_data[:, :, 2:]
+
+    else:
+        state_columns = {state: state - 1 for state in atomic_states}
+        k_vectors, energies, weights = [], [], []
+
+        with open_file(kpdos_output_dir, "r") as kpdos_output_file:
+            for k_vector, block_lines in iterate_k_point_blocks(kpdos_output_file):
+                block_energies, block_weights = parse_k_point_block(block_lines, state_columns, number_of_bands)
+                k_vectors.append(k_vector)
+                energies.append(block_energies)
+                weights.append(block_weights)
+
+        # Measuring the length of the path in reciprocal space
+        k_points = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(k_vectors, axis=0), axis=1))])
+        energies = np.array(energies)
+        weights = np.array(weights)
+
+    return {
+        "header": kpdos_header,
+        "atomic_states": atomic_states,
+        "k_points": k_points,
+        "energies": energies,
+        "weights": weights
+    }
+
+
+# Finds the atomic states of a projection, given as <element name> or <element name>-<orbital> with the orbitals
+# supported by plot_pbands.py (s, p, d, pz, px, py, dz2, dxz, dyz, dx2y2, dxy)
+def get_projection_states(projections, projection):
+
+    if "-" not in projection:
+        element_state_regex_object = re.compile(rf"state #\s+(\d+): atom\s+\d+ \({projection}\s*\)")
+        return [int(match.group(1)) for match in element_state_regex_object.finditer(projections["header"])]
+
+    atomic_projection_indices_info = resolve_atomic_projection_indices(projections["header"],
+        [projection.split("-")])
+
+    return next(iter(atomic_projection_indices_info.values()))
+
+
+# Sums the weights of the atomic states of a projection (see get_projection_states) for every k-point and band
+def get_projection_weights(projections, projection):
+
+    atomic_state_columns = np.array(get_projection_states(projections, projection), dtype=int) - 1
+
+    return np.sum(projections["weights"][:, :, atomic_state_columns], axis=2)
+
+
+# Reads the table of the orbital character of the bands written by orbital_character.py, with one entry per k-point
+# and band in every array and the names of the groups of atomic states
+@memoize_by_file
+def read_orbital_character(orbital_character_dir):
+
+    with np.load(orbital_character_dir) as orbital_character:
+        return {name: orbital_character[name] for name in orbital_character.files}
+
+
+# PROJECTED DENSITY OF STATES
+# ============================================================================================================================
+
+# Reads the pdos files of a pdos calculation aggregated by element, orbital and j (see pdos_utils.py), with the
+# absolute energies in eV. The pdos files are named <filpdos>.pdos_atm#..., where filpdos is the name of the compound.
+# The result is kept in memory as long as the pdos files do not change.
+def read_pdos(pdos_dir, filpdos, pdos_cache_dir, number_of_threads=8):
+
+    pdos_file_dir_list, _ = find_pdos_files(pdos_dir, filpdos)
+    if len(pdos_file_dir_list) == 0:
+        raise FileNotFoundError(f"No pdos files found in {pdos_dir}")
+
+    pdos_total_dir = find_pdos_total_file(pdos_dir, filpdos)
+    key = ("read_pdos", os.path.abspath(pdos_dir), filpdos, get_pdos_files_signature(pdos_file_dir_list + [pdos_total_dir]))
+
+    if key not in result_cache:
+        result = aggregate_pdos(pdos_dir, filpdos, pdos_cache_dir, number_of_threads)
+        for value in result.values():
+            value.flags.writeable = False
+        result_cache[key] = result
+
+    return result_cache[key]
+
+
+# PLOTTING
+# ============================================================================================================================
+
+# Plots the projected band structure of the projections read with read_projections, e.g. ["Mo-d", "S-pz", "S-px"], with
+# the same subplots and colors as plot_pbands.py. Only the weights of the projections are summed from the arrays in
+# memory, so plotting other projections does not read anything again. Returns the figure.
+def plot_projected_bands(projections, projection_list, fermi_energy=0.0, spin_orbit=False, raster=False,
+    energy_window=(-3.0, 3.0), title=None):
+
+    # matplotlib is only imported when plotting, since importing it is slow
+    from plot_utils import plot_projected_band_structure
+
+    atomic_projection_indices_info = resolve_atomic_projection_indices(projections["header"],
+        [projection.split("-") for projection in projection_list])
+    projection_weights = {projection: np.sum(projections["weights"][:, :, np.array(states, dtype=int) - 1], axis=2)
+        for projection, states in atomic_projection_indices_info.items()}
+
+    energies = projections["energies"] - fermi_energy
+
+    return plot_projected_band_structure(title if title is not None else "Projected Band Structure",
+        projections["k_points"], energies.T, projections["k_points"], energies, projection_weights, spin_orbit, raster,
+        energy_window)
+
+
+# Plots the projected density of states read with read_pdos for the selections, e.g. ["Mo", "S-p", "Mo-d_j2.5"], over
+# the total density of states, like plot_pdos.py. Returns the figure.
+def plot_pdos(aggregated_pdos, selections, fermi_energy=0.0, energy_window=(-3.0, 3.0), title=None):
+
+    # matplotlib is only imported when plotting, since importing it is slow
+    from plot_utils import plot_pdos_figure
+
+    shifted_pdos = dict(aggregated_pdos, energies=aggregated_pdos["energies"] - fermi_energy)
+
+    return plot_pdos_figure(title if title is not None else "Projected Density of States", shifted_pdos, selections,
+        energy_window)
+
+
+# WANNIER MODEL
+# ============================================================================================================================
+
+# Reads the tight-binding Hamiltonian written by Wannier90 (_hr.dat, with write_hr = true), or its compact .npz
+# version written by hr_convert.py (see wannier_utils.py), whose threshold and cutoff show whether it was truncated
+@memoize_by_file
+def read_wannier_model(hamiltonian_dir):
+
+    if hamiltonian_dir.endswith(".npz"):
+        return read_compact_model(hamiltonian_dir)
+
+    return read_hr_file(hamiltonian_dir)
+
+
+# RESULTS STORE
+# ============================================================================================================================
+
+# Queries the columnar store of the results of all the projects written by results_store.py (see store_utils.py),
+# e.g. qic.query_results(["formula", "band_gap"], spin_orbit=False, where={"band_gap": lambda gap: gap > 1.0}).
+# The store changes whenever results are appended, so the results are not kept in memory.
+def query_results(columns=None, compounds=None, spin_orbit=None, where=None, root_dir="../"):
+    return query_store(os.path.join(os.path.abspath(root_dir), "results_store"), columns, compounds, spin_orbit, where)
@@ -0,0 +1,357 @@
+import os
+import re
+import csv
+import math
+from statistics import median
+from qe_xml import bohr_to_angstrom
+from file_utils import find_file, open_file
+
+
+# Utilities for estimating the size of the calculations from the input files of pw.x and choosing their parallelization.
+# The estimates of the memory and the wall time are calibrated with the outputs harvested by qe_timings.py.
+# These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The parameters of the SYSTEM namelist which are used for the estimates
+pw_input_regex_info = {
+    "ecutwfc": re.compile(r"^\s*ecutwfc\s*=\s*([\d.]+)", re.MULTILINE),
+    "ecutrho": re.compile(r"^\s*ecutrho\s*=\s*([\d.]+)", re.MULTILINE),
+    "number_of_bands": re.compile(r"^\s*nbnd\s*=\s*(\d+)", re.MULTILINE),
+    "spin_orbit": re.compile(r"^\s*noncolin\s*=\s*\.true\.", re.MULTILINE | re.IGNORECASE),
+    "smearing": re.compile(r"^\s*occupations\s*=\s*'smearing'", re.MULTILINE | re.IGNORECASE)
+}
+
+k_points_card_regex_object = re.compile(r"^K_POINTS\s*\{?\s*(\w+)", re.MULTILINE)
+cell_parameters_card_regex_object = re.compile(r"^CELL_PARAMETERS\s*\{?\s*(\w+)", re.MULTILINE)
+
+# The number of k-points printed by pw.x, after the symmetry reduction
+pw_output_k_points_regex_object = re.compile(r"number of k points=\s+(\d+)")
+
+# The prime factors allowed in the dimensions of the FFT grid
+fft_factors = (2, 3, 5)
+
+# The number of valence electrons in a UPF file (version 2 and version 1)
+valence_charge_regex_object = re.compile(r'z_valence\s*=\s*"\s*([-+.\dEe]+)\s*"|^\s*([-+.\dEe]+)\s+Z valence',
+    re.MULTILINE | re.IGNORECASE)
+
+
+# Reads the parameters of a pw.x input which determine the size of the calculation: the cutoffs (in Ry), the number
+# of bands (None if it is not given), whether it is a spin-orbit calculation, the lattice vectors (in angstrom) and
+# the number of k-points. The number of k-points of automatic meshes is estimated, since pw.x reduces them by symmetry.
+def read_pw_input(pw_input):
+
+    pw_input_info = dict()
+    for key, regex_object in pw_input_regex_info.items():
+        match = regex_object.search(pw_input)
+        if key in ("spin_orbit", "smearing"):
+            pw_input_info[key] = match is not None
+        elif key == "number_of_bands":
+            pw_input_info[key] = int(match.group(1)) if match is not None else None
+        else:
+            pw_input_info[key] = float(match.group(1)) if match is not None else None
+
+    # The default cutoff of the charge density
+    if pw_input_info["ecutrho"] is None and pw_input_info["ecutwfc"] is not None:
+        pw_input_info["ecutrho"] = 4 * pw_input_info["ecutwfc"]
+
+    pw_input_lines = pw_input.splitlines()
+
+    cell_parameters_match = cell_parameters_card_regex_object.search(pw_input)
+    pw_input_info["lattice_vectors"] = None
+    if cell_parameters_match is not None:
+        first_line = pw_input[:cell_parameters_match.start()].count("\n") + 1
+        lattice_vectors = [[float(value) for value in line.split()[:3]]
+            for line in pw_input_lines[first_line:first_line + 3]]
+
+        if cell_parameters_match.group(1).lower() == "bohr":
+            lattice_vectors = [[value * bohr_to_angstrom for value in vector] for vector in lattice_vectors]
+        pw_input_info["lattice_vectors"] = lattice_vectors
+
+    pw_input_info["number_of_k_points"], pw_input_info["k_points_estimated"] = count_k_points(pw_input)
+
+    return pw_input_info
+
+
+# Counts the points of a Monkhorst-Pack mesh (with the shifts of the K_POINTS card) which are irreducible under
+# time-reversal symmetry alone: the points equal to their inverse (k = -k up to a reciprocal lattice vector) plus half
+# of the others. Along a direction with n points, 2 points are their own inverse for an even unshifted n, none for an
+# even shifted n and 1 for an odd n, e.g. 4 of the 16 points of a 4x4x1 mesh, which has 10 irreducible points.
+def count_irreducible_mesh_points(mesh, shifts=(0, 0, 0)):
+
+    number_of_self_inverse_points = math.prod((2 if not shift else 0) if n % 2 == 0 else 1
+        for n, shift in zip(mesh, shifts))
+
+    return (math.prod(mesh) + number_of_self_inverse_points) // 2
+
+
+# Counts the k-points of the K_POINTS card of a pw.x input. Returns the number of k-points and whether it is only
+# an estimate. pw.x reduces automatic meshes by symmetry, which is not known before the run. They are assumed to be
+# reduced only by time-reversal symmetry, which overestimates the number of k-points of symmetric structures.
+def count_k_points(pw_input):
+
+    k_points_match = k_points_card_regex_object.search(pw_input)
+    if k_points_match is None:
+        return 1, False
+
+    k_points_type = k_points_match.group(1).lower()
+    first_line = pw_input[:k_points_match.start()].count("\n") + 1
+    k_points_lines = pw_input.splitlines()[first_line:]
+
+    if k_points_type == "gamma":
+        return 1, False
+
+    if k_points_type == "automatic":
+        mesh_values = [int(value) for value in k_points_lines[0].split()[:6]]
+        return count_irreducible_mesh_points(mesh_values[:3], mesh_values[3:] or (0, 0, 0)), True
+
+    number_of_listed_k_points = int(k_points_lines[0].split()[0])
+
+    # The band structure paths have the number of points of every segment in the last column
+    if k_points_type.endswith("_b"):
+        segment_lengths = [int(float(line.split()[3])) for line in k_points_lines[1:number_of_listed_k_points]]
+        return sum(segment_lengths) + 1, False
+
+    return number_of_listed_k_points, False
+
+
+# Reads the number of k-points of a finished (or running) pw.x calculation, or None if there is no output
+def read_number_of_k_points(pw_output_dir):
+
+    if find_file(pw_output_dir) is None:
+        return None
+
+    with open_file(pw_output_dir, "r") as pw_output_file:
+        for line in pw_output_file:
+            match = pw_output_k_points_regex_object.search(line)
+            if match is not None:
+                return int(match.group(1))
+
+    return None
+
+
+# Finds the smallest FFT dimension which is at least the given one and has only the allowed prime factors
+def get_good_fft_dimension(dimension):
+
+    while True:
+        remainder = dimension
+        for factor in fft_factors:
+            while remainder % factor == 0:
+                remainder //= factor
+
+        if remainder == 1:
+            return dimension
+        dimension += 1
+
+
+# Estimates the dense FFT grid of pw.x from the lattice vectors (in angstrom) and the cutoff of the charge density
+# (in Ry), in the same way as pw.x: nr = 2 * int(sqrt(ecutrho) * |a| / 2pi) + 1 with |a| in bohr, rounded up to a
+# dimension with small prime factors.
+def estimate_fft_grid(lattice_vectors, ecutrho):
+
+    fft_grid = []
+    for lattice_vector in lattice_vectors:
+        length = math.sqrt(sum(value**2 for value in lattice_vector)) / bohr_to_angstrom
+        fft_grid.append(get_good_fft_dimension(2 * int(math.sqrt(ecutrho) * length / (2 * math.pi)) + 1))
+
+    return fft_grid
+
+
+# Reads the number of irreducible q-points of a phonon calculation from the fildyn0 file written by ph.x (the q-point
+# mesh on the first line and the number of q-points on the second), or None if it does not exist yet
+def read_number_of_q_points(dyn0_dir):
+
+    if find_file(dyn0_dir) is None:
+        return None
+
+    with open_file(dyn0_dir, "r") as dyn0_file:
+        dyn0_lines = dyn0_file.read().splitlines()
+
+    return int(dyn0_lines[1].split()[0]) if len(dyn0_lines) > 1 else None
+
+
+# Estimates the number of irreducible q-points of a q-point mesh before ph.x has reduced it by symmetry, in the same
+# way as the k-points of automatic meshes (only by time-reversal symmetry, so it is an upper bound)
+def estimate_number_of_q_points(q_mesh):
+    return count_irreducible_mesh_points(q_mesh)
+
+
+# Splits the q-points into the given number of jobs of consecutive q-points with almost the same size.
+# Returns the first and the last q-point (start_q and last_q of ph.x, starting from 1) of every job.
+def split_q_points(number_of_q_points, number_of_jobs):
+
+    number_of_jobs = max(1, min(number_of_jobs, number_of_q_points))
+    bounds = [job_index * number_of_q_points // number_of_jobs for job_index in range(number_of_jobs + 1)]
+
+    return [(bounds[job_index] + 1, bounds[job_index + 1]) for job_index in range(number_of_jobs)]
+
+
+# Gets the divisors of a number in increasing order
+def get_divisors(number):
+    return [divisor for divisor in range(1, number + 1) if number % divisor == 0]
+
+
+# Chooses the parallelization of a pw.x calculation on the given number of MPI processes, following the guidelines of
+# the Quantum ESPRESSO user guide:
+#
+# - The k-points are distributed over as many pools (-nk) as possible, since they scale almost perfectly, as long as
+#   no pool gets more than 25% extra k-points compared to a perfect balance.
+# - The plane waves of a pool are distributed over the planes of the FFT grid along the third lattice vector. If a
+#   pool has more processes than planes, the FFTs are done by task groups (-nt, at most 4) and then the bands are
+#   distributed over band groups (-nb).
+# - The subspace diagonalization is only parallelized (-nd, a square number) for many bands (64 per row of the
+#   process grid), since it is slower than the serial one for small matrices. It is serial if nbnd is not given.
+#
+# Returns the number of pools, band groups, task groups and processes of the diagonalization.
+def choose_parallelization(number_of_processes, number_of_k_points, number_of_bands, fft_grid):
+
+    number_of_pools = 1
+    for divisor in get_divisors(number_of_processes):
+        if divisor > number_of_k_points:
+            break
+        if math.ceil(number_of_k_points / divisor) * divisor <= 1.25 * number_of_k_points:
+            number_of_pools = divisor
+
+    processes_per_pool = number_of_processes // number_of_pools
+    number_of_planes = fft_grid[2]
+
+    number_of_task_groups = 1
+    for divisor in get_divisors(processes_per_pool):
+        if divisor > 4:
+            break
+        number_of_task_groups = divisor
+        if processes_per_pool <= number_of_planes * divisor:
+            break
+
+    number_of_band_groups = 1
+    for divisor in get_divisors(processes_per_pool // number_of_task_groups):
+        if number_of_bands is not None and divisor > number_of_bands:
+            break
+        number_of_band_groups = divisor
+        if processes_per_pool <= number_of_planes * number_of_task_groups * divisor:
+            break
+
+    processes_per_band_group = processes_per_pool // number_of_band_groups
+    diagonalization_size = 1
+    if number_of_bands is not None:
+        diagonalization_size = min(math.isqrt(processes_per_band_group), number_of_bands // 64)
+
+    return {
+        "npool": number_of_pools,
+        "nbgrp": number_of_band_groups,
+        "ntg": number_of_task_groups,
+        "ndiag": max(diagonalization_size, 1)**2
+    }
+
+
+# Reads the number of valence electrons of a pseudopotential file, or None if it cannot be read
+def read_valence_charge(upf_dir):
+
+    try:
+        with open(upf_dir, "r", errors="replace") as upf_file:
+            match = valence_charge_regex_object.search(upf_file.read())
+    except OSError:
+        return None
+
+    if match is None:
+        return None
+
+    return float(match.group(1) or match.group(2))
+
+
+# Gets the number of bands which pw.x uses if nbnd is not given
+def get_default_number_of_bands(number_of_electrons, spin_orbit, smearing):
+
+    # The bands of spin-orbit calculations hold one electron each
+    number_of_occupied_bands = math.ceil(number_of_electrons / (1 if spin_orbit else 2))
+
+    if smearing:
+        return max(round(1.2 * number_of_occupied_bands), number_of_occupied_bands + 4)
+
+    return number_of_occupied_bands
+
+
+# Calculates the volume of the cell in bohr^3 from the lattice vectors in angstrom
+def get_cell_volume(lattice_vectors):
+
+    a, b, c = lattice_vectors
+    volume = a[0] * (b[1] * c[2] - b[2] * c[1]) - a[1] * (b[0] * c[2] - b[2] * c[0]) + a[2] * (b[0] * c[1] - b[1] * c[0])
+
+    return abs(volume) / bohr_to_angstrom**3
+
+
+# Estimates the size of a pw.x calculation (the volume in bohr^3 and the cutoff in Ry):
+#
+# - The number of plane waves of the wavefunctions, volume * ecutwfc^(3/2) / (6 pi^2).
+# - The memory of the wavefunctions of a k-point in MB (twice as many components with spin-orbit coupling).
+# - The memory per process in MB: the wavefunctions, their buffer and the Davidson workspace (3 arrays of twice the
+#   number of bands) and about 10 arrays on the dense FFT grid are distributed over the processes of a pool, while the
+#   reduced Davidson matrices are not.
+# - The relative cost, proportional to the number of FFTs (one per k-point and band) times their cost.
+def estimate_resources(volume, ecutwfc, fft_grid, number_of_bands, number_of_k_points, spin_orbit, processes_per_pool):
+
+    number_of_plane_waves = volume * ecutwfc**1.5 / (6 * math.pi**2)
+    number_of_components = 2 if spin_orbit else 1
+    number_of_fft_points = math.prod(fft_grid)
+
+    wavefunction_memory = 16 * number_of_plane_waves * number_of_components * number_of_bands / 1024**2
+    fft_memory = 10 * 8 * number_of_fft_points / 1024**2
+    subspace_memory = 3 * 16 * (2 * number_of_bands)**2 / 1024**2
+
+    return {
+        "number_of_plane_waves": round(number_of_plane_waves),
+        "wavefunction_memory_mb": wavefunction_memory,
+        "ram_per_process_mb": (8 * wavefunction_memory + fft_memory) / processes_per_pool + subspace_memory,
+        "relative_cost": number_of_k_points * number_of_bands * number_of_components * number_of_fft_points
+            * math.log2(number_of_fft_points) / 1e9
+    }
+
+
+# Gets the name of a step of the calculations from the name of its output, without the name of the compound,
+# e.g. "_scf_soc.pw.out", so the runs of the same step of different compounds are compared
+def get_step_name(output_filename, compound_name):
+    return output_filename[len(compound_name):] if output_filename.startswith(compound_name) else output_filename
+
+
+# Calibrates the estimates with the pw.x runs harvested by qe_timings.py: the wall time per unit of relative cost on
+# one core (for every step and for all the steps together) and the ratio of the memory printed by pw.x to the
+# estimated one. Returns None if there are no finished runs to calibrate with.
+def read_calibration(timings_dir):
+
+    if not os.path.exists(timings_dir):
+        return None
+
+    time_factors_info = dict()
+    memory_factors = []
+
+    with open(timings_dir, "r", newline="") as timings_file:
+        for row in csv.DictReader(timings_file):
+            if row.get("program") != "PWSCF" or row.get("job_done") != "True":
+                continue
+
+            try:
+                fft_grid = [int(n) for n in row["fft_grid"].split("x")]
+                processes_per_pool = int(row["mpi_processes"]) // int(row["npool"] or 1)
+                resources = estimate_resources(float(row["volume"]), float(row["ecutwfc"]), fft_grid,
+                    int(row["number_of_bands"]), int(row["number_of_k_points"]), row["spin_orbit"] == "True",
+                    processes_per_pool)
+                wall_time = float(row["wall_time"]) * int(row["cores"])
+            except (KeyError, ValueError):
+                continue
+
+            step_name = get_step_name(row["file"], row["compound"])
+            time_factors_info.setdefault(step_name, []).append(wall_time / resources["relative_cost"])
+            time_factors_info.setdefault(None, []).append(wall_time / resources["relative_cost"])
+
+            if row.get("ram_per_process_mb"):
+                memory_factors.append(float(row["ram_per_process_mb"]) / resources["ram_per_process_mb"])
+
+    if len(time_factors_info) == 0:
+        return None
+
+    return {
+        "time_factors": {step_name: median(factors) for step_name, factors in time_factors_info.items()},
+        "memory_factor": median(memory_factors) if len(memory_factors) > 0 else 1.0,
+        "number_of_runs": len(time_factors_info[None])
+    }
@@ -0,0 +1,196 @@
+import os
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from store_utils import read_store_manifest, append_rows, query_store, compact_store
+from analysis_utils import collect_results
+from file_utils import list_compound_names, get_process_context
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python results_store.py [<compound name> ...] [--store DIR] [--by element|orbital|atom] [--parallel [N]] [--batch N]
+# python results_store.py --query [COLUMN ...] [--compounds NAME ...] [--soc | --no-soc] [--where CONDITION ...]
+# python results_store.py --compact
+#
+# Collects the results of the given compounds, or of all the compounds in the root directory if none is given, into
+# one columnar store (the results_store directory in the root directory by default), with one row per compound and
+# spin-orbit flag: the structure of the scf input (formula, number of atoms, volume, fingerprint, lattice vectors and
+# fractional positions), the Fermi energy, the bands (relative to the Fermi energy) and their gaps, the projected
+# weights of the bands summed per element, orbital of every element (default) or orbital of every atom, and the
+# spreads, centres and hoppings of the Wannier functions. The rows are appended to the store as a new chunk after every
+# batch of N compounds (--batch, 64 by default), so the memory stays bounded and an interrupted run keeps the finished
+# batches. The rows of compounds collected again supersede their older rows. --compact rewrites the store without the
+# superseded rows. The compounds are collected in parallel with --parallel.
+#
+# With --query, the given columns (the columns with one value per row if none is given) of the rows satisfying the
+# conditions (e.g. "band_gap>1.5" or "formula==MoS2") are printed, which only reads these columns and rows. The
+# arrays (e.g. the bands) and aggregate analyses are available from Python with qic.query_results.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# A condition of --query, e.g. band_gap>1.5, and the comparisons of its operators
+condition_regex_object = re.compile(r"^\s*(\w+)\s*(==|!=|<=|>=|<|>)\s*(.+?)\s*$")
+comparison_functions = {"==": np.equal, "!=": np.not_equal, "<=": np.less_equal, ">=": np.greater_equal, "<": np.less,
+    ">": np.greater}
+
+
+# Gets the function of a condition of --query, which gives the rows of the values of its column satisfying it and the
+# previous condition on the same column, if any
+def get_condition(operator, value, previous_condition=None):
+
+    if previous_condition is None:
+        return lambda values: comparison_functions[operator](values, value)
+
+    return lambda values: previous_condition(values) & comparison_functions[operator](values, value)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Collects the results of the projects into one columnar store.")
+parser.add_argument("compound_names", nargs="*", metavar="compound_name",
+    help="the names of the compounds to collect (all the compounds if none is given)")
+parser.add_argument("--store", default=None, metavar="DIR",
+    help="the directory of the store (default: results_store in the root directory of the projects)")
+parser.add_argument("--by", choices=["element", "orbital", "atom"], default="orbital",
+    help="sum the projected weights by element, by orbital of every element (default) or by orbital of every atom")
+parser.add_argument("--parallel", type=int, nargs="?", const=os.cpu_count(), default=None, metavar="N",
+    help="collect the compounds with N processes (all cores if N is not given)")
+parser.add_argument("--batch", type=int, default=64, metavar="N",
+    help="append the rows to the store after every N compounds (default: 64)")
+parser.add_argument("--compact", action="store_true", help="rewrite the store without the superseded rows")
+parser.add_argument("--query", nargs="*", default=None, metavar="COLUMN",
+    help="print the given columns of the store instead of collecting (the columns with one value per row by default)")
+parser.add_argument("--compounds", nargs="+", default=None, metavar="NAME", help="only query the given compounds")
+parser.add_argument("--soc", action=argparse.BooleanOptionalAction, default=None,
+    help="only query the rows with (--soc) or without (--no-soc) spin-orbit coupling")
+parser.add_argument("--where", nargs="+", default=[], metavar="CONDITION",
+    help="only query the rows satisfying all the conditions, e.g. band_gap>1.5 or formula==MoS2")
+args = parser.parse_args()
+
+if args.parallel is not None and args.parallel < 1:
+    parser.error("the number of processes of --parallel must be at least 1")
+if args.batch < 1:
+    parser.error("the number of compounds of --batch must be at least 1")
+
+print("Initializing...\n", flush=True)
+
+root_dir = os.path.abspath("../")  # The root directory of the projects
+store_dir = args.store if args.store is not None else os.path.join(root_dir, "results_store")
+
+# QUERYING THE STORE
+# ============================================================================================================================
+
+if args.query is not None:
+
+    manifest = read_store_manifest(store_dir)
+    if len(manifest["chunks"]) == 0:
+        print(f"ERROR: The store {store_dir} is empty.")
+        exit(1)
+
+    columns = args.query if len(args.query) > 0 else [column for column, info in manifest["columns"].items()
+        if not info["ragged"]]
+
+    # The values of the conditions are compared as numbers, unless the column has strings
+    where = dict()
+    for condition in args.where:
+        condition_match = condition_regex_object.match(condition)
+        if condition_match is None or condition_match.group(1) not in manifest["columns"]:
+            print(f"ERROR: The condition {condition} is not of the form <column><operator><value> with one of the \
+columns of the store.")
+            exit(1)
+
+        column, operator, value = condition_match.groups()
+        if np.dtype(manifest["columns"][column]["dtype"]).kind != "U":
+            value = float(value) if value.lower() not in ("true", "false") else value.lower() == "true"
+
+        where[column] = get_condition(operator, value, where.get(column))
+
+    try:
+        results = query_store(store_dir, columns, args.compounds, args.soc, where)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
+    # The columns with an array per row are printed as the shapes of the arrays
+    print("\t".join(results))
+    for i in range(len(results["compound"])):
+        print("\t".join(f"{'x'.join(str(n) for n in values[i].shape) or 'scalar'}" if isinstance(values, list)
+            else f"{values[i]:.6g}" if isinstance(values[i], np.floating) else str(values[i])
+            for values in results.values()))
+
+    print(f"\n{len(results['compound'])} rows.")
+    exit(0)
+
+# COMPACTING THE STORE
+# ============================================================================================================================
+
+if args.compact:
+
+    print(f"Compacting {store_dir}...")
+    number_of_rows = compact_store(store_dir)
+    print(f"Done. The store has {number_of_rows} rows in one chunk.")
+    exit(0)
+
+# COLLECTING THE RESULTS
+# ============================================================================================================================
+
+# Taking all the project directories if no compound is given, except for the directory of the toolkit itself and the
+# store
+compound_names = args.compound_names
+if len(compound_names) == 0:
+    compound_names = list_compound_names(root_dir, exclude=[store_dir])
+
+print(f"Collecting the results of {len(compound_names)} compounds\
+{f' with {args.parallel} processes' if args.parallel is not None else ''} into {store_dir}, {args.batch} at a time...\n",
+    flush=True)
+
+if args.parallel is not None:
+    executor = ProcessPoolExecutor(max_workers=args.parallel, mp_context=get_process_context())
+
+print(f"{'compound':<20} {'SOC':>4} {'atoms':>6} {'bands':>6} {'k-points':>9} {'projections':>12} {'wannier':>8}")
+
+# The rows are appended to the store as a new chunk after every batch of compounds, so only one batch is kept in
+# memory and the rows of the finished batches are kept if the run is interrupted
+number_of_rows = 0
+chunk_names = []
+for batch_start in range(0, len(compound_names), args.batch):
+    batch_names = compound_names[batch_start:batch_start + args.batch]
+    batch_dirs = [os.path.join(root_dir, name) for name in batch_names]
+
+    rows = []
+    if args.parallel is None:
+        for compound_dir, compound_name in zip(batch_dirs, batch_names):
+            rows += collect_results(compound_dir, compound_name, args.by)
+    else:
+        for compound_rows in executor.map(collect_results, batch_dirs, batch_names, [args.by] * len(batch_names),
+            chunksize=max(1, min(16, len(batch_names) // args.parallel))):
+            rows += compound_rows
+
+    # Printing what was found for every compound
+    for row in rows:
+        if "error" in row:
+            print(f"{row['compound']:<20} {'yes' if row['spin_orbit'] else 'no':>4}  {row['error']}")
+            continue
+
+        print(f"{row['compound']:<20} {'yes' if row['spin_orbit'] else 'no':>4} {row.get('number_of_atoms', '-'):>6} \
+{row.get('number_of_bands', '-'):>6} {row.get('number_of_k_points', '-'):>9} \
+{'yes' if 'projected_weights' in row else 'no':>12} {row.get('number_of_wannier_functions', '-'):>8}")
+
+    if len(rows) > 0:
+        chunk_names.append(append_rows(store_dir, rows))
+        number_of_rows += len(rows)
+        print(f"Appended {len(rows)} rows to {chunk_names[-1]} ({batch_start + len(batch_names)} of \
+{len(compound_names)} compounds done).", flush=True)
+
+if args.parallel is not None:
+    executor.shutdown()
+
+if number_of_rows == 0:
+    print("\nNo results were found. Nothing was written.")
+    exit(0)
+
+print(f"\nDone. {number_of_rows} rows were appended to {store_dir} ({', '.join(chunk_names)}).")
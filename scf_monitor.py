@@ -0,0 +1,297 @@
+import os
+import argparse
+import re
+import math
+import time
+from file_utils import open_file
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python scf_monitor.py <pw.x output> [--abort] [--interval S] [--window N] [--patience N] [--maxstep N] [--stall N]
+#                         [--replay]
+#
+# Follows a running pw.x calculation by reading only the lines appended to its output since the last check. For every
+# SCF iteration, the trend of the "estimated scf accuracy" over the last iterations is fitted to estimate the number
+# of iterations left, and the run is flagged if it is stagnating, oscillating or would not converge within
+# electron_maxstep iterations, together with a suggestion for the mixing parameters. The monitoring stops when the run
+# finishes, stops with an error ("Error in routine") or when its output has not grown for --stall checks (e.g. after
+# an MPI abort or a kill by the job scheduler).
+#
+# With --abort, a flagged run is stopped cleanly by creating the <prefix>.EXIT file (with the prefix of the input file
+# next to the output) in the directory of the output, which pw.x checks after every iteration. With --replay, a recorded output is read from the
+# start to the end without waiting, to test the criteria on finished (or failed) runs.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Monitors the SCF convergence of a running pw.x calculation.")
+parser.add_argument("pw_output_dir", metavar="pw_output", help="the standard output of pw.x")
+parser.add_argument("--abort", action="store_true",
+    help="stop the run cleanly (with the <prefix>.EXIT file) when it is flagged")
+parser.add_argument("--interval", type=float, default=10.0, metavar="S",
+    help="check the output for new lines every S seconds (default: 10)")
+parser.add_argument("--window", type=int, default=10, metavar="N",
+    help="fit the trend of the accuracy over the last N iterations (default: 10)")
+parser.add_argument("--patience", type=int, default=10, metavar="N",
+    help="flag the run after N consecutive iterations without progress (default: 10)")
+parser.add_argument("--maxstep", type=int, default=600, metavar="N",
+    help="the electron_maxstep of the run (default: 600, as in the generated inputs)")
+parser.add_argument("--stall", type=int, default=360, metavar="N",
+    help="stop monitoring when the output has not grown for N checks, e.g. after a crash (default: 360, 0 to never stop)")
+parser.add_argument("--replay", action="store_true",
+    help="read a recorded output from the start to the end without waiting")
+args = parser.parse_args()
+
+pw_output_dir = args.pw_output_dir
+
+# The minimum decrease of the accuracy (in decades per iteration) of a converging run
+stagnation_slope = 0.02
+
+# The fraction of the iterations in the window in which the accuracy increases for an oscillating run
+oscillation_fraction = 0.4
+
+# The lines of the output which are followed
+output_regex_info = {
+    "conv_thr": re.compile(r"convergence threshold\s+=\s+([\d.Ee+-]+)"),
+    "mixing_beta": re.compile(r"mixing beta\s+=\s+([\d.]+)"),
+    "mixing": re.compile(r"number of iterations used\s+=\s+(\d+)\s+(\S+)\s+mixing"),
+    "iteration": re.compile(r"iteration #\s*(\d+)\s+ecut=\s*[\d.]+\s+Ry\s+beta=\s*([\d.]+)"),
+    "accuracy": re.compile(r"estimated scf accuracy\s+<\s+([\d.Ee+-]+)\s+Ry"),
+    "converged": re.compile(r"convergence has been achieved in\s+(\d+) iterations"),
+    "not_converged": re.compile(r"convergence NOT achieved"),
+    "error": re.compile(r"Error in routine\s+(\S+)\s*\(\s*(-?\d+)\s*\)"),
+    "job_done": re.compile(r"JOB DONE")
+}
+
+# The state of the SCF cycle which is followed. A relaxation starts a new cycle for every ionic step.
+scf_info = {
+    "conv_thr": None,
+    "mixing_beta": None,
+    "mixing_ndim": None,
+    "mixing_mode": None,
+    "cycle": 0,
+    "iteration": 0,
+    "accuracies": [],
+    "iterations_without_progress": 0,
+    "flagged": False,
+    "finished": False
+}
+
+# ANALYZING THE CONVERGENCE
+# ============================================================================================================================
+
+# Fits a line to the logarithm of the accuracy over the last iterations and classifies the convergence.
+# Returns the slope (in decades per iteration), the estimated number of iterations left (None if the accuracy does not
+# decrease) and whether the run is "converging", "stagnating" or "oscillating".
+def analyze_convergence(accuracies, conv_thr, window):
+
+    log_accuracies = [get_log_accuracy(accuracy) for accuracy in accuracies[-window:]]
+    number_of_points = len(log_accuracies)
+    if number_of_points < 3:
+        return None, None, "converging"
+
+    mean_x = (number_of_points - 1) / 2
+    mean_y = sum(log_accuracies) / number_of_points
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(log_accuracies)) \
+        / sum((x - mean_x)**2 for x in range(number_of_points))
+
+    iterations_left = None
+    if slope < 0 and conv_thr is not None:
+        iterations_left = max(0, round((get_log_accuracy(conv_thr) - log_accuracies[-1]) / slope))
+
+    # Only judging the run once the window is full, since the first iterations are often irregular
+    increases = sum(1 for previous, current in zip(log_accuracies, log_accuracies[1:]) if current > previous)
+    if number_of_points < window:
+        verdict = "converging"
+    elif increases >= oscillation_fraction * (number_of_points - 1):
+        verdict = "oscillating"
+    elif slope > -stagnation_slope:
+        verdict = "stagnating"
+    else:
+        verdict = "converging"
+
+    return slope, iterations_left, verdict
+
+# Computes the decimal logarithm of the accuracy, which can be printed as 0 when it is very small
+def get_log_accuracy(accuracy):
+    return math.log10(max(accuracy, 1e-99))
+
+# Suggests changes of the mixing parameters for a run which does not converge
+def suggest_mixing(verdict):
+
+    mixing_beta = scf_info["mixing_beta"] if scf_info["mixing_beta"] is not None else 0.7
+
+    if verdict == "oscillating":
+        suggestion = f"reduce mixing_beta to {mixing_beta / 2:.2f}"
+        if scf_info["mixing_mode"] != "local-TF":
+            suggestion += " and try mixing_mode = 'local-TF' for inhomogeneous systems such as slabs"
+        return suggestion
+
+    suggestion = f"increase mixing_ndim to {max(12, 2 * (scf_info['mixing_ndim'] or 8))}"
+    if mixing_beta < 0.5:
+        suggestion += f" or increase mixing_beta to {min(0.7, 1.5 * mixing_beta):.2f}"
+    return suggestion + ", or restart with a larger degauss or a better starting density"
+
+# Finds the <prefix>.EXIT file of a run, which makes pw.x stop cleanly when it is found in the working directory.
+# The prefix is read from the input file next to the output, and the working directory is the directory of the output,
+# where the job scripts run.
+def get_exit_file_dir(pw_output_dir):
+
+    pw_input_dir = f"{re.sub(r'[.]out$', '', pw_output_dir)}.in"
+    prefix = "pwscf"  # The default prefix of pw.x
+
+    if os.path.exists(pw_input_dir):
+        with open(pw_input_dir, "r") as pw_input_file:
+            prefix_match = re.search(r"^\s*prefix\s*=\s*'([^']*)'", pw_input_file.read(), re.MULTILINE)
+        if prefix_match is not None:
+            prefix = prefix_match.group(1)
+
+    return os.path.join(os.path.dirname(os.path.abspath(pw_output_dir)), f"{prefix}.EXIT")
+
+# Stops the run cleanly by creating its <prefix>.EXIT file
+def abort_run():
+
+    exit_file_dir = get_exit_file_dir(pw_output_dir)
+    with open(exit_file_dir, "w"):
+        pass
+
+    print(f"Created {exit_file_dir}. pw.x will stop cleanly after the current iteration.", flush=True)
+
+# Updates the state of the SCF cycle with a line of the output and reports the new iterations
+def process_line(line):
+
+    for key, regex_object in output_regex_info.items():
+        match = regex_object.search(line)
+        if match is None:
+            continue
+
+        if key == "conv_thr":
+            scf_info["conv_thr"] = float(match.group(1))
+
+        elif key == "mixing_beta":
+            scf_info["mixing_beta"] = float(match.group(1))
+
+        elif key == "mixing":
+            scf_info["mixing_ndim"] = int(match.group(1))
+            scf_info["mixing_mode"] = match.group(2)
+
+        elif key == "iteration":
+            iteration = int(match.group(1))
+
+            # The first iteration of every ionic step of a relaxation starts a new SCF cycle
+            if iteration == 1:
+                scf_info["cycle"] += 1
+                scf_info["accuracies"] = []
+                scf_info["iterations_without_progress"] = 0
+                scf_info["flagged"] = False
+            scf_info["iteration"] = iteration
+            scf_info["mixing_beta"] = float(match.group(2))
+
+        elif key == "accuracy":
+            scf_info["accuracies"].append(float(match.group(1)))
+            report_iteration()
+
+        elif key == "converged":
+            print(f"Cycle {scf_info['cycle']} converged in {match.group(1)} iterations.", flush=True)
+
+        elif key == "not_converged":
+            print(f"Cycle {scf_info['cycle']} did NOT converge.", flush=True)
+            scf_info["finished"] = True
+
+        elif key == "error":
+            print(f"The run stopped with an error in routine {match.group(1)} (code {match.group(2)}). See the \
+%%%% block of the output.", flush=True)
+            scf_info["finished"] = True
+
+        elif key == "job_done":
+            print("The run has finished.", flush=True)
+            scf_info["finished"] = True
+
+        break
+
+# Analyzes the convergence after a new iteration, prints it and flags (or aborts) the run if needed
+def report_iteration():
+
+    slope, iterations_left, verdict = analyze_convergence(scf_info["accuracies"], scf_info["conv_thr"], args.window)
+
+    slope_text = "" if slope is None else f"{slope:+.3f} decades/iteration"
+    left_text = "" if iterations_left is None else f"~{iterations_left} iterations left"
+    print(f"cycle {scf_info['cycle']:>3}  iteration {scf_info['iteration']:>4}  accuracy \
+{scf_info['accuracies'][-1]:.3e} Ry  {slope_text:<24} {left_text:<22} {verdict}", flush=True)
+
+    # A converging run which would need more than electron_maxstep iterations makes no progress either
+    too_slow = iterations_left is not None and scf_info["iteration"] + iterations_left > args.maxstep
+    if verdict != "converging" or too_slow:
+        scf_info["iterations_without_progress"] += 1
+    else:
+        scf_info["iterations_without_progress"] = 0
+
+    if scf_info["iterations_without_progress"] < args.patience or scf_info["flagged"]:
+        return
+
+    scf_info["flagged"] = True
+    reason = f"would need more than electron_maxstep = {args.maxstep} iterations" if verdict == "converging" \
+        else f"has been {verdict} for {args.patience} iterations"
+
+    print(f"\nFLAGGED: cycle {scf_info['cycle']} of {os.path.basename(pw_output_dir)} {reason}.")
+    print(f"Suggestion: {suggest_mixing('oscillating' if verdict == 'oscillating' else 'stagnating')}.\n", flush=True)
+
+    if args.abort:
+        abort_run()
+
+# FOLLOWING THE OUTPUT
+# ============================================================================================================================
+
+print(f"Monitoring {pw_output_dir}...\n", flush=True)
+
+if args.replay:
+    with open_file(pw_output_dir, "r") as pw_output_file:
+        for line in pw_output_file:
+            process_line(line)
+
+else:
+
+    # Waiting for the run to start
+    while not os.path.exists(pw_output_dir):
+        time.sleep(args.interval)
+
+    # Reading only the bytes appended since the last check. An incomplete last line is kept until it is completed.
+    # A run killed by MPI or the scheduler leaves no message, so the monitoring stops when the output has not grown
+    # for --stall checks
+    output_offset = 0
+    incomplete_line = b""
+    checks_without_growth = 0
+
+    while not scf_info["finished"]:
+        with open(pw_output_dir, "rb") as pw_output_file:
+
+            # Starting again if the output was overwritten by a new run
+            if os.fstat(pw_output_file.fileno()).st_size < output_offset:
+                output_offset = 0
+                incomplete_line = b""
+
+            pw_output_file.seek(output_offset)
+            new_content = pw_output_file.read()
+            output_offset += len(new_content)
+
+        lines = (incomplete_line + new_content).split(b"\n")
+        incomplete_line = lines.pop()
+
+        for line in lines:
+            process_line(line.decode("utf-8", errors="replace"))
+
+        checks_without_growth = 0 if len(new_content) > 0 else checks_without_growth + 1
+        if args.stall > 0 and checks_without_growth >= args.stall and not scf_info["finished"]:
+            print(f"\nWARNING: {os.path.basename(pw_output_dir)} has not grown for {checks_without_growth * args.interval:g} \
+seconds. The run has probably crashed or been killed. Stopping the monitoring.", flush=True)
+            break
+
+        if not scf_info["finished"]:
+            time.sleep(args.interval)
+
+if scf_info["cycle"] == 0:
+    print("No SCF iterations found.")
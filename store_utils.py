@@ -0,0 +1,269 @@
+import os
+import json
+import shutil
+import numpy as np
+from file_utils import file_lock, write_file_atomically
+
+
+# Utilities for the columnar store of the results of all the projects, written by results_store.py and read e.g. with
+# qic.query_results. These are not meant to be run directly.
+#
+# The store is a directory with one subdirectory per appended chunk of rows and a manifest.json listing the chunks and
+# the columns. Every column of a chunk is a separate .npy file, so a query only reads the columns it needs, and the
+# files are memory-mapped, so only the rows it needs are read from the disk. The columns with one value per row
+# (numbers and strings) are stored as they are. The columns with an array per row (e.g. the bands) are stored as the
+# flattened arrays of all the rows one after the other (<column>.values.npy), the offsets of the rows in them
+# (<column>.offsets.npy) and the shapes of the arrays (<column>.shapes.npy).
+#
+# A row is identified by its compound and spin-orbit flag. Appending a row again supersedes the older one, which the
+# queries ignore until the store is compacted.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+manifest_filename = "manifest.json"
+
+
+# Reads the manifest of a store: the names of its chunks in the order they were appended and the columns, with their
+# type and whether they have an array per row
+def read_store_manifest(store_dir):
+
+    manifest_dir = os.path.join(store_dir, manifest_filename)
+    if not os.path.exists(manifest_dir):
+        return {"next_chunk": 1, "chunks": [], "columns": dict()}
+
+    with open(manifest_dir, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+# Converts the values of a column with one value per row to an array. Strings, booleans and integers keep their type
+# (missing strings are empty), and the other columns are stored as floats with NaN for the missing values.
+def get_scalar_column(values):
+
+    present_values = [value for value in values if value is not None]
+
+    if len(present_values) > 0 and all(isinstance(value, str) for value in present_values):
+        return np.array([value if value is not None else "" for value in values], dtype=str)
+
+    if len(present_values) == len(values):
+        if all(isinstance(value, (bool, np.bool_)) for value in values):
+            return np.array(values, dtype=bool)
+        if all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) for value in values):
+            return np.array(values, dtype=np.int64)
+
+    return np.array([value if value is not None else np.nan for value in values], dtype=float)
+
+
+# Writes the rows (dictionaries of the values of their columns, NumPy arrays for the columns with an array per row)
+# to a new chunk directory, with one .npy file per column. Returns the columns of the chunk for the manifest.
+def write_chunk(chunk_dir, rows):
+
+    os.makedirs(chunk_dir)
+
+    column_info = dict()
+    for column in dict.fromkeys(column for row in rows for column in row):
+        values = [row.get(column) for row in rows]
+
+        if not any(isinstance(value, np.ndarray) for value in values):
+            column_values = get_scalar_column(values)
+            np.save(os.path.join(chunk_dir, f"{column}.npy"), column_values)
+            column_info[column] = {"dtype": column_values.dtype.str, "ragged": False}
+            continue
+
+        # The missing arrays are stored as empty arrays with the same number of dimensions
+        arrays = [np.asarray(value) for value in values if value is not None]
+        dtype = np.result_type(*arrays)
+        number_of_dimensions = max(array.ndim for array in arrays)
+        arrays = [np.asarray(value, dtype=dtype) if value is not None else np.zeros((0,) * number_of_dimensions, dtype)
+            for value in values]
+
+        np.save(os.path.join(chunk_dir, f"{column}.values.npy"), np.concatenate([array.ravel() for array in arrays]))
+        np.save(os.path.join(chunk_dir, f"{column}.offsets.npy"),
+            np.concatenate([[0], np.cumsum([array.size for array in arrays])]).astype(np.int64))
+        np.save(os.path.join(chunk_dir, f"{column}.shapes.npy"),
+            np.array([array.shape for array in arrays], dtype=np.int64).reshape(len(arrays), number_of_dimensions))
+        column_info[column] = {"dtype": dtype.str, "ragged": True, "ndim": number_of_dimensions}
+
+    return column_info
+
+
+# Adds the columns of a chunk to the columns of the manifest. A column stored with different types in different
+# chunks gets the common type.
+def merge_column_info(manifest, column_info):
+
+    for column, info in column_info.items():
+        if column not in manifest["columns"]:
+            manifest["columns"][column] = info
+            continue
+
+        manifest_info = manifest["columns"][column]
+        manifest_info["dtype"] = np.result_type(np.dtype(manifest_info["dtype"]), np.dtype(info["dtype"])).str
+        if info["ragged"]:
+            manifest_info["ndim"] = max(manifest_info.get("ndim", 0), info["ndim"])
+
+
+# Appends rows to a store as a new chunk while holding the lock of its manifest, so concurrent runs do not lose
+# chunks. The chunk is written to a temporary directory and renamed once it is complete. Returns the name of the chunk.
+def append_rows(store_dir, rows):
+
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_dir = os.path.join(store_dir, manifest_filename)
+
+    with file_lock(manifest_dir):
+        manifest = read_store_manifest(store_dir)
+        chunk_name = f"chunk_{manifest['next_chunk']:06d}"
+        chunk_dir = os.path.join(store_dir, chunk_name)
+        temp_chunk_dir = os.path.join(store_dir, f"{chunk_name}.{os.getpid()}.tmp")
+
+        try:
+            column_info = write_chunk(temp_chunk_dir, rows)
+            os.rename(temp_chunk_dir, chunk_dir)
+        finally:
+            shutil.rmtree(temp_chunk_dir, ignore_errors=True)
+
+        manifest["next_chunk"] += 1
+        manifest["chunks"].append(chunk_name)
+        merge_column_info(manifest, column_info)
+        write_file_atomically(manifest_dir, json.dumps(manifest, indent=2) + "\n")
+
+    return chunk_name
+
+
+# Reads the values of a column with one value per row of a chunk at the given rows. The values of a column which the
+# chunk does not have are empty strings for strings and NaN otherwise.
+def read_chunk_column(chunk_dir, column, column_info, row_indices):
+
+    column_dir = os.path.join(chunk_dir, f"{column}.npy")
+    if not os.path.exists(column_dir):
+        if np.dtype(column_info["dtype"]).kind == "U":
+            return np.full(len(row_indices), "", dtype=column_info["dtype"])
+        return np.full(len(row_indices), np.nan)
+
+    return np.array(np.load(column_dir, mmap_mode="r")[row_indices])
+
+
+# Reads the arrays of a column with an array per row of a chunk at the given rows, reading only their part of the
+# flattened values. The arrays of a column which the chunk does not have are empty.
+def read_chunk_arrays(chunk_dir, column, column_info, row_indices):
+
+    values_dir = os.path.join(chunk_dir, f"{column}.values.npy")
+    if not os.path.exists(values_dir):
+        return [np.zeros((0,) * column_info["ndim"], dtype=column_info["dtype"]) for _ in row_indices]
+
+    values = np.load(values_dir, mmap_mode="r")
+    offsets = np.load(os.path.join(chunk_dir, f"{column}.offsets.npy"))
+    shapes = np.load(os.path.join(chunk_dir, f"{column}.shapes.npy"))
+
+    return [np.array(values[offsets[i]:offsets[i + 1]]).reshape(shapes[i]) for i in row_indices]
+
+
+# Queries a store: reads the given columns (all if None) of the rows of the given compounds (all if None) and
+# spin-orbit flag (both if None) which satisfy the conditions of where, a dictionary of columns with one value per row
+# and either the value they must have or a function of the array of their values returning which rows to keep, e.g.
+# {"metal": False, "band_gap": lambda band_gap: band_gap > 1.0}. Only the latest row of every compound and spin-orbit
+# flag is used. The key columns and the columns of the conditions are read first, and only the selected rows of the
+# other columns afterwards. Returns a dictionary of the columns, sorted by compound and spin-orbit flag, with an
+# array per column with one value per row and a list of arrays per column with an array per row.
+def query_store(store_dir, columns=None, compounds=None, spin_orbit=None, where=None):
+
+    manifest = read_store_manifest(store_dir)
+    column_infos = manifest["columns"]
+    where = dict() if where is None else where
+
+    columns = list(column_infos) if columns is None else list(dict.fromkeys(["compound", "spin_orbit"] + list(columns)))
+    for column in columns + list(where):
+        if column not in column_infos:
+            raise ValueError(f"The column {column} is not in the store {store_dir}.")
+    for column in where:
+        if column_infos[column]["ragged"]:
+            raise ValueError(f"The column {column} has an array per row and cannot be used in a condition.")
+
+    chunk_dirs = [os.path.join(store_dir, chunk_name) for chunk_name in manifest["chunks"]]
+    if len(chunk_dirs) == 0:
+        return {column: [] if column_infos.get(column, {}).get("ragged") else np.array([]) for column in columns}
+
+    # The rows of every chunk which are the latest of their compound and spin-orbit flag and satisfy the conditions
+    chunk_keys = []
+    chunk_masks = []
+    for chunk_dir in chunk_dirs:
+        compound_values = np.load(os.path.join(chunk_dir, "compound.npy"))
+        spin_orbit_values = np.load(os.path.join(chunk_dir, "spin_orbit.npy"))
+        chunk_keys.append(np.char.add(compound_values.astype(str), np.where(spin_orbit_values, "/soc", "")))
+
+        mask = np.ones(len(compound_values), dtype=bool)
+        if compounds is not None:
+            mask &= np.isin(compound_values, compounds)
+        if spin_orbit is not None:
+            mask &= spin_orbit_values == spin_orbit
+        for column, condition in where.items():
+            values = read_chunk_column(chunk_dir, column, column_infos[column], np.arange(len(mask)))
+            mask &= np.asarray(condition(values) if callable(condition) else values == condition, dtype=bool)
+        chunk_masks.append(mask)
+
+    # The last occurrence of every key is its first one in the reversed keys
+    all_keys = np.concatenate(chunk_keys)
+    _, reversed_indices = np.unique(all_keys[::-1], return_index=True)
+    latest = np.zeros(len(all_keys), dtype=bool)
+    latest[len(all_keys) - 1 - reversed_indices] = True
+    chunk_bounds = np.cumsum([0] + [len(keys) for keys in chunk_keys])
+
+    results = {column: [] for column in columns}
+    selected_keys = []
+    for i, chunk_dir in enumerate(chunk_dirs):
+        row_indices = np.flatnonzero(chunk_masks[i] & latest[chunk_bounds[i]:chunk_bounds[i + 1]])
+        if len(row_indices) == 0:
+            continue
+
+        selected_keys.append(chunk_keys[i][row_indices])
+        for column in columns:
+            if column_infos[column]["ragged"]:
+                results[column] += read_chunk_arrays(chunk_dir, column, column_infos[column], row_indices)
+            else:
+                results[column].append(read_chunk_column(chunk_dir, column, column_infos[column], row_indices))
+
+    order = np.argsort(np.concatenate(selected_keys), kind="stable") if len(selected_keys) > 0 else np.array([], int)
+    for column in columns:
+        if column_infos[column]["ragged"]:
+            results[column] = [results[column][i] for i in order]
+        else:
+            values = np.concatenate(results[column]) if len(results[column]) > 0 else np.array([])
+            results[column] = values[order]
+
+    return results
+
+
+# Compacts a store while holding the lock of its manifest: the latest rows are rewritten to a single chunk and the
+# superseded rows and the old chunks are removed
+def compact_store(store_dir):
+
+    manifest_dir = os.path.join(store_dir, manifest_filename)
+
+    with file_lock(manifest_dir):
+        manifest = read_store_manifest(store_dir)
+        results = query_store(store_dir)
+        number_of_rows = len(results["compound"]) if "compound" in results else 0
+
+        old_chunk_names = manifest["chunks"]
+        manifest["chunks"] = []
+        manifest["columns"] = dict()
+
+        if number_of_rows > 0:
+            rows = [{column: values[i] for column, values in results.items()} for i in range(number_of_rows)]
+            chunk_name = f"chunk_{manifest['next_chunk']:06d}"
+            temp_chunk_dir = os.path.join(store_dir, f"{chunk_name}.{os.getpid()}.tmp")
+
+            try:
+                manifest["columns"] = write_chunk(temp_chunk_dir, rows)
+                os.rename(temp_chunk_dir, os.path.join(store_dir, chunk_name))
+            finally:
+                shutil.rmtree(temp_chunk_dir, ignore_errors=True)
+
+            manifest["next_chunk"] += 1
+            manifest["chunks"].append(chunk_name)
+
+        write_file_atomically(manifest_dir, json.dumps(manifest, indent=2) + "\n")
+
+        for chunk_name in old_chunk_names:
+            shutil.rmtree(os.path.join(store_dir, chunk_name), ignore_errors=True)
+
+    return number_of_rows
@@ -0,0 +1,80 @@
+import os
+import argparse
+from file_utils import file_lock, find_file, open_file
+from structure_utils import read_poscar, read_pw_input_structure, get_structure_fingerprint, write_structure_index, \
+    find_duplicate_projects
+
+
+# Usage: the following python script should be run with command line arguments in the following way:
+#
+# python structure_index.py [<path-to-POSCAR-file> ...] [--rebuild]
+#
+# Prints the fingerprints of the structures in the given POSCAR files and the existing projects with the same
+# structure. The fingerprint does not depend on the names of the files, the order of the atoms, the origin or the
+# choice of the lattice vectors, so the same structure is recognized under different names. The structures of the
+# projects with the same fingerprint are compared with a tolerance on the distances between the atoms.
+#
+# The fingerprints of the projects are kept in structure_index.json in the root directory of the projects, which
+# init_calc.py updates for every new project and checks before creating one. With --rebuild, the index is created
+# again from the scf inputs of all the projects (e.g. for the projects created before the index existed).
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# INITIALIZATION
+# ============================================================================================================================
+
+parser = argparse.ArgumentParser(description="Finds the projects with the same structure as the given POSCAR files.")
+parser.add_argument("poscar_dirs", nargs="*", metavar="POSCAR", help="the POSCAR files to look up")
+parser.add_argument("--rebuild", action="store_true",
+    help="create the index again from the scf inputs of all the projects")
+args = parser.parse_args()
+
+root_dir = os.path.abspath("../")  # The root directory of the projects
+structure_index_dir = os.path.join(root_dir, "structure_index.json")
+
+# REBUILDING THE INDEX
+# ============================================================================================================================
+
+if args.rebuild:
+    print(f"Rebuilding {structure_index_dir}...\n", flush=True)
+
+    # The projects are the directories with an scf input written by init_calc.py. The links to other projects created
+    # for duplicate structures are skipped.
+    structure_index = dict()
+    for project_name in sorted(os.listdir(root_dir)):
+        project_dir = os.path.join(root_dir, project_name)
+        scf_input_dir = os.path.join(project_dir, "scf", f"{project_name}_scf.pw.in")
+        if os.path.islink(project_dir) or find_file(scf_input_dir) is None:
+            continue
+
+        with open_file(scf_input_dir, "r") as scf_input_file:
+            structure = read_pw_input_structure(scf_input_file.read())
+
+        if structure is None:
+            print(f"No structure found in {scf_input_dir}. Skipping {project_name}.")
+            continue
+
+        fingerprint = get_structure_fingerprint(structure["lattice_vectors"], structure["atomic_labels"],
+            structure["fractional_positions"])
+        structure_index.setdefault(fingerprint, []).append(project_name)
+        print(f"{fingerprint[:16]}  {project_name}")
+
+    with file_lock(structure_index_dir):
+        write_structure_index(structure_index_dir, structure_index)
+
+    number_of_projects = sum(len(project_names) for project_names in structure_index.values())
+    print(f"\nIndexed {number_of_projects} projects with {len(structure_index)} distinct structures.\n")
+
+# LOOKING UP THE STRUCTURES
+# ============================================================================================================================
+
+# The projects with the same fingerprint are only listed if their structure is the same within the tolerances
+for poscar_dir in args.poscar_dirs:
+    structure = read_poscar(poscar_dir)
+    fingerprint = get_structure_fingerprint(structure["lattice_vectors"], structure["atomic_labels"],
+        structure["fractional_positions"])
+
+    project_names = find_duplicate_projects(structure_index_dir, fingerprint, None, root_dir, structure)
+    matches = ", ".join(project_names) if len(project_names) > 0 else "no existing project"
+    print(f"{poscar_dir}: {fingerprint}\n  {matches}")
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import hashlib
+import itertools
+from collections import Counter
+import numpy as np
+from file_utils import file_lock, write_file_atomically, open_file, find_file
+
+
+# Utilities for reading crystal structures and recognizing the same structure under different names, atom orderings,
+# origins or lattice vectors. These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The radius (in angstrom) of the neighborhood of every atom in the fingerprint, and the tolerances of the distances
+# (in angstrom) and of the volume per atom (in cubic angstrom) when comparing structures
+fingerprint_cutoff = 6.0
+fingerprint_tolerance = 0.01
+fingerprint_volume_tolerance = 0.1
+
+# The cards of a pw.x input with the structure (in the format written by init_calc.py)
+cell_parameters_regex_object = re.compile(r"^CELL_PARAMETERS\s*\{?\s*angstrom", re.MULTILINE | re.IGNORECASE)
+atomic_positions_regex_object = re.compile(r"^ATOMIC_POSITIONS\s*\{?\s*crystal", re.MULTILINE | re.IGNORECASE)
+nat_regex_object = re.compile(r"^\s*nat\s*=\s*(\d+)", re.MULTILINE)
+
+
+# Reads the lattice vectors and the atomic positions of a POSCAR file (VASP 5 format, with the element names).
+# The lattice vectors and the cartesian positions are in angstrom. The file can be compressed (.gz, .xz or .zst).
+def read_poscar(poscar_dir):
+
+    with open_file(poscar_dir, "r") as poscar_file:
+        poscar_lines = [line.split() for line in poscar_file.read().splitlines()]
+
+    # A negative scaling factor is the volume of the cell
+    scaling_factor = float(poscar_lines[1][0])
+    lattice_vectors = np.array([line[:3] for line in poscar_lines[2:5]], dtype=float)
+    if scaling_factor < 0:
+        scaling_factor = (-scaling_factor / abs(np.linalg.det(lattice_vectors)))**(1 / 3)
+    lattice_vectors *= scaling_factor
+
+    if not poscar_lines[5][0].isalpha():
+        raise ValueError(f"The element names are missing in {poscar_dir}")
+
+    element_names = poscar_lines[5]
+    element_numbers = [int(number) for number in poscar_lines[6]]
+    atomic_labels = [name for name, number in zip(element_names, element_numbers) for _ in range(number)]
+
+    # Skipping the optional "Selective dynamics" line
+    coordinates_line = 7
+    if poscar_lines[coordinates_line][0][0] in "Ss":
+        coordinates_line += 1
+
+    positions = np.array([line[:3] for line in
+        poscar_lines[coordinates_line + 1:coordinates_line + 1 + len(atomic_labels)]], dtype=float)
+
+    if poscar_lines[coordinates_line][0][0] in "CcKk":
+        cartesian_positions = positions * scaling_factor
+        fractional_positions = np.linalg.solve(lattice_vectors.T, cartesian_positions.T).T
+    else:
+        fractional_positions = positions
+        cartesian_positions = fractional_positions @ lattice_vectors
+
+    return {
+        "comment": " ".join(poscar_lines[0]),
+        "lattice_vectors": lattice_vectors,
+        "element_names": element_names,
+        "element_numbers": element_numbers,
+        "atomic_labels": atomic_labels,
+        "fractional_positions": fractional_positions,
+        "cartesian_positions": cartesian_positions
+    }
+
+
+# Reads the lattice vectors (CELL_PARAMETERS angstrom), the atomic labels and the fractional positions
+# (ATOMIC_POSITIONS crystal) of a pw.x input written by init_calc.py. Returns None if they are not found.
+def read_pw_input_structure(pw_input):
+
+    nat_match = nat_regex_object.search(pw_input)
+    cell_parameters_match = cell_parameters_regex_object.search(pw_input)
+    atomic_positions_match = atomic_positions_regex_object.search(pw_input)
+    if nat_match is None or cell_parameters_match is None or atomic_positions_match is None:
+        return None
+
+    number_of_atoms = int(nat_match.group(1))
+    cell_parameters_lines = pw_input[cell_parameters_match.end():].splitlines()[1:4]
+    atomic_positions_lines = pw_input[atomic_positions_match.end():].splitlines()[1:number_of_atoms + 1]
+
+    return {
+        "lattice_vectors": np.array([line.split()[:3] for line in cell_parameters_lines], dtype=float),
+        "atomic_labels": [line.split()[0] for line in atomic_positions_lines],
+        "fractional_positions": np.array([line.split()[1:4] for line in atomic_positions_lines], dtype=float)
+    }
+
+
+# Finds the environment of every atom of a crystal structure: its element and the elements and distances (in
+# angstrom) of its neighbors within the cutoff, including the periodic images, sorted by element and distance. The
+# distances are calculated one atom at a time, so the memory does not grow with the square of the number of atoms.
+# Returns the volume per atom (which distinguishes e.g. different vacuum thicknesses of slabs) and the environments,
+# as tuples of the element, the elements of the neighbors and the array of their distances.
+def get_atomic_environments(lattice_vectors, atomic_labels, fractional_positions, cutoff=fingerprint_cutoff):
+
+    lattice_vectors = np.array(lattice_vectors, dtype=float)
+    cartesian_positions = (np.array(fractional_positions, dtype=float) % 1.0) @ lattice_vectors
+    volume_per_atom = abs(np.linalg.det(lattice_vectors)) / len(atomic_labels)
+
+    # The number of periodic images along every lattice vector needed to cover the cutoff, from the spacing of the
+    # lattice planes
+    plane_spacings = 1 / np.linalg.norm(np.linalg.inv(lattice_vectors), axis=0)
+    image_ranges = [range(-n, n + 1) for n in np.ceil(cutoff / plane_spacings).astype(int)]
+    image_translations = np.array(list(itertools.product(*image_ranges))) @ lattice_vectors
+
+    # The same neighbor at a distance of zero is the atom itself
+    atomic_labels = list(atomic_labels)
+    environments = []
+    for atom_index, atomic_label in enumerate(atomic_labels):
+        distances = np.linalg.norm(cartesian_positions[None, :, :] + image_translations[:, None, :]
+            - cartesian_positions[atom_index], axis=2)
+        image_indices, neighbor_indices = np.nonzero((distances > 1e-6) & (distances <= cutoff))
+
+        neighbors = sorted(zip((atomic_labels[index] for index in neighbor_indices),
+            distances[image_indices, neighbor_indices].tolist()))
+        environments.append((atomic_label, tuple(label for label, _ in neighbors),
+            np.array([distance for _, distance in neighbors])))
+
+    return {"volume_per_atom": volume_per_atom, "environments": environments}
+
+
+# Calculates a fingerprint of a crystal structure which does not depend on the order of the atoms, the origin or the
+# choice of the lattice vectors. Only the elements of every atom and of its neighbors within the cutoff are hashed
+# with SHA-256, so the fingerprint does not change with small differences of the positions (e.g. the number of
+# digits of the files). Structures with the same fingerprint are compared with is_same_structure.
+def get_structure_fingerprint(lattice_vectors, atomic_labels, fractional_positions, cutoff=fingerprint_cutoff):
+
+    environments = get_atomic_environments(lattice_vectors, atomic_labels, fractional_positions, cutoff)["environments"]
+    canonical_environments = sorted(Counter((atomic_label, tuple(sorted(Counter(neighbor_labels).items())))
+        for atomic_label, neighbor_labels, _ in environments).items())
+
+    return hashlib.sha256(repr(canonical_environments).encode("utf-8")).hexdigest()
+
+
+# Checks whether two structures (dictionaries of lattice_vectors, atomic_labels and fractional_positions, as read by
+# read_poscar and read_pw_input_structure) are the same: the volumes per atom and the distances of every environment
+# to the neighbors within the cutoff must agree within the tolerances, with a one-to-one matching of the atoms
+def is_same_structure(structure, other_structure, cutoff=fingerprint_cutoff, tolerance=fingerprint_tolerance,
+    volume_tolerance=fingerprint_volume_tolerance):
+
+    environments, other_environments = (get_atomic_environments(s["lattice_vectors"], s["atomic_labels"],
+        s["fractional_positions"], cutoff) for s in (structure, other_structure))
+
+    if abs(environments["volume_per_atom"] - other_environments["volume_per_atom"]) > volume_tolerance:
+        return False
+    if len(environments["environments"]) != len(other_environments["environments"]):
+        return False
+
+    # Every environment is matched to an unmatched environment of the other structure with the same elements and the
+    # same sorted distances within the tolerance
+    unmatched_environments = list(other_environments["environments"])
+    for atomic_label, neighbor_labels, distances in environments["environments"]:
+        for i, (other_atomic_label, other_neighbor_labels, other_distances) in enumerate(unmatched_environments):
+            if atomic_label == other_atomic_label and neighbor_labels == other_neighbor_labels \
+                and np.allclose(distances, other_distances, rtol=0, atol=tolerance):
+                del unmatched_environments[i]
+                break
+        else:
+            return False
+
+    return True
+
+
+# Reads the index of the structures of the projects, which maps the fingerprints to the names of the projects
+def read_structure_index(index_dir):
+
+    if not os.path.exists(index_dir):
+        return dict()
+
+    with open(index_dir, "r") as index_file:
+        return json.load(index_file)
+
+
+# Adds a project to the index of the structures while holding its lock, so concurrent runs do not lose entries.
+# A project is only listed under its latest fingerprint.
+def add_to_structure_index(index_dir, fingerprint, project_name):
+
+    with file_lock(index_dir):
+        structure_index = read_structure_index(index_dir)
+
+        for project_names in structure_index.values():
+            if project_name in project_names:
+                project_names.remove(project_name)
+
+        structure_index.setdefault(fingerprint, []).append(project_name)
+        write_structure_index(index_dir, structure_index)
+
+
+# Writes the index of the structures atomically, sorted so it can be compared between runs. The caller must hold its
+# lock.
+def write_structure_index(index_dir, structure_index):
+
+    structure_index = {key: sorted(value) for key, value in sorted(structure_index.items()) if len(value) > 0}
+    write_file_atomically(index_dir, json.dumps(structure_index, indent=2) + "\n")
+
+
+# Finds the existing projects with the same fingerprint, other than the given project. If the structure is given, only
+# the projects whose scf input has the same structure within the tolerances are kept (the projects without an scf
+# input are kept as they are).
+def find_duplicate_projects(index_dir, fingerprint, project_name, root_dir, structure=None):
+
+    project_names = [name for name in read_structure_index(index_dir).get(fingerprint, [])
+        if name != project_name and os.path.isdir(os.path.join(root_dir, name))]
+    if structure is None:
+        return project_names
+
+    duplicate_projects = []
+    for name in project_names:
+        scf_input_dir = find_file(os.path.join(root_dir, name, "scf", f"{name}_scf.pw.in"))
+        if scf_input_dir is None:
+            duplicate_projects.append(name)
+            continue
+
+        with open_file(scf_input_dir, "r") as scf_input_file:
+            project_structure = read_pw_input_structure(scf_input_file.read())
+
+        if project_structure is None or is_same_structure(structure, project_structure):
+            duplicate_projects.append(name)
+
+    return duplicate_projects
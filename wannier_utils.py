@@ -0,0 +1,245 @@
+import re
+import numpy as np
+from qe_xml import bohr_to_angstrom
+from file_utils import atomic_output, find_file, open_file, get_process_context
+
+
+# Utilities for the tight-binding models of Wannier90: reading the _hr.dat files and the spreads of the .wout files,
+# truncating the negligible hoppings, storing the models in a compact binary format and interpolating the bands.
+# These are not meant to be run directly.
+#
+# For more information visit the GitHub repository (https://github.com/shayanmoosavi/Quantum-Instant-Coffee.git)
+
+
+# The unit cell block of a Wannier90 input, in angstrom or in bohr
+unit_cell_regex_object = re.compile(r"^\s*begin\s+unit_cell_cart\s*\n(.*?)^\s*end\s+unit_cell_cart",
+    re.MULTILINE | re.DOTALL | re.IGNORECASE)
+
+# The centres and spreads of the Wannier functions and the decomposition of the total spread in a Wannier90 output
+# (.wout file), e.g. "WF centre and spread    1  (  0.000000,  1.822996,  3.074790 )     1.37649263"
+wannier_centre_regex_object = re.compile(r"WF centre and spread\s+\d+\s+\(\s*(\S+),\s*(\S+),\s*(\S+)\s*\)\s+(\S+)")
+spread_term_regex_object = re.compile(r"Omega\s+(I|D|OD|Total)\s*=\s*(\S+)")
+
+# The memory (in MB) of the Hamiltonians of one chunk of k-points in interpolate_wannier_bands_in_chunks
+chunk_memory = 64
+
+# The Wannier model of a worker process of interpolate_wannier_bands_in_chunks, which is sent only once per process
+worker_wannier_model = None
+
+
+# Reads the tight-binding Hamiltonian written by Wannier90 (_hr.dat, with write_hr = true).
+# The hoppings are in eV with one (number of wannier functions x number of wannier functions) matrix per lattice
+# vector R (in units of the lattice vectors), and the degeneracies are the weights of the lattice vectors.
+def read_hr_file(hamiltonian_dir):
+
+    with open_file(hamiltonian_dir, "r") as hamiltonian_file:
+        hamiltonian_file.readline()  # The date of the calculation
+        number_of_wannier_functions = int(hamiltonian_file.readline())
+        number_of_lattice_vectors = int(hamiltonian_file.readline())
+
+        # The degeneracies are written with 15 numbers per line
+        degeneracies = []
+        while len(degeneracies) < number_of_lattice_vectors:
+            degeneracies += [int(degeneracy) for degeneracy in hamiltonian_file.readline().split()]
+
+        hamiltonian_data = np.fromstring(hamiltonian_file.read(), sep=" ").reshape(-1, 7)
+
+    # The file has one block of lines per lattice vector, with the same order of the matrix elements in every block
+    hamiltonian_data = hamiltonian_data.reshape(number_of_lattice_vectors, -1, 7)
+    lattice_vectors = hamiltonian_data[:, 0, :3].astype(int)
+    rows = hamiltonian_data[0, :, 3].astype(int) - 1
+    columns = hamiltonian_data[0, :, 4].astype(int) - 1
+
+    hamiltonian = np.zeros((number_of_lattice_vectors, number_of_wannier_functions, number_of_wannier_functions),
+        dtype=complex)
+    hamiltonian[:, rows, columns] = hamiltonian_data[:, :, 5] + 1j * hamiltonian_data[:, :, 6]
+
+    return {
+        "number_of_wannier_functions": number_of_wannier_functions,
+        "lattice_vectors": lattice_vectors,
+        "degeneracies": np.array(degeneracies),
+        "hamiltonian": hamiltonian
+    }
+
+
+# Reads the unit cell (in angstrom) of a Wannier90 input (.win file), or None if it is not found
+def read_win_unit_cell(win_dir):
+
+    if find_file(win_dir) is None:
+        return None
+
+    with open_file(win_dir, "r") as win_file:
+        unit_cell_match = unit_cell_regex_object.search(win_file.read())
+    if unit_cell_match is None:
+        return None
+
+    unit_cell_lines = [line.split() for line in unit_cell_match.group(1).splitlines() if len(line.split()) > 0]
+    scale = 1.0
+    if len(unit_cell_lines[0]) == 1:
+        scale = bohr_to_angstrom if unit_cell_lines[0][0].lower().startswith("bohr") else 1.0
+        unit_cell_lines = unit_cell_lines[1:]
+
+    return scale * np.array([line[:3] for line in unit_cell_lines[:3]], dtype=float)
+
+
+# Reads the final centres (in angstrom) and spreads (in angstrom^2) of the Wannier functions and the terms of the total
+# spread (Omega I, D, OD and Total) of a Wannier90 output (.wout file). Returns None if the final state is not found,
+# e.g. if the calculation did not finish.
+def read_wout_spreads(wout_dir):
+
+    with open_file(wout_dir, "r") as wout_file:
+        wout_output = wout_file.read()
+
+    final_state_index = wout_output.rfind("Final State")
+    if final_state_index == -1:
+        return None
+    final_state = wout_output[final_state_index:]
+
+    centre_matches = wannier_centre_regex_object.findall(final_state)
+    spread_terms = {term: float(value) for term, value in spread_term_regex_object.findall(final_state)}
+    if len(centre_matches) == 0 or "Total" not in spread_terms:
+        return None
+
+    centres_and_spreads = np.array(centre_matches, dtype=float)
+
+    return {
+        "centres": centres_and_spreads[:, :3],
+        "spreads": centres_and_spreads[:, 3],
+        "omega_i": spread_terms.get("I"),
+        "omega_d": spread_terms.get("D"),
+        "omega_od": spread_terms.get("OD"),
+        "omega_total": spread_terms["Total"]
+    }
+
+
+# Drops the hoppings of a Wannier model smaller than the threshold (in eV) or between unit cells further apart than
+# the cutoff (the length of R in angstrom, which needs the unit cell). Both keep the Hamiltonian hermitian, since the
+# hoppings of R and -R are complex conjugates of each other. The lattice vectors without any hopping left are removed.
+# The threshold and the cutoff are kept in the truncated model, so its files record that it is truncated.
+def truncate_wannier_model(wannier_model, threshold=0.0, cutoff=None, unit_cell=None):
+
+    hamiltonian = wannier_model["hamiltonian"].copy()
+    hamiltonian[np.abs(hamiltonian) < threshold] = 0
+
+    if cutoff is not None:
+        distances = np.linalg.norm(wannier_model["lattice_vectors"] @ unit_cell, axis=1)
+        hamiltonian[distances > cutoff] = 0
+
+    kept_lattice_vectors = np.flatnonzero(np.any(hamiltonian != 0, axis=(1, 2)))
+
+    return {
+        "number_of_wannier_functions": wannier_model["number_of_wannier_functions"],
+        "lattice_vectors": wannier_model["lattice_vectors"][kept_lattice_vectors],
+        "degeneracies": wannier_model["degeneracies"][kept_lattice_vectors],
+        "hamiltonian": hamiltonian[kept_lattice_vectors],
+        "threshold": threshold,
+        "cutoff": cutoff
+    }
+
+
+# Checks whether hoppings of a Wannier model were dropped by truncate_wannier_model
+def is_truncated_model(wannier_model):
+    return wannier_model.get("threshold", 0.0) > 0 or wannier_model.get("cutoff") is not None
+
+
+# Writes a Wannier model to a compact binary .npz file with only its nonzero hoppings (the index of their lattice
+# vector, their row and column and their value) and the threshold and the cutoff of its truncation (0 and NaN if it
+# was not truncated), written atomically
+def write_compact_model(compact_model_dir, wannier_model):
+
+    lattice_vector_indices, rows, columns = np.nonzero(wannier_model["hamiltonian"])
+
+    with atomic_output(compact_model_dir) as temp_compact_model_dir:
+        with open(temp_compact_model_dir, "wb") as compact_model_file:
+            np.savez_compressed(compact_model_file,
+                number_of_wannier_functions=wannier_model["number_of_wannier_functions"],
+                lattice_vectors=wannier_model["lattice_vectors"].astype(np.int32),
+                degeneracies=wannier_model["degeneracies"].astype(np.int32),
+                lattice_vector_indices=lattice_vector_indices.astype(np.int32),
+                rows=rows.astype(np.int32),
+                columns=columns.astype(np.int32),
+                hoppings=wannier_model["hamiltonian"][lattice_vector_indices, rows, columns],
+                threshold=np.float64(wannier_model.get("threshold", 0.0)),
+                cutoff=np.float64(np.nan if wannier_model.get("cutoff") is None else wannier_model["cutoff"]))
+
+
+# Reads a Wannier model from a compact .npz file written by write_compact_model, with the threshold and the cutoff
+# of its truncation (0 and None if it was not truncated, also for the files written before they were recorded)
+def read_compact_model(compact_model_dir):
+
+    with np.load(compact_model_dir) as compact_model:
+        number_of_wannier_functions = int(compact_model["number_of_wannier_functions"])
+        lattice_vectors = compact_model["lattice_vectors"].astype(int)
+
+        hamiltonian = np.zeros((len(lattice_vectors), number_of_wannier_functions, number_of_wannier_functions),
+            dtype=complex)
+        hamiltonian[compact_model["lattice_vector_indices"], compact_model["rows"], compact_model["columns"]] = \
+            compact_model["hoppings"]
+
+        return {
+            "number_of_wannier_functions": number_of_wannier_functions,
+            "lattice_vectors": lattice_vectors,
+            "degeneracies": compact_model["degeneracies"].astype(int),
+            "hamiltonian": hamiltonian,
+            "threshold": float(compact_model["threshold"]) if "threshold" in compact_model else 0.0,
+            "cutoff": float(compact_model["cutoff"]) if "cutoff" in compact_model
+                and not np.isnan(compact_model["cutoff"]) else None
+        }
+
+
+# Calculates the Hamiltonian of a Wannier model at the given k-points (in crystal coordinates)
+def get_wannier_hamiltonian(wannier_model, k_points):
+
+    phases = np.exp(2j * np.pi * np.atleast_2d(k_points) @ wannier_model["lattice_vectors"].T) \
+        / wannier_model["degeneracies"]
+
+    return np.tensordot(phases, wannier_model["hamiltonian"], axes=1)
+
+
+# Calculates the bands of a Wannier model at the given k-points (in crystal coordinates), with one row per k-point
+def interpolate_wannier_bands(wannier_model, k_points):
+    return np.linalg.eigvalsh(get_wannier_hamiltonian(wannier_model, k_points))
+
+
+# Gets the number of k-points whose Hamiltonians (and the copies made by the diagonalization) fit in the given memory
+def get_chunk_size(number_of_wannier_functions, memory=chunk_memory):
+    return max(1, memory * 1024**2 // (3 * 16 * number_of_wannier_functions**2))
+
+
+# Sets the Wannier model of a worker process
+def set_worker_wannier_model(wannier_model):
+    global worker_wannier_model
+    worker_wannier_model = wannier_model
+
+
+# Calculates the bands of the Wannier model of a worker process at a chunk of k-points
+def interpolate_worker_chunk(k_points):
+    return interpolate_wannier_bands(worker_wannier_model, k_points)
+
+
+# Calculates the bands of a Wannier model at many k-points (e.g. a dense grid) in chunks of the given size, so the
+# memory of the Hamiltonians stays bounded. The chunks are distributed over a process pool if a number of processes is
+# given. Returns the energies with one row per k-point, in the order of the k-points.
+def interpolate_wannier_bands_in_chunks(wannier_model, k_points, chunk_size=None, number_of_processes=None):
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if chunk_size is None:
+        chunk_size = get_chunk_size(wannier_model["number_of_wannier_functions"])
+
+    chunk_bounds = range(0, len(k_points), chunk_size)
+    energies = np.empty((len(k_points), wannier_model["number_of_wannier_functions"]))
+
+    if number_of_processes is None:
+        for start in chunk_bounds:
+            energies[start:start + chunk_size] = interpolate_wannier_bands(wannier_model,
+                k_points[start:start + chunk_size])
+        return energies
+
+    with ProcessPoolExecutor(max_workers=number_of_processes, mp_context=get_process_context(),
+        initializer=set_worker_wannier_model, initargs=(wannier_model,)) as executor:
+        chunks = (k_points[start:start + chunk_size] for start in chunk_bounds)
+        for start, chunk_energies in zip(chunk_bounds, executor.map(interpolate_worker_chunk, chunks)):
+            energies[start:start + chunk_size] = chunk_energies
+
+    return energies